@@ -2,6 +2,6 @@
 import pointsbot
 
 try:
-    pointsbot.run()
+    pointsbot.main()
 except KeyboardInterrupt as e:
     print('\nShutting down...\n')
@@ -0,0 +1,451 @@
+"""A local stand-in for the parts of Reddit's API that the bot uses, for load and soak testing.
+
+Serves the endpoints that the bot (through PRAW) touches: logging in, `me`, the subreddit's details,
+moderators and comment listing (which is also what the comment stream polls), `info`, replying to a
+comment, and setting, listing and bulk-updating flair. New comments are generated at a steady rate,
+with the same mix of commands as the pipeline benchmark, and every response carries Reddit's
+rate-limit headers. Latency, errors and dropped connections can be added to any fraction of the
+requests, to test how the bot copes with a slow or flaky Reddit.
+
+Run from the project root, e.g.:
+
+    python -m benchmarks.fake_reddit --rate 20 --latency 0.05 --error-rate 0.01
+
+then point the bot at it, in the bot's config file:
+
+    [reddit]
+    oauth_url = "http://127.0.0.1:8081"
+    reddit_url = "http://127.0.0.1:8081"
+
+The subreddit in the bot's config has to match the fake subreddit's name (`--subreddit`). Any
+credentials are accepted. A summary of the requests served so far is at `/_fake/stats`.
+"""
+import argparse
+import http.server
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+from . import fakes
+
+### Globals ###
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8081
+
+# Reddit allows 600 requests per 10 minutes to OAuth clients
+DEFAULT_RATE_LIMIT = 600
+DEFAULT_RATE_LIMIT_WINDOW = 600
+
+# The statuses of injected errors, which PRAW treats as Reddit being down
+ERROR_STATUSES = (500, 502, 503, 504)
+
+# Maximum number of items in a page of a listing
+MAX_LISTING_LIMIT = 100
+
+### Main Function ###
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    mix = fakes.CommandMix(args.op_solved, args.mod_solved, args.mod_remove)
+    faults = Faults(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    drop_rate=args.drop_rate, rate_limit=args.rate_limit, rate_limit_window=args.rate_limit_window)
+    world = World(args.subreddit, comment_rate=args.rate, command_mix=mix, seed=args.seed)
+    with Server(world, faults, host=args.host, port=args.port) as server:
+        try:
+            server.join()
+        except KeyboardInterrupt:
+            pass
+    print(json.dumps(world.stats(), indent=2))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Serve a fake Reddit for the bot to run against.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to serve at (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to serve at (default: %(default)s)')
+    parser.add_argument('--subreddit', default='benchmark', help='name of the subreddit (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=5.0,
+                        help='new comments per second (default: %(default)s)')
+    parser.add_argument('--op-solved', type=float, default=fakes.DEFAULT_COMMAND_MIX.op_solved,
+                        help='fraction of comments with "!helped" (default: %(default)s)')
+    parser.add_argument('--mod-solved', type=float, default=fakes.DEFAULT_COMMAND_MIX.mod_solved,
+                        help='fraction of comments with "/helped" (default: %(default)s)')
+    parser.add_argument('--mod-remove', type=float, default=fakes.DEFAULT_COMMAND_MIX.mod_remove,
+                        help='fraction of comments with "/removepoint" (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each response (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random +/- seconds added to each response (default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests that get a 5xx error (default: %(default)s)')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='fraction of requests whose connection is closed without a response '
+                             '(default: %(default)s)')
+    parser.add_argument('--rate-limit', type=int, default=DEFAULT_RATE_LIMIT,
+                        help='requests allowed per rate-limit window (default: %(default)s)')
+    parser.add_argument('--rate-limit-window', type=int, default=DEFAULT_RATE_LIMIT_WINDOW,
+                        help='length of the rate-limit window, in seconds (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generating comments (default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser
+
+
+### Classes ###
+
+
+class Faults:
+    """What can go wrong with a request: latency, 5xx errors, dropped connections, and the rate limit."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0, rate_limit=DEFAULT_RATE_LIMIT,
+                 rate_limit_window=DEFAULT_RATE_LIMIT_WINDOW, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._used = 0
+
+    def delay(self):
+        return max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0)
+
+    def should_drop(self):
+        return self.rng.random() < self.drop_rate
+
+    def error_status(self):
+        """Return the status of the error to respond with, or None if there is no error."""
+        if self.rng.random() < self.error_rate:
+            return self.rng.choice(ERROR_STATUSES)
+        return None
+
+    def count_request(self):
+        """Count a request against the rate limit, and return the rate-limit headers for it, as
+        (used, remaining, seconds until reset).
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.rate_limit_window:
+                self._window_start = now
+                self._used = 0
+            self._used += 1
+            reset = self._window_start + self.rate_limit_window - now
+            return self._used, max(self.rate_limit - self._used, 0), max(int(reset), 0)
+
+
+class World:
+    """The fake subreddit: its submissions, comments, moderators and flair, and what has been done to
+    them, which the request handlers read and change under a lock.
+    """
+
+    def __init__(self, subreddit_name='benchmark', comment_rate=5.0, command_mix=fakes.DEFAULT_COMMAND_MIX,
+                 seed=0, **kwargs):
+        self.generator = fakes.CommentGenerator(command_mix, seed=seed, subreddit_name=subreddit_name, **kwargs)
+        self.subreddit = self.generator.subreddit
+        self.comment_rate = comment_rate
+        self.lock = threading.Lock()
+        # The comments, oldest first
+        self.comments = []
+        self._comment_indexes = {}
+        self.flair = {}
+        self.users = {redditor.name.lower(): redditor for redditor in self.generator.redditors}
+        self.counts = Counter()
+        self._start = time.time()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'uptime': time.time() - self._start,
+                'comments': len(self.comments),
+                'counts': dict(self.counts),
+            }
+
+    def generate_due_comments(self):
+        """Generate the comments that should have been posted by now. Must be called with the lock."""
+        due = int((time.time() - self._start) * self.comment_rate) - self.counts['generated']
+        for _ in range(due):
+            self.add_comment(self.generator.next_comment(created_utc=time.time()))
+            self.counts['generated'] += 1
+
+    def add_comment(self, comment):
+        self._comment_indexes[comment.fullname] = len(self.comments)
+        self.comments.append(comment)
+
+    def login(self, username):
+        """Return the redditor for the bot's account, creating it the first time."""
+        key = username.lower()
+        if key not in self.users:
+            self.users[key] = fakes.FakeRedditor(f'bot{len(self.users)}', username)
+        return self.users[key]
+
+    def get(self, fullname):
+        return self.generator.reddit._objects.get(fullname)
+
+    def comment_listing(self, limit, before=None, after=None):
+        """Return a page of the comments, newest first, like Reddit's listings: `before` gives the
+        comments just newer than the one given, and `after` the comments just older than it.
+        """
+        limit = min(limit, MAX_LISTING_LIMIT)
+        if before and before in self._comment_indexes:
+            start = self._comment_indexes[before] + 1
+            page = self.comments[start:start + limit]
+        elif after and after in self._comment_indexes:
+            end = self._comment_indexes[after]
+            page = self.comments[max(end - limit, 0):end]
+        else:
+            page = self.comments[-limit:]
+        page = page[::-1]
+        has_more = bool(page) and self._comment_indexes[page[-1].fullname] > 0
+        return page, page[-1].fullname if has_more else None
+
+    def reply(self, author, parent_fullname, body):
+        parent = self.get(parent_fullname)
+        if parent is None:
+            return None
+        submission = self.get(getattr(parent, 'link_id', parent.fullname))
+        comment = fakes.FakeComment(self.generator.reddit, f'r{fakes.to_base36(self.counts["replies"])}', body,
+                                    author, submission, parent, time.time())
+        self.generator.reddit.add(comment)
+        self.add_comment(comment)
+        self.counts['replies'] += 1
+        return comment
+
+    def set_flair(self, name, text, css_class):
+        self.flair[name.lower()] = (name, text or '', css_class or '')
+        self.counts['flair_updates'] += 1
+
+
+class Server(threading.Thread):
+    """Serves the fake Reddit in a background thread, handling each request in its own thread."""
+
+    def __init__(self, world, faults=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__(name='fake-reddit', daemon=True)
+        self.world = world
+        self.faults = faults or Faults()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake_reddit = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        logging.info('Serving a fake Reddit at %s', self.url)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.join()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def run(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        server = self.server.fake_reddit
+        world, faults = server.world, server.faults
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path.rstrip('/')
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8')
+            params.update((key, values[-1]) for key, values in urllib.parse.parse_qs(body).items())
+
+        # The stats aren't part of the fake Reddit, so nothing goes wrong with them
+        if path == '/_fake/stats':
+            self.send_json(200, world.stats())
+            return
+
+        time.sleep(faults.delay())
+        with world.lock:
+            world.counts['requests'] += 1
+        if faults.should_drop():
+            with world.lock:
+                world.counts['dropped'] += 1
+            self.close_connection = True
+            return
+        status = faults.error_status()
+        if status is not None:
+            with world.lock:
+                world.counts['errors'] += 1
+            self.send_json(status, {'message': 'Injected error', 'error': status})
+            return
+
+        used, remaining, reset = faults.count_request()
+        rate_limit_headers = {
+            'x-ratelimit-used': str(used),
+            'x-ratelimit-remaining': str(remaining),
+            'x-ratelimit-reset': str(reset),
+        }
+        if used > faults.rate_limit:
+            with world.lock:
+                world.counts['rate_limited'] += 1
+            self.send_json(429, {'message': 'Too Many Requests', 'error': 429}, rate_limit_headers)
+            return
+
+        with world.lock:
+            world.generate_due_comments()
+            response = route(world, method, path, params, self.headers)
+        if response is None:
+            self.send_json(404, {'message': 'Not Found', 'error': 404}, rate_limit_headers)
+        else:
+            self.send_json(200, response, rate_limit_headers)
+
+    def send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('Fake Reddit: %s - %s', self.address_string(), format % args)
+
+
+### Routing ###
+
+
+def route(world, method, path, params, headers):
+    """Return the response to the request, as an object to be sent as JSON, or None if there is no
+    such endpoint. Must be called with the world's lock.
+    """
+    subreddit_prefix = f'/r/{world.subreddit.display_name}'.lower()
+    lower_path = path.lower()
+
+    if path == '/api/v1/access_token' and method == 'POST':
+        world.counts['logins'] += 1
+        # The token is the bot's username, so that `me` knows who is asking
+        return {'access_token': params.get('username', 'anonymous'), 'token_type': 'bearer',
+                'expires_in': 3600, 'scope': '*'}
+    if path == '/api/v1/me':
+        me = world.login(bearer_token(headers))
+        return {'id': me.id, 'name': me.name, 'created_utc': 0.0, 'link_karma': 1, 'comment_karma': 1}
+    if path == '/api/info':
+        fullnames = [fullname for fullname in params.get('id', '').split(',') if fullname]
+        things = [world.get(fullname) for fullname in fullnames]
+        return listing([thing_json(thing) for thing in things if thing is not None])
+    if path == '/api/comment' and method == 'POST':
+        author = world.login(bearer_token(headers))
+        comment = world.reply(author, params.get('thing_id'), params.get('text', ''))
+        if comment is None:
+            return {'json': {'errors': [['NO_THING_ID', 'that item does not exist', 'parent']]}}
+        return {'json': {'errors': [], 'data': {'things': [thing_json(comment)]}}}
+    if path.startswith('/comments/'):
+        # A submission and its comments; only the submission is needed, e.g. for `comment.submission`
+        submission = world.get(f't3_{path.split("/")[2]}')
+        if submission is None:
+            return None
+        return [listing([thing_json(submission)]), listing([])]
+
+    if not lower_path.startswith(subreddit_prefix):
+        return None
+    subpath = lower_path[len(subreddit_prefix):]
+    if subpath == '/about':
+        return subreddit_json(world.subreddit)
+    if subpath == '/about/moderators':
+        return {'kind': 'UserList', 'data': {'children': [
+            {'name': mod.name, 'id': mod.fullname, 'date': 0.0, 'mod_permissions': ['all']}
+            for mod in world.subreddit._moderators
+        ]}}
+    if subpath == '/comments':
+        page, after = world.comment_listing(int(params.get('limit', 25)), before=params.get('before'),
+                                            after=params.get('after'))
+        return listing([thing_json(comment) for comment in page], after=after)
+    if subpath in ('/api/flair', '/api/selectflair') and method == 'POST':
+        world.set_flair(params.get('name', ''), params.get('text'), params.get('css_class'))
+        return {'json': {'errors': []}}
+    if subpath == '/api/flaircsv' and method == 'POST':
+        results = []
+        for line in params.get('flair_csv', '').splitlines():
+            name, text, css_class = (line.split(',') + ['', ''])[:3]
+            world.set_flair(name, text, css_class)
+            results.append({'ok': True, 'status': f'added flair for user {name}', 'errors': {}, 'warnings': {}})
+        return results
+    if subpath == '/api/flairlist':
+        return {'users': [{'user': name, 'flair_text': text, 'flair_css_class': css_class}
+                          for name, text, css_class in world.flair.values()]}
+    if subpath == '/api/user_flair_v2':
+        return []
+    return None
+
+
+def bearer_token(headers):
+    return headers.get('Authorization', '').partition(' ')[2]
+
+
+def listing(children, after=None):
+    return {'kind': 'Listing', 'data': {'children': children, 'after': after, 'before': None, 'dist': len(children)}}
+
+
+def thing_json(thing):
+    if isinstance(thing, fakes.FakeComment):
+        return {'kind': 't1', 'data': {
+            'id': thing.id,
+            'name': thing.fullname,
+            'body': thing.body,
+            'author': thing.author.name,
+            'author_fullname': thing.author_fullname,
+            'subreddit': thing.subreddit.display_name,
+            'link_id': thing.link_id,
+            'parent_id': thing.parent_id,
+            'is_submitter': thing.is_submitter,
+            'created_utc': thing.created_utc,
+            'replies': '',
+        }}
+    return {'kind': 't3', 'data': {
+        'id': thing.id,
+        'name': thing.fullname,
+        'title': thing.title,
+        'author': thing.author.name,
+        'author_fullname': thing.author_fullname,
+        'subreddit': thing.subreddit.display_name,
+        'selftext': '',
+        'is_self': True,
+    }}
+
+
+def subreddit_json(subreddit):
+    return {'kind': 't5', 'data': {
+        'id': subreddit.display_name,
+        'name': f't5_{subreddit.display_name}',
+        'display_name': subreddit.display_name,
+        'title': subreddit.title,
+    }}
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Synthetic stand-ins for the PRAW objects that the bot uses, and a generator for a stream of them.
+
+Only the attributes and methods that the bot actually touches are implemented. Anything that would
+make a request to Reddit sleeps for the configured latency instead.
+"""
+import itertools
+import random
+import time
+from collections import namedtuple
+
+### Data Structures ###
+
+# The fraction of generated comments that contain each command; the rest are ordinary comments
+CommandMix = namedtuple('CommandMix', 'op_solved mod_solved mod_remove')
+
+DEFAULT_COMMAND_MIX = CommandMix(op_solved=0.05, mod_solved=0.01, mod_remove=0.005)
+
+COMMAND_BODIES = {
+    'op_solved': 'Thanks, that fixed it! !helped',
+    'mod_solved': '/helped',
+    'mod_remove': '/removepoint',
+}
+
+ORDINARY_BODIES = [
+    'Have you tried turning it off and on again?',
+    'Which version are you running?',
+    'Same problem here, following.',
+    'Check the logs folder for a crash report.',
+]
+
+### Classes ###
+
+
+class Latency:
+    """Simulated request latency, in seconds."""
+
+    def __init__(self, mean=0.0, jitter=0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.num_requests = 0
+
+    def wait(self):
+        self.num_requests += 1
+        delay = self.mean + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeRedditor:
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.fullname = f't2_{id}'
+
+    def __str__(self):
+        return self.name
+
+
+class FakeSubmission:
+
+    def __init__(self, id, author, title, subreddit):
+        self.id = id
+        self.fullname = f't3_{id}'
+        self.author = author
+        self.author_fullname = author.fullname
+        self.title = title
+        self.subreddit = subreddit
+
+
+class FakeComment:
+
+    def __init__(self, reddit, id, body, author, submission, parent, created_utc):
+        self._reddit = reddit
+        self.id = id
+        self.fullname = f't1_{id}'
+        self.body = body
+        self.author = author
+        self.author_fullname = author.fullname
+        self.subreddit = submission.subreddit
+        self.link_id = submission.fullname
+        self.parent_id = parent.fullname
+        self.is_root = parent is submission
+        self.is_submitter = author is submission.author
+        self.created_utc = created_utc
+
+    def parent(self):
+        return self._reddit.info_one(self.parent_id)
+
+    @property
+    def submission(self):
+        return self._reddit.info_one(self.link_id)
+
+
+class FakeStream:
+
+    def __init__(self, comments):
+        self._comments = comments
+
+    def comments(self, skip_existing=False, pause_after=None):
+        """Yield the comments in windows of random size, separated by None (when pause_after is
+        given), as if they were arriving over time. Stops once every comment has been yielded.
+        """
+        comments = iter(self._comments)
+        while True:
+            window = list(itertools.islice(comments, random.randint(1, 100)))
+            if not window:
+                return
+            yield from window
+            if pause_after is not None:
+                yield None
+
+
+class FakeSubreddit:
+
+    def __init__(self, display_name, moderators, latency):
+        self.display_name = display_name
+        self.title = f'r/{display_name}'
+        self._moderators = moderators
+        self._latency = latency
+        self.stream = FakeStream([])
+
+    def moderator(self):
+        self._latency.wait()
+        return list(self._moderators)
+
+
+class FakeReddit:
+    """Keeps every generated object, so that they can be "fetched" by fullname."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._objects = {}
+        self._counts = {}
+
+    def new_id(self, prefix):
+        """Return an id that is unique among those with the prefix."""
+        count = self._counts.get(prefix, 0)
+        self._counts[prefix] = count + 1
+        return f'{prefix}{to_base36(count)}'
+
+    def add(self, thing):
+        self._objects[thing.fullname] = thing
+        return thing
+
+    def info(self, fullnames):
+        self.latency.wait()
+        return [self._objects[fullname] for fullname in fullnames if fullname in self._objects]
+
+    def info_one(self, fullname):
+        self.latency.wait()
+        return self._objects[fullname]
+
+
+class CommentGenerator:
+    """Generates a subreddit's comments, one at a time.
+
+    Every comment is a reply to a random submission, or to a random earlier comment on it. Commands
+    are posted by the submission's author (for "!helped") or by a moderator (for mod commands), in
+    reply to someone else's comment, so that they pass the bot's rules.
+    """
+
+    def __init__(self, command_mix=DEFAULT_COMMAND_MIX, num_submissions=200, num_redditors=500,
+                 num_moderators=5, latency=None, seed=0, subreddit_name='benchmark', reddit=None):
+        """Generators for several subreddits can share a `reddit`, so that it has all of their objects."""
+        self.command_mix = command_mix
+        self.rng = random.Random(seed)
+        self.reddit = reddit or FakeReddit(latency or Latency())
+
+        self.redditors = [FakeRedditor(to_base36(i + 1), f'user{i}') for i in range(num_redditors)]
+        self.moderators = self.redditors[:num_moderators]
+        self.subreddit = FakeSubreddit(subreddit_name, self.moderators, self.reddit.latency)
+        self.submissions = [
+            self.reddit.add(FakeSubmission(self.reddit.new_id('s'), self.rng.choice(self.redditors),
+                                           f'Problem {i}', self.subreddit))
+            for i in range(num_submissions)
+        ]
+        self._replies = {submission.fullname: [] for submission in self.submissions}
+        self._thresholds = list(itertools.accumulate(command_mix))
+        self._created_utc = time.time()
+
+    def next_comment(self, created_utc=None):
+        rng = self.rng
+        submission = rng.choice(self.submissions)
+        thread = self._replies[submission.fullname]
+        roll = rng.random()
+        command = next((name for name, threshold in zip(CommandMix._fields, self._thresholds) if roll < threshold),
+                       None)
+
+        # Commands need a parent comment by someone other than the OP
+        candidates = [comm for comm in thread[-50:] if comm.author is not submission.author]
+        if command and candidates:
+            parent = rng.choice(candidates)
+            author = submission.author if command == 'op_solved' else rng.choice(self.moderators)
+            body = COMMAND_BODIES[command]
+        else:
+            parent = rng.choice(thread) if thread and rng.random() < 0.5 else submission
+            author = rng.choice(self.redditors)
+            body = rng.choice(ORDINARY_BODIES)
+
+        if created_utc is None:
+            self._created_utc += rng.random()
+            created_utc = self._created_utc
+        comment = self.reddit.add(FakeComment(self.reddit, self.reddit.new_id('c'), body, author,
+                                              submission, parent, created_utc))
+        thread.append(comment)
+        return comment
+
+
+### Functions ###
+
+
+def generate(num_comments, command_mix=DEFAULT_COMMAND_MIX, latency=None, seed=0, **kwargs):
+    """Return a (reddit, subreddit, comments) tuple, with the subreddit's stream set to the comments.
+
+    The keyword arguments are passed on to CommentGenerator.
+    """
+    generator = CommentGenerator(command_mix, latency=latency, seed=seed, **kwargs)
+    comments = [generator.next_comment() for _ in range(num_comments)]
+    generator.subreddit.stream = FakeStream(comments)
+    return generator.reddit, generator.subreddit, comments
+
+
+def to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            return result
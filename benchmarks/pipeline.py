@@ -0,0 +1,201 @@
+"""End-to-end throughput benchmark for the bot's comment pipeline.
+
+Drives the real `bot.monitor_comments` loop (prefetching, rule checks, solver detection, database
+writes, reply building and the outbox) over a generated stream of fake comments, and reports the
+comments handled per second, the latency of each stage, and the number of SQLite statements run per
+comment. Nothing is sent to Reddit.
+
+Run from the project root, e.g.:
+
+    python -m benchmarks.pipeline --comments 20000 --latency 0.05 --output results.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import os.path
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from pointsbot import bot, config, database, journal, level, moderators, prefetch
+
+from . import fakes
+
+### Globals ###
+
+# The functions whose calls are timed, as (name, module, attribute name)
+STAGES = [
+    ('prefetch', prefetch, 'prefetch'),
+    ('classify', bot, 'classify'),
+    ('persist', bot, 'persist'),
+    ('make_reply', bot, 'make_reply'),
+    ('outbox', bot.outbox, 'add'),
+]
+
+LEVELS = [
+    level.Level('Novice', 1, None),
+    level.Level('Apprentice', 5, None),
+    level.Level('Journeyman', 15, None),
+    level.Level('Expert', 45, None),
+    level.Level('Master', 100, None),
+]
+
+### Main Function ###
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    mix = fakes.CommandMix(args.op_solved, args.mod_solved, args.mod_remove)
+    results = run(args.comments, mix, latency=fakes.Latency(args.latency, args.jitter), seed=args.seed)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nSaved results to {args.output}')
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the comment pipeline with fake comments.')
+    parser.add_argument('--comments', type=int, default=10000, help='number of comments (default: %(default)s)')
+    parser.add_argument('--op-solved', type=float, default=fakes.DEFAULT_COMMAND_MIX.op_solved,
+                        help='fraction of comments with "!helped" (default: %(default)s)')
+    parser.add_argument('--mod-solved', type=float, default=fakes.DEFAULT_COMMAND_MIX.mod_solved,
+                        help='fraction of comments with "/helped" (default: %(default)s)')
+    parser.add_argument('--mod-remove', type=float, default=fakes.DEFAULT_COMMAND_MIX.mod_remove,
+                        help='fraction of comments with "/removepoint" (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated seconds per Reddit request (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random +/- seconds added to each request (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generating comments (default: %(default)s)')
+    parser.add_argument('--output', help='file to save the results to, as JSON')
+    return parser
+
+
+### Functions ###
+
+
+def run(num_comments, command_mix, latency=None, seed=0):
+    """Run the benchmark, and return the results as a dict."""
+    latency = latency or fakes.Latency()
+    reddit, subreddit, comments = fakes.generate(num_comments, command_mix, latency=latency, seed=seed)
+    me = bot.Identity('0', 'PointsBot')
+    timings = defaultdict(list)
+    num_statements = 0
+
+    def count_statement(statement):
+        nonlocal num_statements
+        # Statements run by triggers are reported as comments
+        if not statement.startswith('--'):
+            num_statements += 1
+
+    clear_caches()
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = make_config(dirname, subreddit.display_name)
+        with database.Database(cfg.database_path) as db, timed_stages(timings):
+            db.conn.set_trace_callback(count_statement)
+            sender = NullSender()
+            start = time.perf_counter()
+            communities = [bot.Community(subreddit, db, cfg.levels, cfg)]
+            bot.monitor_comments(reddit, subreddit, communities, me, sender)
+            duration = time.perf_counter() - start
+            db.conn.set_trace_callback(None)
+            num_queued = len(db.get_due_outbox_items(num_comments, now=float('inf')))
+
+    return {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'database_version': str(database.Database.LATEST_VERSION),
+        'comments': num_comments,
+        'command_mix': command_mix._asdict(),
+        'latency': {'mean': latency.mean, 'jitter': latency.jitter},
+        'duration': duration,
+        'comments_per_sec': num_comments / duration,
+        'outbox_items': num_queued,
+        'requests': latency.num_requests,
+        'statements_per_comment': num_statements / num_comments,
+        'stages': {name: summarize(times) for name, times in timings.items()},
+    }
+
+
+def clear_caches():
+    """Empty the bot's in-memory caches, so that an earlier run can't affect the next one."""
+    prefetch.clear()
+    journal.clear()
+    moderators.invalidate()
+
+
+def make_config(dirname, subreddit_name='benchmark', levels=LEVELS):
+    """Return a config without credentials, whose database and log are in the given directory."""
+    return config.Config(os.path.join(dirname, 'pointsbot.toml'), subreddit_name, '', '', '', '', levels)
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'calls': len(times),
+        'total_ms': sum(times) * 1000,
+        'p50_ms': percentile(times, 50) * 1000,
+        'p99_ms': percentile(times, 99) * 1000,
+    }
+
+
+def percentile(sorted_values, percent):
+    index = round((len(sorted_values) - 1) * percent / 100)
+    return sorted_values[index]
+
+
+def print_results(results):
+    print(f'{results["comments"]} comments in {results["duration"]:.2f}s '
+          f'({results["comments_per_sec"]:.0f} comments/sec)')
+    print(f'{results["statements_per_comment"]:.2f} SQLite statements per comment, '
+          f'{results["requests"]} simulated requests, {results["outbox_items"]} outbox items')
+    print(f'\n{"stage":<12}{"calls":>8}{"p50 ms":>10}{"p99 ms":>10}{"total ms":>12}')
+    for name, stage in results['stages'].items():
+        print(f'{name:<12}{stage["calls"]:>8}{stage["p50_ms"]:>10.3f}{stage["p99_ms"]:>10.3f}'
+              f'{stage["total_ms"]:>12.1f}')
+
+
+class timed_stages:
+    """Context manager that records the duration of every call to each of the STAGES."""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self._originals = []
+
+    def __enter__(self):
+        for name, module, attr in STAGES:
+            original = getattr(module, attr)
+            self._originals.append((module, attr, original))
+            setattr(module, attr, self._timed(name, original))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for module, attr, original in reversed(self._originals):
+            setattr(module, attr, original)
+
+    def _timed(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timings[name].append(time.perf_counter() - start)
+        return timed
+
+
+class NullSender:
+    """Stands in for `outbox.Sender`; the queued items are only counted."""
+
+    def notify(self):
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
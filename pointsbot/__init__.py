@@ -1 +1,2 @@
 from .bot import run
+from .cli import main
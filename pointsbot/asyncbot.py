@@ -0,0 +1,378 @@
+"""An optional asynchronous engine for the bot, built on asyncpraw.
+
+Instead of handling one comment at a time, comments flow through separate stages, each connected to the
+next by bounded queues:
+
+    ingest -> classify -> persist (-> outbox) -> send
+
+so that e.g. a slow reply doesn't stop new comments from being read. The classify stage has several
+workers, and comments are assigned to workers by submission, so that commands for the same submission
+are always persisted in the order they were posted. The persist stage has a single worker, since the
+database can only be written by one connection at a time. It adds replies and flair updates to the
+outbox (see `outbox`), which the send stage's workers then send concurrently.
+
+The database is still the (synchronous) `database.Database`, but it is only ever used from a single
+dedicated thread, so that it never blocks the event loop. When the bot monitors several subreddits, their
+comments are read from a single combined stream, and each subreddit has its own database (and thread).
+"""
+import asyncio
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import asyncpraw
+    import asyncprawcore
+except ImportError:
+    asyncpraw = asyncprawcore = None
+
+from . import bot, database, journal, logs, metrics, moderators, outbox, prefetch
+
+### Globals ###
+
+# Errors from Reddit when sending an outbox item, which are retried or given up on (see `outbox`)
+if asyncpraw is not None:
+    REDDIT_ERRORS = (asyncpraw.exceptions.RedditAPIException, asyncprawcore.exceptions.AsyncPrawcoreException)
+else:
+    REDDIT_ERRORS = ()
+
+### Main Functions ###
+
+
+def run(cfg):
+    if asyncpraw is None:
+        raise RuntimeError('The async engine requires the asyncpraw package; install it with '
+                           '`pipenv install asyncpraw`, or use the "sync" engine')
+    # Checking a stale list would fetch the moderators synchronously, which asyncpraw can't do, so
+    # `refresh_moderators` is awaited before they are checked instead
+    moderators.configure(ttl=cfg.moderator_cache_ttl, refresh_on_check=False)
+    asyncio.run(run_async(cfg))
+
+
+async def run_async(cfg):
+    dbs = [AsyncDatabase(profile.database_path) for profile in cfg.profiles]
+    try:
+        for db in dbs:
+            await db.open()
+        # Run indefinitely, reconnecting any time a connection is lost
+        while True:
+            try:
+                async with connect(cfg) as reddit:
+                    me = await identify(reddit)
+                    logging.info('Connected to Reddit as %s', me.name)
+
+                    # Moderators may have changed while disconnected
+                    moderators.invalidate()
+                    communities = []
+                    for profile, db in zip(cfg.profiles, dbs):
+                        subreddit = await reddit.subreddit(profile.subreddit, fetch=True)
+                        logging.info('Watching subreddit %s', subreddit.title)
+                        await refresh_moderators(subreddit)
+                        is_mod = moderators.is_moderator(subreddit, me)
+                        logging.info(f'Is {"" if is_mod else "NOT "}moderator for subreddit')
+                        communities.append(bot.Community(subreddit, db, profile.levels, profile))
+
+                    # A single stream of every subreddit's comments
+                    subreddit = await reddit.subreddit('+'.join(profile.subreddit for profile in cfg.profiles))
+                    await Pipeline(reddit, subreddit, communities, cfg, me).run()
+
+            # Ignoring other potential exceptions for now, since we may not be able
+            # to recover from them as well as from these ones
+            except asyncprawcore.exceptions.RequestException as e:
+                metrics.RECONNECTS.inc(reason='request')
+                logging.error('Unable to connect to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Trying again')
+            except asyncprawcore.exceptions.ServerError as e:
+                metrics.RECONNECTS.inc(reason='server')
+                logging.error('Lost connection to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Attempting to reconnect')
+    finally:
+        for db in dbs:
+            await db.close()
+
+
+### Classes ###
+
+
+class AsyncDatabase:
+    """Runs calls to a `database.Database` in a single dedicated thread.
+
+    Since there is only the one thread, calls are run one at a time, in the order they were made.
+    """
+
+    def __init__(self, dbpath):
+        self.path = dbpath
+        self.db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+
+    async def open(self):
+        # The connection has to be created in the thread that will use it
+        self.db = await self._run_in_thread(database.Database, self.path)
+
+    async def close(self):
+        if self.db:
+            await self._run_in_thread(self.db.close)
+            self.db = None
+        self._executor.shutdown()
+
+    async def run(self, func, *args):
+        """Call func(db, *args) in the database thread, and return the result."""
+        return await self._run_in_thread(func, self.db, *args)
+
+    async def _run_in_thread(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+
+class Pipeline:
+
+    def __init__(self, reddit, subreddit, communities, cfg, me):
+        """`subreddit` is the combined subreddit of every community (e.g. "a+b"), and `cfg` the main
+        config, whose engine settings are used.
+        """
+        self.reddit = reddit
+        self.subreddit = subreddit
+        self.communities = {community.cfg.subreddit.lower(): community for community in communities}
+        self.cfg = cfg
+        self.me = me
+
+        num_workers = cfg.engine_workers
+        queue_size = cfg.engine_queue_size
+        self.classify_queues = [asyncio.Queue(queue_size) for _ in range(num_workers)]
+        self.persist_queue = asyncio.Queue(queue_size)
+        self.send_queues = [asyncio.Queue(queue_size) for _ in range(num_workers)]
+
+        # Set whenever there are new outbox items, and the (database path, rowid) of those currently
+        # being sent
+        self.outbox_changed = asyncio.Event()
+        self.sending = set()
+
+        # Read whenever the metrics are
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(queue.qsize() for queue in self.classify_queues),
+                                         queue='classify')
+        metrics.QUEUE_DEPTH.set_function(self.persist_queue.qsize, queue='persist')
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(queue.qsize() for queue in self.send_queues), queue='send')
+
+    async def run(self):
+        """Run every stage until one of them raises an exception."""
+        tasks = [
+            asyncio.create_task(self.ingest()),
+            *(asyncio.create_task(self.classify(queue)) for queue in self.classify_queues),
+            asyncio.create_task(self.persist()),
+            asyncio.create_task(self.dispatch()),
+            *(asyncio.create_task(self.send(queue)) for queue in self.send_queues),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shard(self, queues, key):
+        """Return the queue for the key, so that items with the same key are always handled by the
+        same worker, in order.
+        """
+        return queues[hash(key) % len(queues)]
+
+    def community(self, comm):
+        return self.communities[comm.subreddit.display_name.lower()]
+
+    ### Stages ###
+
+    async def ingest(self):
+        if self.cfg.catch_up:
+            for community in self.communities.values():
+                for comm in await self.find_missed_comments(community):
+                    await self.shard(self.classify_queues, comm.link_id).put(comm)
+
+        # As in `bot.monitor_comments`, the stream overlaps with the comments read before reconnecting,
+        # unless a journal is empty
+        skip_existing = False
+        for community in self.communities.values():
+            if await community.db.run(journal.newest) is None:
+                skip_existing = True
+        async for comm in self.subreddit.stream.comments(skip_existing=skip_existing):
+            metrics.observe_comments([comm])
+            community = self.community(comm)
+            if bot.find_commands(comm) and await community.db.run(journal.handled_ids, [comm]):
+                continue
+            await self.shard(self.classify_queues, comm.link_id).put(comm)
+
+    async def classify(self, queue):
+        while True:
+            # Take every comment that is already waiting, so that they can be prefetched together
+            window = [await queue.get()]
+            while len(window) < prefetch.BATCH_SIZE and not queue.empty():
+                window.append(queue.get_nowait())
+
+            with_commands = [comm for comm in window if bot.find_commands(comm)]
+            if with_commands:
+                await prefetch_async(self.reddit, with_commands)
+                for community in {self.community(comm) for comm in with_commands}:
+                    await refresh_moderators(community.subreddit)
+
+            for comm in window:
+                community = self.community(comm)
+                if bot.find_commands(comm) and not await self.load_context(comm):
+                    logging.warning('The parent or submission of comment %s was not found', comm.id)
+                    await community.db.run(journal.record, comm, 'rejected')
+                    queue.task_done()
+                    continue
+                command = bot.classify(comm, community.cfg, self.me)
+                if command:
+                    await self.persist_queue.put((community, command))
+                elif bot.find_commands(comm):
+                    await community.db.run(journal.record, comm, 'rejected')
+                queue.task_done()
+
+    async def persist(self):
+        while True:
+            community, command = await self.persist_queue.get()
+            start = time.perf_counter()
+            processed = await community.db.run(bot.persist_and_queue_replies, community.subreddit.display_name,
+                                               community.levels, community.cfg, command)
+            bot.log_comment(command.comment, command, processed, persist_ms=logs.elapsed_ms(start))
+            if processed:
+                self.outbox_changed.set()
+            self.persist_queue.task_done()
+
+    async def dispatch(self):
+        """Hand out outbox items that are due to the send workers."""
+        while True:
+            pending = 0
+            items = []
+            for community in self.communities.values():
+                await community.db.run(journal.prune)
+                pending += await community.db.run(database.Database.count_pending_outbox_items)
+                due = await community.db.run(database.Database.get_due_outbox_items, outbox.BATCH_SIZE)
+                items.extend((community.db, item) for item in due
+                             if (community.db.path, item['rowid']) not in self.sending)
+            metrics.QUEUE_DEPTH.set(pending, queue='outbox')
+            if not items:
+                try:
+                    await asyncio.wait_for(self.outbox_changed.wait(), outbox.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.outbox_changed.clear()
+                continue
+
+            for db, item in items:
+                self.sending.add((db.path, item['rowid']))
+                await self.shard(self.send_queues, item['target']).put((db, item))
+
+    async def send(self, queue):
+        while True:
+            db, item = await queue.get()
+            delay = outbox.seconds_until_rate_limit_reset(self.reddit.auth.limits)
+            if delay > 0:
+                logging.info('Close to the rate limit; waiting %ds before sending', delay)
+                await asyncio.sleep(delay)
+
+            try:
+                sent = await self.send_item(item)
+            except REDDIT_ERRORS as e:
+                await db.run(outbox.record_failure, item, e)
+            except Exception as e:
+                # Retried like any other transient error, instead of stopping the pipeline
+                logging.exception('Unexpected error sending outbox item %s', item['rowid'])
+                await db.run(outbox.record_failure, item, e)
+            else:
+                await db.run(outbox.record_sent, item, 'sent' if sent else 'skipped')
+            self.sending.discard((db.path, item['rowid']))
+            # There may be more due items that didn't fit in the last batch
+            self.outbox_changed.set()
+            queue.task_done()
+
+    async def load_context(self, comm):
+        """Make sure that the comment's parent and submission are prefetched, since classifying it would
+        otherwise fetch them synchronously. Return False if either can't be found (e.g. it was deleted).
+        """
+        if prefetch.missing([comm]):
+            # It may have been evicted by another worker's window since it was prefetched
+            await prefetch_async(self.reddit, [comm])
+        return not prefetch.missing([comm])
+
+    async def find_missed_comments(self, community):
+        """Like `bot.find_missed_comments`, but with asyncpraw, for one community."""
+        since = await community.db.run(database.Database.get_latest_comment_timestamp)
+        if since is None:
+            return []
+
+        recent = []
+        async for comm in community.subreddit.comments(limit=None):
+            recent.append(comm)
+            if comm.created_utc < since:
+                break
+        missed = await community.db.run(lambda db: bot.find_missed_comments(recent, db))
+        if missed:
+            logging.info('Catching up on %d comments posted in %s while disconnected', len(missed),
+                         community.subreddit.display_name)
+        return missed
+
+    async def send_item(self, item):
+        """Send the outbox item. Return False if it was skipped."""
+        if item['kind'] == 'reply':
+            # Only the id is needed to reply, so the comment isn't fetched first
+            comment = await self.reddit.comment(item['target'], fetch=False)
+            with metrics.REDDIT_REQUEST.time(kind='reply'):
+                await comment.reply(item['body'])
+            logging.info('Replied to comment %s', item['target'])
+            logging.debug('Reply body: %s', item['body'])
+            return True
+
+        subreddit = await self.reddit.subreddit(item['subreddit'])
+        await refresh_moderators(subreddit)
+        if moderators.is_moderator(subreddit, item['target']):
+            logging.info('Solver is mod; don\'t alter flair')
+            return False
+
+        logging.info('Setting flair for user "%s"', item['target'])
+        logging.info('Flair text: %s', item['flair_text'])
+        logging.info('Flair template ID: %s', item['flair_template_id'])
+        with metrics.REDDIT_REQUEST.time(kind='flair'):
+            await subreddit.flair.set(item['target'],
+                                      text=item['flair_text'],
+                                      flair_template_id=item['flair_template_id'])
+        return True
+
+
+### Reddit Functions ###
+
+
+def connect(cfg):
+    return asyncpraw.Reddit(client_id=cfg.client_id,
+                            client_secret=cfg.client_secret,
+                            username=cfg.username,
+                            password=cfg.password,
+                            user_agent=bot.USER_AGENT,
+                            **bot.endpoints(cfg))
+
+
+async def identify(reddit):
+    """Look up the bot's own account. This should only be done once per Reddit session."""
+    me = await reddit.user.me()
+    return bot.Identity(me.id, me.name)
+
+
+async def prefetch_async(reddit, comments):
+    """Like `prefetch.prefetch`, but with asyncpraw."""
+    fullnames = prefetch.missing(comments)
+    for start in range(0, len(fullnames), prefetch.BATCH_SIZE):
+        things = reddit.info(fullnames=fullnames[start:start + prefetch.BATCH_SIZE])
+        if inspect.isawaitable(things):
+            # Depending on the version, asyncpraw's `info` is either a coroutine or an async generator
+            things = await things
+        prefetch.store([thing async for thing in things])
+
+
+async def refresh_moderators(subreddit):
+    """Fetch the subreddit's moderators if the cached list is stale. Until then, checking the cache
+    uses the stale list.
+    """
+    cache = moderators.for_subreddit(subreddit)
+    if cache.is_stale():
+        cache.update(moderator.name for moderator in await subreddit.moderator())
@@ -1,13 +1,14 @@
+import contextlib
 import logging
 import re
-import sys
+import time
 from collections import namedtuple
-from logging.handlers import RotatingFileHandler
 
 import praw
 import prawcore
 
-from . import config, database, level, reply
+from . import (config, database, journal, level, logs, metrics, moderators, outbox, prefetch, profiling,
+               reply, scoreboard)
 
 ### Globals ###
 
@@ -18,156 +19,402 @@ SOLVED_PATTERN = re.compile('![Hh]elped')
 MOD_SOLVED_PATTERN = re.compile('/[Hh]elped')
 MOD_REMOVE_PATTERN = re.compile('/[Rr]emove[Pp]oint')
 
+# What happens to each comment, and the result of each rule, are the noisiest messages, so they have
+# their own loggers, whose levels (and sampling) can be configured separately (see `logs`)
+comment_log = logging.getLogger(logs.CATEGORIES['comments'])
+rule_log = logging.getLogger(logs.CATEGORIES['rules'])
 
-### Main Function ###
+# The maximum number of streamed comments whose parents and submissions are prefetched together
+PREFETCH_WINDOW_SIZE = prefetch.BATCH_SIZE
+
+# All of the command patterns combined, so that a comment body only needs to be
+# searched once to find which (if any) commands it contains
+COMMAND_PATTERN = re.compile(f'(?P<op_solved>{SOLVED_PATTERN.pattern})'
+                             f'|(?P<mod_solved>{MOD_SOLVED_PATTERN.pattern})'
+                             f'|(?P<mod_remove>{MOD_REMOVE_PATTERN.pattern})')
+
+
+### Main Functions ###
 
 
 def run():
     print_welcome_message()
 
     cfg = config.load()
+    setup_logging(cfg)
+    moderators.configure(ttl=cfg.moderator_cache_ttl)
+    journal.configure(max_entries=cfg.journal_size, retention=cfg.journal_retention)
+
+    # The scoreboard and metrics (if enabled) are served in the background for as long as the bot runs,
+    # and profiling can be turned on and off at any time
+    with scoreboard.serve(cfg), metrics.serve(cfg), profiling.install(cfg):
+        if cfg.engine == 'async':
+            # Imported here, since the async engine has its own dependencies
+            from . import asyncbot
+            asyncbot.run(cfg)
+        else:
+            run_sync(cfg)
+
+
+# A subreddit that the bot monitors, along with its own database and settings (see `config.Config.profiles`)
+Community = namedtuple('Community', 'subreddit db levels cfg')
+
+
+def run_sync(cfg):
+    # Keep one connection to each subreddit's database open for the lifetime of the bot, and send
+    # replies and flair updates in the background; all are closed cleanly on shutdown
+    with contextlib.ExitStack() as stack:
+        dbs = [stack.enter_context(database.Database(profile.database_path)) for profile in cfg.profiles]
+        sender = stack.enter_context(outbox.Sender([profile.database_path for profile in cfg.profiles],
+                                                   lambda: connect(cfg)))
+        # Run indefinitely, reconnecting any time a connection is lost
+        while True:
+            try:
+                reddit = connect(cfg)
+                me = identify(reddit)
+                logging.info('Connected to Reddit as %s', me.name)
+                access_type = 'read-only' if reddit.read_only else 'write'
+                logging.info(f'Has {access_type} access to Reddit')
+
+                # Moderators may have changed while disconnected
+                moderators.invalidate()
+                communities = []
+                for profile, db in zip(cfg.profiles, dbs):
+                    subreddit = reddit.subreddit(profile.subreddit)
+                    logging.info('Watching subreddit %s', subreddit.title)
+                    is_mod = moderators.is_moderator(subreddit, me)
+                    logging.info(f'Is {"" if is_mod else "NOT "}moderator for subreddit')
+                    communities.append(Community(subreddit, db, profile.levels, profile))
+
+                if cfg.catch_up:
+                    for community in communities:
+                        catch_up(reddit, *community, me, sender)
+                # A single stream of every subreddit's comments
+                subreddit = reddit.subreddit('+'.join(profile.subreddit for profile in cfg.profiles))
+                monitor_comments(reddit, subreddit, communities, me, sender)
+
+            # Ignoring other potential exceptions for now, since we may not be able
+            # to recover from them as well as from these ones
+            except prawcore.exceptions.RequestException as e:
+                metrics.RECONNECTS.inc(reason='request')
+                logging.error('Unable to connect to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Trying again')
+            except prawcore.exceptions.ServerError as e:
+                metrics.RECONNECTS.inc(reason='server')
+                logging.error('Lost connection to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Attempting to reconnect')
+
+
+def monitor_comments(reddit, subreddit, communities, me, sender):
+    """Monitor new comments in the subreddit (which may combine several, e.g. "a+b"), looking for
+    confirmed solutions, and handle each one as part of the community it was posted in.
+    """
+    by_name = {community.cfg.subreddit.lower(): community for community in communities}
+    # The stream starts with comments that may have been read before reconnecting, which the journal
+    # skips; but if a journal is empty (e.g. nothing has been handled since upgrading, or every entry has
+    # aged out), it can't tell which were, so they are skipped, and left to catching up instead
+    skip_existing = any(journal.newest(community.db) is None for community in communities)
+    for window in stream_windows(subreddit, PREFETCH_WINDOW_SIZE, skip_existing=skip_existing):
+        metrics.observe_comments(window)
+        with profiling.sample(len(window)):
+            with_commands = [comm for comm in window if find_commands(comm)]
+            handled = find_handled(by_name, with_commands)
+            if handled:
+                comment_log.debug('Skipping %d comments that were already handled', len(handled))
+            # Only comments with commands need their parents and submissions
+            prefetch.prefetch(reddit, [comm for comm in with_commands if comm.id not in handled])
+            num_processed = sum(process_comment(*by_name[comm.subreddit.display_name.lower()], me, comm)
+                                for comm in window if comm.id not in handled)
+        if num_processed:
+            sender.notify()
+        for community in communities:
+            journal.prune(community.db)
+
+
+def find_handled(by_name, comments):
+    """Return the ids of the comments that are in their communities' journals."""
+    grouped = {}
+    for comm in comments:
+        grouped.setdefault(comm.subreddit.display_name.lower(), []).append(comm)
+    handled = set()
+    for name, comms in grouped.items():
+        handled |= journal.handled_ids(by_name[name].db, comms)
+    return handled
+
+
+def catch_up(reddit, subreddit, db, levels, cfg, me, sender):
+    """Handle any comments that were posted since the newest comment in the database, e.g. while the
+    bot wasn't running.
+    """
+    missed = find_missed_comments(subreddit.comments(limit=None), db)
+    if not missed:
+        return
+
+    logging.info('Catching up on %d comments posted while disconnected', len(missed))
+    num_processed = 0
+    for start in range(0, len(missed), PREFETCH_WINDOW_SIZE):
+        window = missed[start:start + PREFETCH_WINDOW_SIZE]
+        prefetch.prefetch(reddit, [comm for comm in window if find_commands(comm)])
+        num_processed += sum(process_comment(subreddit, db, levels, cfg, me, comm) for comm in window)
+    logging.info('Caught up; %d points awarded or removed', num_processed)
+    if num_processed:
+        sender.notify()
+
+
+def find_missed_comments(comments, db):
+    """Return the comments (given newest first) that were posted since the newest comment in the
+    database and haven't already been handled, oldest first.
+    """
+    since = db.get_latest_comment_timestamp()
+    if since is None:
+        # Nothing has ever been handled, so there is nothing to catch up to
+        return []
 
-    file_handler = RotatingFileHandler(cfg.log_path, maxBytes=1024*1024, backupCount=3, encoding='utf-8')
-    console_handler = logging.StreamHandler(sys.stderr)
-    console_handler.setLevel(logging.INFO)
-
-    logging.basicConfig(handlers=[file_handler, console_handler],
-                        level=logging.DEBUG,
-                        format='%(asctime)s %(levelname)s:%(module)s: %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S')
-    levels = cfg.levels
-    db = database.Database(cfg.database_path)
-
-    # Run indefinitely, reconnecting any time a connection is lost
-    while True:
-        try:
-            reddit = praw.Reddit(client_id=cfg.client_id,
-                                 client_secret=cfg.client_secret,
-                                 username=cfg.username,
-                                 password=cfg.password,
-                                 user_agent=USER_AGENT)
-            logging.info('Connected to Reddit as %s', reddit.user.me())
-            access_type = 'read-only' if reddit.read_only else 'write'
-            logging.info(f'Has {access_type} access to Reddit')
-
-            subreddit = reddit.subreddit(cfg.subreddit)
-            logging.info('Watching subreddit %s', subreddit.title)
-            is_mod = subreddit.moderator(redditor=reddit.user.me())
-            logging.info(f'Is {"" if is_mod else "NOT "}moderator for subreddit')
-
-            monitor_comments(reddit, subreddit, db, levels, cfg)
-
-        # Ignoring other potential exceptions for now, since we may not be able
-        # to recover from them as well as from these ones
-        except prawcore.exceptions.RequestException as e:
-            logging.error('Unable to connect to Reddit')
-            logging.error('Error message: %s', e)
-            logging.error('Trying again')
-        except prawcore.exceptions.ServerError as e:
-            logging.error('Lost connection to Reddit')
-            logging.error('Error message: %s', e)
-            logging.error('Attempting to reconnect')
-
-
-def monitor_comments(reddit, subreddit, db, levels, cfg):
-    """Monitor new comments in the subreddit, looking for confirmed solutions."""
+    missed = []
+    for comm in comments:
+        # Comments from the same second as the newest one may or may not have been handled yet
+        if comm.created_utc < since:
+            break
+        if find_commands(comm):
+            missed.append(comm)
+
+    handled_ids = db.get_saved_comment_ids(comm.id for comm in missed) | journal.handled_ids(db, missed)
+    return [comm for comm in reversed(missed) if comm.id not in handled_ids]
+
+
+def stream_windows(subreddit, max_size, skip_existing=False):
+    """Yield lists of new comments, each no longer than max_size.
+
+    Unless skip_existing is True, the stream starts with the newest comments that Reddit lists (up to
+    100), whether or not they have already been read.
+    """
+    window = []
     # Passing pause_after=0 will bypass the internal exponential delay, but have
     # to check if any comments are returned after each query
-    for comm in subreddit.stream.comments(skip_existing=True, pause_after=0):
-        if comm is None:
-            continue
-        if comm.author == reddit.user.me():
-            logging.info('Comment was posted by this bot')
-            continue
-        if comm.author.name == reddit.user.me().name:
-            logging.info('Comment was posted by this bot name')
-            continue
-
-        logging.info('Found comment')
-        logging.debug('Comment author: "%s"', comm.author.name)
-        logging.debug('Comment text: "%s"', comm.body)
-
-        mark_as_solved, remove_point, is_mod_command = marks_as_solved(comm)
-        if mark_as_solved:
-            logging.info('Comment marks issue as solved')
-        elif remove_point:
-            logging.info('Comment removes point')
-        else:
-            # Skip this "!solved" comment
-            logging.info('Comment does not have a valid command')
-            continue
-
-        if is_mod_command:
-            logging.info('Comment was submitted by mod')
-        elif is_valid_tag(comm, cfg.tags):
-            logging.info('Comment has a valid tag')
-
-        solver, solution_comment = find_solver_and_comment(comm)
-        solver_has_already_solved = db.has_already_solved_once(solution_comment.submission, solver)
-        if not remove_point and solver_has_already_solved:
-            logging.info('User "%s" has already solved this submission once', solver.name)
-            logging.info('No additional points awarded')
-            continue
-
-        if remove_point:
-            db.soft_remove_point_for_solution(comm.submission, solver, comm.author, comm)
-            logging.info('Removed point for user "%s"', solver.name)
-        else:
-            logging.info('Submission solved')
-            logging.debug('Solution comment:')
-            logging.debug('Author: %s', solution_comment.author.name)
-            logging.debug('Body:   %s', solution_comment.body)
-            db.add_point_for_solution(comm.submission, solver, solution_comment, comm.author, comm)
-            logging.info('Added point for user "%s"', solver.name)
-
-        points = db.get_points(solver)
-        logging.info('Total points for user "%s": %d', solver.name, points)
-        if points > 0:
-            level_info = level.user_level_info(points, levels)
-        else:
-            level_info = None
-
-        # Reply to the comment marking the submission as solved
-        reply_body = reply.make(solver,
-                                points,
-                                level_info,
-                                feedback_url=cfg.feedback_url,
-                                scoreboard_url=cfg.scoreboard_url,
-                                is_add=not remove_point)
-        try:
-            comm.reply(reply_body)
-            logging.info('Replied to the comment')
-            logging.debug('Reply body: %s', reply_body)
-        except praw.exceptions.APIException as e:
-            logging.error('Unable to reply to comment: %s', e)
-            if remove_point:
-                db.add_back_point_for_solution(comm.submission, solver)
-                logging.error('Re-added point that was just removed from user "%s"', solver.name)
-            else:
-                db.remove_point_and_delete_solution(comm.submission, solver)
-                logging.error('Removed point that was just awarded to user "%s"', solver.name)
-            logging.error('Skipping comment')
-            continue
-
-        # Check if (non-mod) user flair should be updated to new level
-        if level_info and level_info.current and level_info.current.points == points:
-            lvl = level_info.current
-            logging.info('User reached level: %s', lvl.name)
-            if not subreddit.moderator(redditor=solver):
-                logging.info('User is not mod; setting flair')
-                logging.info('Flair text: %s', lvl.name)
-                logging.info('Flair template ID: %s', lvl.flair_template_id)
-                subreddit.flair.set(solver,
-                                    text=lvl.name,
-                                    flair_template_id=lvl.flair_template_id)
-            else:
-                logging.info('Solver is mod; don\'t alter flair')
+    for comm in subreddit.stream.comments(skip_existing=skip_existing, pause_after=0):
+        if comm is not None:
+            window.append(comm)
+        # Yield as soon as there are no new comments, so that comments aren't held back
+        if window and (comm is None or len(window) >= max_size):
+            yield window
+            window = []
+
+
+def process_comment(subreddit, db, levels, cfg, me, comm):
+    """Award or remove a point if the comment contains a valid command, and add the reply (and any
+    flair update) to the outbox. Return True if a point was awarded or removed.
+    """
+    start = time.perf_counter()
+    command = classify(comm, cfg, me)
+    classified = time.perf_counter()
+    if not command:
+        if find_commands(comm):
+            journal.record(db, comm, 'rejected')
+        log_comment(comm, None, False, classify_ms=logs.elapsed_ms(start, classified))
+        return False
+    processed = persist_and_queue_replies(db, subreddit.display_name, levels, cfg, command)
+    log_comment(comm, command, processed, classify_ms=logs.elapsed_ms(start, classified),
+                persist_ms=logs.elapsed_ms(classified))
+    return processed
+
+
+def log_comment(comm, command, processed, **timings):
+    """Log a single record of what happened to the comment, and how long each stage took (in ms).
+
+    Comments with commands (valid or not) are logged at INFO, and any others at DEBUG.
+    """
+    if not comment_log.isEnabledFor(logging.INFO):
+        return
+    commands = find_commands(comm)
+    level = logging.INFO if commands else logging.DEBUG
+    if not comment_log.isEnabledFor(level):
+        return
+    if command:
+        outcome = ('removed' if command.remove_point else 'awarded') if processed else 'unchanged'
+    else:
+        outcome = 'rejected' if commands else 'ignored'
+    event = {
+        'comment': comm.id,
+        'submission': comm.link_id,
+        'author': comm.author.name if comm.author else None,
+        'commands': sorted(commands),
+        'outcome': outcome,
+        'solver': command.solver.name if command else None,
+        'timings_ms': timings,
+    }
+    logs.log_event(comment_log, level, event, 'Comment %s: %s', comm.id, outcome)
+
+
+### Comment Processing Stages ###
+
+# A comment containing a valid command, along with everything needed to act on it
+Command = namedtuple('Command', 'comment submission solver solution_comment chooser remove_point is_mod_command')
+
+
+def classify(comm, cfg, me):
+    """Return a Command if the comment contains a valid command, or None otherwise.
+
+    The comment's parent and submission should already be prefetched, so this makes no requests to
+    Reddit other than (occasionally) refreshing the list of moderators.
+    """
+    if comm.author and comm.author.name == me.name:
+        comment_log.debug('Comment was posted by this bot')
+        return None
+
+    comment_log.debug('Found comment')
+    comment_log.debug('Comment author: "%s"', comm.author.name if comm.author else None)
+    comment_log.debug('Comment text: "%s"', comm.body)
+
+    mark_as_solved, remove_point, is_mod_command = marks_as_solved(comm, diagnose=cfg.diagnose_rules)
+    if mark_as_solved:
+        comment_log.debug('Comment marks issue as solved')
+    elif remove_point:
+        comment_log.debug('Comment removes point')
+    else:
+        # Skip this "!solved" comment
+        comment_log.debug('Comment does not have a valid command')
+        return None
+
+    if is_mod_command:
+        comment_log.debug('Comment was submitted by mod')
+    elif is_valid_tag(comm, cfg.tags):
+        comment_log.debug('Comment has a valid tag')
+
+    _, solution_comment = find_solver_and_comment(comm)
+    solver = author_identity(solution_comment)
+    if not solver:
+        comment_log.debug('Solution comment has been deleted')
+        return None
+
+    return Command(comm,
+                   submission_info(prefetch.submission(comm)),
+                   solver,
+                   solution_comment,
+                   author_identity(comm),
+                   remove_point,
+                   is_mod_command)
+
+
+def persist(db, command):
+    """Award or remove the point in the database. Return the solver's new point total, or None if
+    nothing should be done.
+    """
+    solver = command.solver
+    if not command.remove_point and db.has_already_solved_once(command.submission, solver):
+        comment_log.debug('User "%s" has already solved this submission once', solver.name)
+        comment_log.debug('No additional points awarded')
+        return None
+
+    if command.remove_point:
+        points = db.soft_remove_point_for_solution(command.submission, solver, command.chooser, command.comment)
+        if points is None:
+            comment_log.debug('User "%s" has no point for this submission to remove', solver.name)
+            return None
+        comment_log.debug('Removed point for user "%s"', solver.name)
+    else:
+        comment_log.debug('Submission solved')
+        comment_log.debug('Solution comment:')
+        comment_log.debug('Author: %s', solver.name)
+        comment_log.debug('Body:   %s', command.solution_comment.body)
+        points = db.add_point_for_solution(command.submission, solver, command.solution_comment,
+                                           command.chooser, command.comment)
+        comment_log.debug('Added point for user "%s"', solver.name)
+
+    comment_log.debug('Total points for user "%s": %d', solver.name, points)
+    return points
+
+
+def persist_and_queue_replies(db, subreddit_name, levels, cfg, command):
+    """Persist the command, add the reply (and any flair update) to the outbox, and add the command
+    comment to the journal, all in a single transaction. Return True if a point was awarded or removed.
+    """
+    with metrics.DB_TRANSACTION.time(), db.atomic():
+        points = persist(db, command)
+        if points is None:
+            journal.record(db, command.comment, 'unchanged')
+            return False
+        reply_body, level_info = make_reply(command, points, levels, cfg)
+        outbox.add(db, subreddit_name, command, reply_body, flair_level(points, level_info))
+        journal.record(db, command.comment, 'removed' if command.remove_point else 'awarded')
+    metrics.POINTS_CHANGED.inc(action='remove' if command.remove_point else 'award')
+    comment_log.debug('Added reply to the outbox')
+    return True
+
+
+def make_reply(command, points, levels, cfg):
+    """Return the body of the reply to the command comment, along with the solver's level info."""
+    if points > 0:
+        level_info = level.user_level_info(points, levels)
+    else:
+        level_info = None
+
+    factory = reply.factory_for(levels, feedback_url=cfg.feedback_url, scoreboard_url=cfg.scoreboard_url)
+    reply_body = factory.make(command.solver, points, is_add=not command.remove_point)
+    return reply_body, level_info
+
+
+def flair_level(points, level_info):
+    """Return the level whose flair the solver should now have, or None if it hasn't changed."""
+    if level_info and level_info.current and level_info.current.points == points:
+        comment_log.debug('User reached level: %s', level_info.current.name)
+        return level_info.current
+    return None
+
+
+### Reddit Session Functions ###
+
+# A redditor's id and name; this is all that the database and replies need, and unlike a PRAW
+# Redditor, it never needs to be fetched
+Identity = namedtuple('Identity', 'id name')
+
+# A submission's id and author Identity (None if deleted), for the same reasons
+SubmissionInfo = namedtuple('SubmissionInfo', 'id author')
+
+
+def connect(cfg):
+    return praw.Reddit(client_id=cfg.client_id,
+                       client_secret=cfg.client_secret,
+                       username=cfg.username,
+                       password=cfg.password,
+                       user_agent=USER_AGENT,
+                       **endpoints(cfg))
+
+
+def endpoints(cfg):
+    """Return the Reddit URLs that the config overrides, as keyword arguments for `praw.Reddit`."""
+    urls = {'oauth_url': cfg.reddit_oauth_url, 'reddit_url': cfg.reddit_url}
+    return {key: url for key, url in urls.items() if url}
+
+
+def identify(reddit):
+    """Look up the bot's own account. This should only be done once per Reddit session."""
+    me = reddit.user.me()
+    return Identity(me.id, me.name)
+
+
+def author_identity(thing):
+    """Return the Identity of the comment or submission's author, or None if it has been deleted."""
+    if not thing.author:
+        return None
+    # The author's fullname is included with the comment or submission, unlike the author's id
+    return Identity(thing.author_fullname.split('_', 1)[1], thing.author.name)
+
+
+def submission_info(submission):
+    return SubmissionInfo(submission.id, author_identity(submission))
 
 
 ### Reddit Comment Functions ###
 
 SolutionResponseRule = namedtuple('SolutionResponseRule',
-                                  'description success_msg failure_msg check')
+                                  'description success_msg failure_msg check cost')
+
+# Rule costs, used to check the cheapest rules first
+REGEX_COST = 0       # Only searches the comment body
+ATTRIBUTE_COST = 1   # Only reads attributes that the comment already has
+NETWORK_COST = 2     # May need to request something from Reddit
 
 OP_RESPONSE_RULES = [
     SolutionResponseRule(
@@ -175,24 +422,28 @@ OP_RESPONSE_RULES = [
         'Comment contains user "solved" pattern',
         'Comment does not contain user "solved" pattern',
         lambda c: SOLVED_PATTERN.search(c.body),
+        REGEX_COST,
     ),
     SolutionResponseRule(
         'is a reply (not top-level)',
         'Comment is a reply to another comment',
         'Comment is a top-level comment',
         lambda c: not c.is_root,
+        ATTRIBUTE_COST,
     ),
     SolutionResponseRule(
         'author is OP',
         'Comment author is submission OP',
         'Comment author is not submission OP',
         lambda c: c.is_submitter,
+        ATTRIBUTE_COST,
     ),
     SolutionResponseRule(
         "OP can't solve own problem",
         'Submission OP is different from solution author',
         'Submission OP is marking own comment as solution',
-        lambda c: not c.is_root and not c.parent().is_submitter,
+        lambda c: not c.is_root and not prefetch.parent(c).is_submitter,
+        NETWORK_COST,
     ),
 ]
 
@@ -202,12 +453,14 @@ MOD_RESPONSE_RULES = [
         'Comment contains mod "solved" pattern',
         'Comment does not contain mod "solved" pattern',
         lambda c: MOD_SOLVED_PATTERN.search(c.body),
+        REGEX_COST,
     ),
     SolutionResponseRule(
         'is a reply (not top-level)',
         'Comment is a reply to another comment',
         'Comment is a top-level comment',
         lambda c: not c.is_root,
+        ATTRIBUTE_COST,
     ),
     SolutionResponseRule(
         'author is mod',
@@ -215,6 +468,7 @@ MOD_RESPONSE_RULES = [
         'Comment author is not a mod',
         # TODO Initialize rules in a function so that they can include other functions
         lambda c: is_mod_comment(c),
+        NETWORK_COST,
     ),
 ]
 
@@ -224,55 +478,94 @@ MOD_REMOVE_RULES = [
         'Comment contains mod "removepoint" pattern',
         'Comment does not contain mod "removepoint" pattern',
         lambda c: MOD_REMOVE_PATTERN.search(c.body),
+        REGEX_COST,
     ),
     SolutionResponseRule(
         'is a reply (not top-level)',
         'Comment is a reply to another comment',
         'Comment is a top-level comment',
         lambda c: not c.is_root,
+        ATTRIBUTE_COST,
     ),
     SolutionResponseRule(
         'author is mod',
         'Comment author is a mod',
         'Comment author is not a mod',
         lambda c: is_mod_comment(c),
+        NETWORK_COST,
     ),
 ]
 
 # GENERAL_RESPONSE_RULES = []
 
+# The rules to check for each named group in COMMAND_PATTERN, cheapest first
+COMMAND_RULES = {
+    'op_solved': sorted(OP_RESPONSE_RULES, key=lambda rule: rule.cost),
+    'mod_solved': sorted(MOD_RESPONSE_RULES, key=lambda rule: rule.cost),
+    'mod_remove': sorted(MOD_REMOVE_RULES, key=lambda rule: rule.cost),
+}
+
+
+def check_rules(rules, comment, diagnose=False):
+    """Return True if the comment passes every rule, False otherwise.
 
-def check_rules(rules, comment):
+    Stop at the first rule that fails, unless diagnose is True, in which case every rule is checked
+    and logged.
+    """
     all_rules_passed = True
     for rule in rules:
         rule_passed = rule.check(comment)
-        logging.info(rule.success_msg if rule_passed else rule.failure_msg)
+        if diagnose:
+            rule_log.info(rule.success_msg if rule_passed else rule.failure_msg)
+        elif not rule_passed:
+            rule_log.info(rule.failure_msg)
+            return False
         all_rules_passed = all_rules_passed and rule_passed
     return all_rules_passed
 
 
-def marks_as_solved(comment):
-    """Return True if the comment meets the criteria for marking the submission
-    as solved, False otherwise.
+def find_commands(comment):
+    """Return the names of the commands (i.e. the COMMAND_PATTERN groups) that appear in the comment."""
+    return {match.lastgroup for match in COMMAND_PATTERN.finditer(comment.body)}
+
+
+def marks_as_solved(comment, diagnose=False):
+    """Return a (marks as solved, removes point, is mod command) tuple of bools for the comment.
+
+    Only the rules for commands that appear in the comment are checked, so a comment without any
+    commands costs no requests to Reddit. If diagnose is True, every rule for every command is checked
+    and logged instead.
     """
+    found = find_commands(comment)
+    if not found and not diagnose:
+        return False, False, False
+    for command in found:
+        metrics.COMMANDS_MATCHED.inc(command=command)
+
+    with metrics.RULE_EVALUATION.time():
+        return check_command_rules(comment, set(COMMAND_RULES) if diagnose else found, diagnose)
+
+
+def check_command_rules(comment, commands, diagnose):
+    """Check the rules for each of the commands, and return the same tuple as `marks_as_solved`."""
     # TODO should enforce that only one or the other can pass?
-    op_rules_pass = check_rules(OP_RESPONSE_RULES, comment)
+    op_rules_pass = 'op_solved' in commands and check_rules(COMMAND_RULES['op_solved'], comment, diagnose)
     if op_rules_pass:
-        logging.info('OP marking submission as solved')
+        rule_log.info('OP marking submission as solved')
 
-    mod_rules_pass = check_rules(MOD_RESPONSE_RULES, comment)
+    mod_rules_pass = 'mod_solved' in commands and check_rules(COMMAND_RULES['mod_solved'], comment, diagnose)
     if mod_rules_pass:
-        logging.info('Mod marking submission as solved')
+        rule_log.info('Mod marking submission as solved')
 
-    mod_remove_pass = check_rules(MOD_REMOVE_RULES, comment)
+    mod_remove_pass = 'mod_remove' in commands and check_rules(COMMAND_RULES['mod_remove'], comment, diagnose)
     if mod_remove_pass:
-        logging.info('Mod removing point')
+        rule_log.info('Mod removing point')
 
     return op_rules_pass or mod_rules_pass, mod_remove_pass, mod_rules_pass or mod_remove_pass
 
 
 def is_mod_comment(comment):
-    return comment.subreddit.moderator(redditor=comment.author)
+    return moderators.is_moderator(comment.subreddit, comment.author)
 
 
 def is_valid_tag(solved_comment, valid_tags):
@@ -281,7 +574,7 @@ def is_valid_tag(solved_comment, valid_tags):
     if valid_tags is None:
         return True
 
-    submission_title = solved_comment.submission.title.lower()
+    submission_title = prefetch.submission(solved_comment).title.lower()
 
     for valid_tag in valid_tags:
         if f"[{valid_tag}]" in submission_title:
@@ -294,22 +587,27 @@ def find_solver_and_comment(solved_comment):
     """Determine the redditor responsible for solving the question."""
     # TODO plz make this better someday
     # return solved_comment.parent().author
-    solution_comment = solved_comment.parent()
+    solution_comment = prefetch.parent(solved_comment)
     return solution_comment.author, solution_comment
 
 
 ### Print & Logging Functions ###
 
 
+def setup_logging(cfg):
+    return logs.setup(cfg)
+
+
 def print_welcome_message():
     print_separator_line()
     print('\n*** Welcome to PointsBot! ***\n')
     print_separator_line()
     print('\nThis bot will monitor the subreddit specified in the '
           'configuration file as long as this program is running.')
-    print('\nAny Reddit activity that occurs while this program is not running '
-          'will be missed. You can work around this by using features '
-          'mentioned in the README.')
+    print('\nWhen this program starts, it will catch up on recent comments '
+          'that were posted while it was not running. However, Reddit only '
+          'lists the most recent 1000 or so comments, so any activity older '
+          'than that will be missed.')
     print('\nThe output from this program can be referenced if any issues are '
           'to occur, and the relevant error message or crash report can be '
           'sent to the developer by reporting an issue on the Github page.')
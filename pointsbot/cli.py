@@ -0,0 +1,142 @@
+"""Command-line interface for running the bot and its maintenance commands."""
+import argparse
+import os
+
+from . import bot, config, database, journal, metrics, moderators, rebuild, resync, scoreboard, workqueue
+
+### Main Function ###
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='PointsBot', description='Run PointsBot.')
+    parser.set_defaults(func=run)
+    subparsers = parser.add_subparsers(title='commands')
+
+    run_parser = subparsers.add_parser('run', help='monitor the subreddit (default)')
+    run_parser.set_defaults(func=run)
+
+    ingest_parser = subparsers.add_parser('ingest',
+                                          help='queue the subreddit\'s new comments for worker processes '
+                                               '(instead of "run")')
+    ingest_parser.set_defaults(func=ingest)
+
+    worker_parser = subparsers.add_parser('worker', help='handle the comments queued by "ingest"')
+    worker_parser.add_argument('--processes', type=int, default=1,
+                               help='number of worker processes to run (default: %(default)s; '
+                                    '0 for one per core)')
+    worker_parser.set_defaults(func=worker)
+
+    explain_parser = subparsers.add_parser('explain',
+                                           help='print the query plans for the hot database queries')
+    add_subreddit_argument(explain_parser)
+    explain_parser.set_defaults(func=explain)
+
+    recompute_parser = subparsers.add_parser('recompute',
+                                             help='recompute every point total from the points ledger')
+    add_subreddit_argument(recompute_parser)
+    recompute_parser.set_defaults(func=recompute)
+
+    resync_parser = subparsers.add_parser('resync-flair',
+                                          help="update every user's flair to match their level, "
+                                               'e.g. after changing the levels')
+    resync_parser.add_argument('--dry-run', action='store_true',
+                               help='only print the changes, without updating any flair')
+    resync_parser.add_argument('--templates', action='store_true',
+                               help="also set each level's flair template again for every user at that "
+                                    'level, one request per user; needed after changing a '
+                                    "level's flair_template_id, which can't be detected otherwise")
+    add_subreddit_argument(resync_parser)
+    resync_parser.set_defaults(func=resync_flair)
+
+    rebuild_parser = subparsers.add_parser('rebuild',
+                                           help='rebuild the database from the subreddit\'s history '
+                                                '(stop the bot first)')
+    rebuild_parser.add_argument('--workers', type=int, default=rebuild.DEFAULT_WORKERS,
+                                help='number of submissions to fetch at the same time (default: %(default)s)')
+    rebuild_parser.add_argument('--ids-file', type=argparse.FileType('r'),
+                                help='file with the id of each submission to rebuild, one per line '
+                                     '(default: the submissions in the subreddit\'s listings)')
+    add_subreddit_argument(rebuild_parser)
+    rebuild_parser.set_defaults(func=rebuild_database)
+
+    return parser
+
+
+def add_subreddit_argument(parser):
+    parser.add_argument('--subreddit',
+                        help='which of the configured subreddits to use (default: the one in [core])')
+
+
+def load_profile(args):
+    """Load the config for the subreddit given on the command line, if any."""
+    cfg = config.load()
+    if not args.subreddit:
+        return cfg
+    try:
+        return cfg.profile(args.subreddit)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+### Commands ###
+
+
+def run(args):
+    bot.run()
+
+
+def ingest(args):
+    cfg = config.load()
+    bot.setup_logging(cfg)
+    moderators.configure(ttl=cfg.moderator_cache_ttl)
+    journal.configure(max_entries=cfg.journal_size, retention=cfg.journal_retention)
+    with scoreboard.serve(cfg), metrics.serve(cfg):
+        workqueue.run_ingest(cfg)
+
+
+def worker(args):
+    cfg = config.load()
+    bot.setup_logging(cfg)
+    workqueue.run_workers(cfg, num_processes=args.processes or os.cpu_count())
+
+
+def explain(args):
+    cfg = load_profile(args)
+    with database.Database(cfg.database_path) as db:
+        for name, plan in db.explain_query_plans().items():
+            print(f'{name}:')
+            for line in plan:
+                print(f'    {line}')
+
+
+def recompute(args):
+    cfg = load_profile(args)
+    with database.Database(cfg.database_path) as db:
+        num_corrected = db.recompute_points()
+    print(f'Corrected {num_corrected} point totals')
+
+
+def resync_flair(args):
+    cfg = load_profile(args)
+    bot.setup_logging(cfg)
+    changes = resync.resync(cfg, dry_run=args.dry_run, templates=args.templates)
+    for name, old_flair, new_flair in changes:
+        print(f'{name}: "{old_flair.text}" -> "{new_flair.text}"')
+    print(f'{"Would update" if args.dry_run else "Updated"} flair for {len(changes)} users')
+
+
+def rebuild_database(args):
+    cfg = load_profile(args)
+    bot.setup_logging(cfg)
+    submission_ids = None
+    if args.ids_file:
+        with args.ids_file:
+            submission_ids = [line.strip() for line in args.ids_file if line.strip()]
+    if not rebuild.rebuild(cfg, workers=args.workers, submission_ids=submission_ids):
+        raise SystemExit(1)
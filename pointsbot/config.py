@@ -1,11 +1,12 @@
 import os
 import os.path
 from collections import namedtuple
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import toml
 
-from .level import Level
+from . import database, journal, logs, metrics, moderators, profiling, scoreboard
+from .level import Level, LevelTable
 
 ### Globals ###
 
@@ -40,10 +41,29 @@ class Config:
     # Default config vals
     DEFAULT_DB_NAME = 'pointsbot.db'
     DEFAULT_LOG_NAME = 'pointsbot.log'
+    DEFAULT_ENGINE = 'sync'
+    DEFAULT_ENGINE_QUEUE_SIZE = 100
+    DEFAULT_ENGINE_WORKERS = 4
+
+    ENGINES = ('sync', 'async')
 
     def __init__(self, filepath, subreddit, client_id, client_secret, username,
                  password, levels, database_path=None, log_path=None,
-                 feedback_url=None, scoreboard_url=None, tag_string=None):
+                 feedback_url=None, scoreboard_url=None, tag_string=None,
+                 moderator_cache_ttl=moderators.DEFAULT_TTL, journal_size=journal.DEFAULT_MAX_ENTRIES,
+                 journal_retention=journal.DEFAULT_RETENTION, diagnose_rules=False,
+                 engine=DEFAULT_ENGINE, engine_queue_size=DEFAULT_ENGINE_QUEUE_SIZE,
+                 engine_workers=DEFAULT_ENGINE_WORKERS, catch_up=True,
+                 serve_scoreboard=False, scoreboard_host=scoreboard.DEFAULT_HOST,
+                 scoreboard_port=scoreboard.DEFAULT_PORT,
+                 scoreboard_size=database.LEADERBOARD_SNAPSHOT_SIZE, reddit_oauth_url=None,
+                 reddit_url=None, serve_metrics=False, metrics_host=metrics.DEFAULT_HOST,
+                 metrics_port=metrics.DEFAULT_PORT, profiling_enabled=False,
+                 profile_sample_every=profiling.DEFAULT_SAMPLE_EVERY,
+                 profile_dump_every=profiling.DEFAULT_DUMP_EVERY,
+                 memory_snapshot_interval=profiling.DEFAULT_MEMORY_INTERVAL, profiling_signal=True,
+                 log_format='text', log_level=logs.DEFAULT_LEVEL, log_category_levels=None,
+                 log_sampling=None, subreddits=None):
         self._filepath = filepath
         self._dirname = os.path.dirname(filepath)
 
@@ -52,6 +72,18 @@ class Config:
         elif os.path.isdir(log_path):
             log_path = os.path.join(log_path, self.DEFAULT_LOG_NAME)
         self.log_path = log_path
+        if log_format not in logs.FORMATS:
+            raise ValueError(f'Unknown log format "{log_format}"; '
+                             f'expected one of: {", ".join(logs.FORMATS)}')
+        self.log_format = log_format
+        self.log_level = log_level
+        # Levels and sampling rates for categories of messages, keyed by category (see `logs`)
+        self.log_category_levels = log_category_levels or {}
+        self.log_sampling = log_sampling or {}
+        for category in (*self.log_category_levels, *self.log_sampling):
+            if category not in logs.CATEGORIES:
+                raise ValueError(f'Unknown log category "{category}"; '
+                                 f'expected one of: {", ".join(logs.CATEGORIES)}')
 
         # TODO init logging here so it can be used immediately?
 
@@ -69,33 +101,115 @@ class Config:
         self.client_secret = client_secret
         self.username = username
         self.password = password
+        # Only set when the bot should talk to something other than Reddit, e.g. a local stand-in
+        self.reddit_oauth_url = reddit_oauth_url
+        self.reddit_url = reddit_url
 
-        self.levels = levels
+        # Built once, so that looking up a level never has to go through every level
+        self.levels = LevelTable(levels)
         if tag_string is None:
             self.tags = None
         else:
             self.tags = tag_string.lower().split(",")
 
+        self.moderator_cache_ttl = moderator_cache_ttl
+        self.journal_size = journal_size
+        self.journal_retention = journal_retention
+        self.diagnose_rules = diagnose_rules
+
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown engine "{engine}"; expected one of: {", ".join(self.ENGINES)}')
+        self.engine = engine
+        self.engine_queue_size = engine_queue_size
+        self.engine_workers = engine_workers
+        self.catch_up = catch_up
+
+        self.serve_scoreboard = serve_scoreboard
+        self.scoreboard_host = scoreboard_host
+        self.scoreboard_port = scoreboard_port
+        self.scoreboard_size = scoreboard_size
+
+        self.serve_metrics = serve_metrics
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+
+        self.profiling_enabled = profiling_enabled
+        self.profile_sample_every = profile_sample_every
+        self.profile_dump_every = profile_dump_every
+        self.memory_snapshot_interval = memory_snapshot_interval
+        self.profiling_signal = profiling_signal
+
+        # This subreddit's profile comes first, followed by one for each other subreddit that the bot
+        # monitors (see `make_profile`)
+        self.profiles = [self]
+        for settings in subreddits or []:
+            self.profiles.append(self.make_profile(**settings))
+        names = [profile.subreddit.lower() for profile in self.profiles]
+        if len(set(names)) < len(names):
+            raise ValueError('Each subreddit can only be configured once')
+        paths = [os.path.abspath(profile.database_path) for profile in self.profiles]
+        if len(set(paths)) < len(paths):
+            raise ValueError('Each subreddit needs its own database')
+
+    def make_profile(self, subreddit, levels=None, tag_string=None, feedback_url=None,
+                     scoreboard_url=None, database_path=None):
+        """Return a copy of this config for another subreddit, with its own levels, tags, links and
+        database. Any of them that aren't given are the same as this subreddit's, except the database,
+        which defaults to one named after the subreddit.
+        """
+        profile = copy(self)
+        profile.subreddit = subreddit
+        if levels is not None:
+            profile.levels = LevelTable(levels)
+        if tag_string is not None:
+            profile.tags = tag_string.lower().split(",")
+        if feedback_url is not None:
+            profile.feedback_url = feedback_url
+        if scoreboard_url is not None:
+            profile.scoreboard_url = scoreboard_url
+
+        db_name = f'pointsbot-{subreddit.lower()}.db'
+        if not database_path:
+            database_path = os.path.join(self._dirname, db_name)
+        elif os.path.isdir(database_path):
+            database_path = os.path.join(database_path, db_name)
+        profile.database_path = database_path
+
+        profile.profiles = [profile]
+        return profile
+
+    def profile(self, subreddit):
+        """Return the profile for the subreddit."""
+        for profile in self.profiles:
+            if profile.subreddit.lower() == subreddit.lower():
+                return profile
+        raise ValueError(f'Subreddit "{subreddit}" is not in the config; '
+                         f'expected one of: {", ".join(p.subreddit for p in self.profiles)}')
+
     @classmethod
     def from_toml(cls, filepath):
         obj = toml.load(filepath)
 
-        # Create list of level objects, in ascending order by point value
-        levels = []
-        for lvl in obj['levels']:
-            flair_template_id = lvl.get('flair_template_id', None)
-            if flair_template_id == '':
-                flair_template_id = None
-            levels.append(Level(lvl['name'], lvl['points'], flair_template_id))
-        levels.sort(key=lambda l: l.points)
+        levels = parse_levels(obj['levels'])
 
         dbpath = obj['filepaths']['database']
         if dbpath:
-            dbpath = os.path.abspath(os.path.expandvars(os.path.expanduser(dbpath)))
+            dbpath = expand_path(dbpath)
 
         logpath = obj['filepaths']['log']
         if logpath:
-            logpath = os.path.abspath(os.path.expandvars(os.path.expanduser(logpath)))
+            logpath = expand_path(logpath)
+
+        # Optional sections, which may be missing from older config files
+        cache = obj.get('cache', {})
+        debug = obj.get('debug', {})
+        engine = obj.get('engine', {})
+        scoreboard_section = obj.get('scoreboard', {})
+        reddit = obj.get('reddit', {})
+        metrics_section = obj.get('metrics', {})
+        profiling_section = obj.get('profiling', {})
+        logging_section = obj.get('logging', {})
+        subreddits = [parse_subreddit(section) for section in obj.get('subreddits', [])]
 
         return cls(
             filepath,
@@ -110,10 +224,37 @@ class Config:
             feedback_url=obj['links']['feedback'],
             scoreboard_url=obj['links']['scoreboard'],
             tag_string=obj['core']['valid_tags'],
+            moderator_cache_ttl=cache.get('moderators_ttl', moderators.DEFAULT_TTL),
+            journal_size=cache.get('journal_size', journal.DEFAULT_MAX_ENTRIES),
+            journal_retention=cache.get('journal_retention', journal.DEFAULT_RETENTION),
+            diagnose_rules=debug.get('diagnose_rules', False),
+            engine=engine.get('mode', cls.DEFAULT_ENGINE),
+            engine_queue_size=engine.get('queue_size', cls.DEFAULT_ENGINE_QUEUE_SIZE),
+            engine_workers=engine.get('workers', cls.DEFAULT_ENGINE_WORKERS),
+            catch_up=engine.get('catch_up', True),
+            serve_scoreboard=scoreboard_section.get('serve', False),
+            scoreboard_host=scoreboard_section.get('host', scoreboard.DEFAULT_HOST),
+            scoreboard_port=scoreboard_section.get('port', scoreboard.DEFAULT_PORT),
+            scoreboard_size=scoreboard_section.get('size', database.LEADERBOARD_SNAPSHOT_SIZE),
+            reddit_oauth_url=reddit.get('oauth_url') or None,
+            reddit_url=reddit.get('reddit_url') or None,
+            serve_metrics=metrics_section.get('serve', False),
+            metrics_host=metrics_section.get('host', metrics.DEFAULT_HOST),
+            metrics_port=metrics_section.get('port', metrics.DEFAULT_PORT),
+            profiling_enabled=profiling_section.get('enabled', False),
+            profile_sample_every=profiling_section.get('sample_every', profiling.DEFAULT_SAMPLE_EVERY),
+            profile_dump_every=profiling_section.get('dump_every', profiling.DEFAULT_DUMP_EVERY),
+            memory_snapshot_interval=profiling_section.get('memory_interval', profiling.DEFAULT_MEMORY_INTERVAL),
+            profiling_signal=profiling_section.get('signal', True),
+            log_format=logging_section.get('format', 'text'),
+            log_level=logging_section.get('level', logs.DEFAULT_LEVEL),
+            log_category_levels=logging_section.get('levels', {}),
+            log_sampling=logging_section.get('sampling', {}),
+            subreddits=subreddits,
         )
 
     def save(self):
-        obj = deepcopy(vars(self))
+        obj = deepcopy({name: value for name, value in vars(self).items() if name != 'profiles'})
         orig_levels, obj['levels'] = obj['levels'], []
         for level in orig_levels:
             obj['levels'].append({
@@ -128,6 +269,41 @@ class Config:
             toml.dump(obj, f)
 
 
+### Parsing Functions ###
+
+
+def parse_levels(items):
+    """Return a list of level objects, in ascending order by point value."""
+    levels = []
+    for lvl in items:
+        flair_template_id = lvl.get('flair_template_id', None)
+        if flair_template_id == '':
+            flair_template_id = None
+        levels.append(Level(lvl['name'], lvl['points'], flair_template_id))
+    levels.sort(key=lambda l: l.points)
+    return levels
+
+
+def parse_subreddit(section):
+    """Return the `Config.make_profile` arguments for a `[[subreddits]]` section."""
+    settings = {'subreddit': section['name']}
+    if 'levels' in section:
+        settings['levels'] = parse_levels(section['levels'])
+    if 'valid_tags' in section:
+        settings['tag_string'] = section['valid_tags']
+    if 'feedback' in section:
+        settings['feedback_url'] = section['feedback']
+    if 'scoreboard' in section:
+        settings['scoreboard_url'] = section['scoreboard']
+    if section.get('database'):
+        settings['database_path'] = expand_path(section['database'])
+    return settings
+
+
+def expand_path(path):
+    return os.path.abspath(os.path.expandvars(os.path.expanduser(path)))
+
+
 ### Interactive Config Editing ###
 
 
@@ -1,47 +1,45 @@
+import contextlib
 import datetime
 import functools
 import logging
 import os.path
 import re
 import sqlite3 as sqlite
+import time
+import urllib.request
+from collections import namedtuple
+
+### Globals ###
+
+# Default number of entries in a leaderboard snapshot
+LEADERBOARD_SNAPSHOT_SIZE = 100
+
+### Data Structures ###
+
+# A redditor's id and name, as saved in the database
+Redditor = namedtuple('Redditor', 'id name')
+
+# A redditor's place on the leaderboard
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'rank name points')
+
+# The top `size` entries of the leaderboard (fewer if there aren't enough redditors with points),
+# as of the given leaderboard generation
+LeaderboardSnapshot = namedtuple('LeaderboardSnapshot', 'generation size entries')
 
 ### Decorators ###
 
 
 def transaction(func):
-    """Use this decorator on any methods that needs to query the database to ensure that connections
-    are properly opened and closed, without being left open unnecessarily.
+    """Use this decorator on any methods that needs to query the database to ensure that changes are
+    committed once the outermost decorated call returns, or rolled back if it raises.
+
+    All decorated methods share the database's long-lived connection, so nested calls (e.g. a public
+    method calling internal ones) run as part of the same transaction.
     """
     @functools.wraps(func)
     def newfunc(self, *args, **kwargs):
-        created_conn = False
-        if not self.conn:
-            self.conn = sqlite.connect(self.path)
-            self.conn.row_factory = sqlite.Row
-            self.cursor = self.conn.cursor()
-            created_conn = True
-
-        return_value = func(self, *args, **kwargs)
-        # try:
-        #     return_value = func(self, *args, **kwargs)
-        # except Exception as e:
-        #     if self.conn.in_transaction:
-        #         self.conn.rollback()
-        #     if created_conn:
-        #         self.cursor.close()
-        #         self.conn.close()
-        #         self.cursor = self.conn = None
-        #     raise e
-
-        if self.conn.in_transaction:
-            self.conn.commit()
-
-        if created_conn:
-            self.cursor.close()
-            self.conn.close()
-            self.cursor = self.conn = None
-
-        return return_value
+        with self.atomic():
+            return func(self, *args, **kwargs)
 
     return newfunc
 
@@ -98,7 +96,7 @@ class DatabaseVersion:
 class Database:
 
     # TODO why store this separately; could compute from SCHEMA_VERSION_STATEMENTS
-    LATEST_VERSION = DatabaseVersion(0, 2, 1)
+    LATEST_VERSION = DatabaseVersion(0, 5, 1)
 
     # TODO now that I'm separating these statements by version, I could probably make these
     # scripts instead of lists of individual statements...
@@ -202,15 +200,328 @@ class Database:
            '''
            ALTER TABLE temp_submission RENAME TO submission
            '''
-        ]
+        ],
+        DatabaseVersion(0, 3, 0): [
+            # Drop any duplicate solutions, so that the uniqueness constraint lost in 0.2.1 can be
+            # restored as an index
+            '''
+            DELETE FROM solution
+            WHERE submission_rowid IS NOT NULL
+                AND rowid NOT IN (
+                    SELECT min(rowid)
+                    FROM solution
+                    WHERE submission_rowid IS NOT NULL
+                    GROUP BY submission_rowid, author_rowid
+                )
+            ''',
+            '''
+            CREATE UNIQUE INDEX IF NOT EXISTS solution_submission_author_idx
+            ON solution (submission_rowid, author_rowid)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS solution_author_idx
+            ON solution (author_rowid)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS comment_author_idx
+            ON comment (author_rowid)
+            ''',
+            '''
+            ANALYZE
+            ''',
+        ],
+        DatabaseVersion(0, 3, 1): [
+            # Replies and flair updates waiting to be sent to Reddit
+            '''
+            CREATE TABLE IF NOT EXISTS outbox (
+                kind TEXT NOT NULL,         -- 'reply' or 'flair'
+                subreddit TEXT NOT NULL,
+                target TEXT NOT NULL,       -- Comment id for a reply; redditor name for a flair update
+                body TEXT,
+                flair_text TEXT,
+                flair_template_id TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',   -- 'pending', 'sent', 'skipped', or 'failed'
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,            -- Unix timestamp
+                last_error TEXT,
+                created_at_datetime TEXT NOT NULL
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS outbox_pending_idx
+            ON outbox (next_attempt_at)
+            WHERE status = 'pending'
+            ''',
+        ],
+        DatabaseVersion(0, 4, 0): [
+            # An append-only ledger of every change to a redditor's points; `redditor.points` is now
+            # only a running total of the ledger, maintained by the trigger below
+            '''
+            CREATE TABLE IF NOT EXISTS point_event (
+                redditor_rowid INTEGER NOT NULL,
+                kind TEXT NOT NULL,         -- 'award', 'remove', 'restore', or 'adjust'
+                points INTEGER NOT NULL,
+                solution_rowid INTEGER,
+                comment_rowid INTEGER,      -- The comment that caused the change, if any
+                note TEXT,
+                created_at_datetime TEXT NOT NULL,
+                FOREIGN KEY (redditor_rowid) REFERENCES redditor (rowid),
+                FOREIGN KEY (solution_rowid) REFERENCES solution (rowid),
+                FOREIGN KEY (comment_rowid) REFERENCES comment (rowid)
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS point_event_redditor_idx
+            ON point_event (redditor_rowid, created_at_datetime)
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS point_event_created_idx
+            ON point_event (created_at_datetime)
+            ''',
+            # Fill the ledger from the existing solutions, dated by the comments that chose (or
+            # removed) them, before the trigger exists so that the existing totals aren't changed
+            '''
+            INSERT INTO point_event (redditor_rowid, kind, points, solution_rowid, comment_rowid,
+                                     created_at_datetime)
+            SELECT solution.author_rowid, 'award', 1, solution.rowid, comment.rowid,
+                coalesce(comment.created_at_datetime, strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+            FROM solution
+                JOIN redditor ON (solution.author_rowid = redditor.rowid)
+                LEFT JOIN comment ON (solution.chosen_by_comment_rowid = comment.rowid)
+            ''',
+            '''
+            INSERT INTO point_event (redditor_rowid, kind, points, solution_rowid, comment_rowid,
+                                     created_at_datetime)
+            SELECT solution.author_rowid, 'remove', -1, solution.rowid, comment.rowid,
+                coalesce(comment.created_at_datetime, strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+            FROM solution
+                JOIN redditor ON (solution.author_rowid = redditor.rowid)
+                LEFT JOIN comment ON (solution.removed_by_comment_rowid = comment.rowid)
+            WHERE solution.removed_by_comment_rowid IS NOT NULL
+            ''',
+            # Points from before solutions were stored (or otherwise not explained by them) become
+            # a single adjustment for each redditor
+            '''
+            INSERT INTO point_event (redditor_rowid, kind, points, note, created_at_datetime)
+            SELECT redditor.rowid, 'adjust',
+                redditor.points - coalesce(sum(point_event.points), 0),
+                'Points from before the points ledger',
+                strftime('%Y-%m-%dT%H:%M:%S', 'now')
+            FROM redditor
+                LEFT JOIN point_event ON (point_event.redditor_rowid = redditor.rowid)
+            GROUP BY redditor.rowid
+            HAVING redditor.points != coalesce(sum(point_event.points), 0)
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS point_event_update_total
+            AFTER INSERT ON point_event
+            BEGIN
+                UPDATE redditor
+                SET points = points + NEW.points
+                WHERE rowid = NEW.redditor_rowid;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS point_event_no_update
+            BEFORE UPDATE ON point_event
+            BEGIN
+                SELECT RAISE(ABORT, 'point_event is append-only');
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS point_event_no_delete
+            BEFORE DELETE ON point_event
+            BEGIN
+                SELECT RAISE(ABORT, 'point_event is append-only');
+            END
+            ''',
+        ],
+        DatabaseVersion(0, 4, 1): [
+            # Leaderboard order, so that the top redditors and ranks can be read from the index
+            '''
+            CREATE INDEX IF NOT EXISTS redditor_points_idx
+            ON redditor (points DESC, name)
+            ''',
+            # Incremented whenever any redditor's points change, so that readers (including other
+            # connections) can cheaply tell whether a cached leaderboard is out of date
+            '''
+            CREATE TABLE IF NOT EXISTS leaderboard_generation (
+                generation INTEGER NOT NULL
+            )
+            ''',
+            '''
+            INSERT INTO leaderboard_generation (generation) VALUES (0)
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS redditor_insert_generation
+            AFTER INSERT ON redditor
+            BEGIN
+                UPDATE leaderboard_generation SET generation = generation + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS redditor_update_generation
+            AFTER UPDATE OF name, points ON redditor
+            BEGIN
+                UPDATE leaderboard_generation SET generation = generation + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS redditor_delete_generation
+            AFTER DELETE ON redditor
+            BEGIN
+                UPDATE leaderboard_generation SET generation = generation + 1;
+            END
+            ''',
+        ],
+        DatabaseVersion(0, 5, 0): [
+            # Comments waiting to be handled by worker processes (see `workqueue`)
+            '''
+            CREATE TABLE IF NOT EXISTS work_item (
+                comment_id TEXT PRIMARY KEY,
+                submission_id TEXT NOT NULL,
+                created_utc REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',   -- 'pending', 'done', or 'failed'
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,                -- Unix timestamp
+                finished_at REAL
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS work_item_pending_idx
+            ON work_item (submission_id)
+            WHERE status = 'pending'
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS work_item_finished_idx
+            ON work_item (finished_at)
+            WHERE status != 'pending'
+            ''',
+            # Which worker owns each submission's items, until when; only one worker at a time may
+            # handle a submission's items, so that its commands are handled in order
+            '''
+            CREATE TABLE IF NOT EXISTS work_lease (
+                submission_id TEXT PRIMARY KEY,
+                worker TEXT NOT NULL,
+                expires_at REAL NOT NULL                  -- Unix timestamp
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS work_lease_worker_idx
+            ON work_lease (worker)
+            ''',
+        ],
+        DatabaseVersion(0, 5, 1): [
+            # What happened to each recent comment with a command, so that comments read again (e.g.
+            # after reconnecting) can be skipped (see `journal`)
+            '''
+            CREATE TABLE IF NOT EXISTS processed_comment (
+                id TEXT PRIMARY KEY,
+                outcome TEXT NOT NULL,      -- 'awarded', 'removed', 'unchanged', or 'rejected'
+                created_utc REAL NOT NULL
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS processed_comment_created_idx
+            ON processed_comment (created_utc)
+            ''',
+        ],
     }
 
-    def __init__(self, dbpath):
+    # Statements run for (nearly) every command comment. These are checked by
+    # `explain_query_plans`, so they should never need to scan a whole table.
+    HAS_ALREADY_SOLVED_ONCE_STMT = '''
+        SELECT count(solution.rowid) AS num_solutions
+        FROM solution
+            JOIN submission ON (solution.submission_rowid = submission.rowid)
+            JOIN redditor ON (solution.author_rowid = redditor.rowid)
+        WHERE submission.id = :submission_id
+            AND redditor.id = :author_id
+    '''
+    ADD_SOLUTION_STMT = '''
+        INSERT INTO solution (submission_rowid, author_rowid, comment_rowid, chosen_by_comment_rowid)
+        SELECT submission.rowid, redditor.rowid, comment.rowid, chosen_by_comment.rowid
+        FROM submission, redditor, comment, comment AS chosen_by_comment
+        WHERE submission.id = :submission_id
+            AND redditor.id = :author_id
+            AND comment.id = :comment_id
+            AND chosen_by_comment.id = :chosen_by_comment_id
+            AND NOT EXISTS (
+                SELECT 1
+                FROM solution
+                WHERE solution.submission_rowid = submission.rowid
+                    AND solution.author_rowid = redditor.rowid
+            )
+    '''
+    SOFT_REMOVE_SOLUTION_STMT = '''
+        UPDATE solution
+        SET removed_by_comment_rowid = (SELECT rowid FROM comment WHERE id = :removed_by_comment_id)
+        WHERE submission_rowid = (SELECT rowid FROM submission WHERE id = :submission_id)
+            AND author_rowid = (SELECT rowid FROM redditor WHERE id = :author_id)
+            AND removed_by_comment_rowid IS NULL
+    '''
+    ADD_SOLUTION_POINT_EVENT_STMT = '''
+        INSERT INTO point_event (redditor_rowid, kind, points, solution_rowid, comment_rowid,
+                                 created_at_datetime)
+        SELECT solution.author_rowid, :kind, :points, solution.rowid, comment.rowid,
+            coalesce(comment.created_at_datetime, :now)
+        FROM solution
+            JOIN submission ON (solution.submission_rowid = submission.rowid)
+            JOIN redditor ON (solution.author_rowid = redditor.rowid)
+            LEFT JOIN comment ON (comment.id = :comment_id)
+        WHERE submission.id = :submission_id
+            AND redditor.id = :author_id
+    '''
+    HOT_STATEMENTS = {
+        'has_already_solved_once': HAS_ALREADY_SOLVED_ONCE_STMT,
+        'add_solution': ADD_SOLUTION_STMT,
+        'soft_remove_solution': SOFT_REMOVE_SOLUTION_STMT,
+        'add_solution_point_event': ADD_SOLUTION_POINT_EVENT_STMT,
+    }
+
+    # Seconds to wait for a lock held by another connection (e.g. a scoreboard reader) to be released
+    BUSY_TIMEOUT = 30
+
+    # Applied to every new connection. WAL journaling lets readers in other processes keep reading
+    # while the bot writes, and with WAL, synchronous=NORMAL is still safe against corruption.
+    CONNECTION_PRAGMAS = [
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -8000',   # Negative means KiB, so this is ~8 MB
+        'PRAGMA temp_store = MEMORY',
+    ]
+
+    # The journal mode can only be set by a connection that can write, so read-only connections rely
+    # on the bot's connection to have set it
+    READ_ONLY_CONNECTION_PRAGMAS = [
+        'PRAGMA query_only = ON',
+        'PRAGMA cache_size = -8000',
+        'PRAGMA temp_store = MEMORY',
+    ]
+
+    def __init__(self, dbpath, read_only=False):
+        """If read_only is True, the database must already exist, and is never changed or migrated;
+        this is meant for readers, like the scoreboard, that share the database with the bot.
+        """
         self.path = dbpath
+        self.read_only = read_only
         self.conn = None
         self.cursor = None
+        self._transaction_depth = 0
+        # Functions to call once the current transaction commits (see `on_commit`)
+        self._commit_callbacks = []
+        # The most recent leaderboard snapshot, if any
+        self._leaderboard_snapshot = None
+
+        # Check before connecting, since connecting creates the file
+        db_exists = os.path.exists(self.path)
+        self._connect()
+        if read_only:
+            logging.info(f'Using existing database (read-only): {self.path}')
+            return
 
-        if not os.path.exists(self.path):
+        if not db_exists:
             logging.info('No database found; creating...')
             self._run_migrations()
             logging.info('Successfully created database')
@@ -222,6 +533,81 @@ class Database:
                 self._run_migrations(current_version)
                 logging.info('Successfully completed all migrations')
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        if self.read_only:
+            # With WAL journaling, this can read while the bot writes, without blocking it
+            uri = f'file:{urllib.request.pathname2url(os.path.abspath(self.path))}?mode=ro'
+            self.conn = sqlite.connect(uri, uri=True, timeout=self.BUSY_TIMEOUT)
+            pragmas = self.READ_ONLY_CONNECTION_PRAGMAS
+        else:
+            self.conn = sqlite.connect(self.path, timeout=self.BUSY_TIMEOUT)
+            pragmas = self.CONNECTION_PRAGMAS
+        self.conn.row_factory = sqlite.Row
+        for pragma in pragmas:
+            self.conn.execute(pragma)
+        self.cursor = self.conn.cursor()
+
+    @contextlib.contextmanager
+    def atomic(self, immediate=False):
+        """Run the body of the with statement as a single transaction, which is committed at the end,
+        or rolled back if an exception is raised. Nested transactions are part of the outermost one.
+
+        If immediate is True, the (outermost) transaction takes the database's write lock as soon as it
+        begins, waiting for any other connection's write to finish first, so that nothing it reads can
+        be changed by another connection before it writes.
+        """
+        if not self.conn:
+            self._connect()
+
+        if immediate and self._transaction_depth == 0 and not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._commit_callbacks.clear()
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            callbacks, self._commit_callbacks = self._commit_callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def on_commit(self, callback):
+        """Call the function once the current (outermost) transaction commits, e.g. to update an
+        in-memory cache of what it wrote. It is never called if the transaction is rolled back, and is
+        called right away if there is no transaction.
+        """
+        if self._transaction_depth == 0:
+            callback()
+        else:
+            self._commit_callbacks.append(callback)
+
+    def close(self):
+        """Commit any pending changes and close the connection to the database."""
+        if not self.conn:
+            return
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+        self.cursor = self.conn = None
+        self._transaction_depth = 0
+        self._commit_callbacks = []
+
     @transaction
     def _run_migrations(self, current_version=None):
         if not current_version:
@@ -285,74 +671,149 @@ class Database:
         self.cursor.execute(insert_stmt, {'id': redditor.id, 'name': redditor.name})
         return self.cursor.rowcount
 
+    @transaction
+    def find_redditor(self, name):
+        """Return the saved Redditor with the given name, or None if there isn't one."""
+        self.cursor.execute('SELECT id, name FROM redditor WHERE name = :name', {'name': name})
+        row = self.cursor.fetchone()
+        return Redditor(row['id'], row['name']) if row else None
+
     @transaction
     def has_already_solved_once(self, submission, solver):
-        select_stmt = '''
-            SELECT count(solution.rowid) AS num_solutions
-            FROM solution
-                JOIN submission ON (solution.submission_rowid = submission.rowid)
-                JOIN redditor ON (solution.author_rowid = redditor.rowid)
-            WHERE submission.id = :submission_id
-                AND redditor.id = :author_id
-        '''
-        self.cursor.execute(select_stmt, {'submission_id': submission.id, 'author_id': solver.id})
+        self.cursor.execute(self.HAS_ALREADY_SOLVED_ONCE_STMT, {'submission_id': submission.id, 'author_id': solver.id})
         row = self.cursor.fetchone()
         return row and row['num_solutions'] > 0
 
+    @transaction
     def add_point_for_solution(self, submission, solver, solution_comment, chooser, chosen_by_comment):
-        self._add_submission(submission)
-        if not self._is_comment_already_saved(solution_comment):
-            self._add_comment(solution_comment, solver)
-        if not self._is_comment_already_saved(chosen_by_comment):
-            self._add_comment(chosen_by_comment, chooser)
-
-        self._update_points(solver, 1)
-        rowcount = self._add_solution(submission, solver, solution_comment, chosen_by_comment)
-        if rowcount == 0:
-            # Was not able to add solution, probably because user has already solved this submission
-            self._update_points(solver, -1)
-        # if rowcount > 0:
-        #     # TODO update author_rowid for comment?
-        return rowcount
+        """Record the solution and award the solver a point, all in a single transaction.
+
+        Return the solver's point total afterwards. If the solver has already solved this submission,
+        nothing is changed.
+        """
+        self._add_submissions([submission])
+        self._add_comments([(solution_comment, solver), (chosen_by_comment, chooser)])
+        self.add_redditor(solver)
+
+        params = {
+            'submission_id': submission.id,
+            'author_id': solver.id,
+            'comment_id': solution_comment.id,
+            'chosen_by_comment_id': chosen_by_comment.id,
+        }
+        self.cursor.execute(self.ADD_SOLUTION_STMT, params)
+        if self.cursor.rowcount > 0:
+            self._add_solution_point_event(submission, solver, 'award', 1, chosen_by_comment.id)
+        # Otherwise, was not able to add solution, because user has already solved this submission
+        return self.get_points(solver)
 
+    @transaction
     def soft_remove_point_for_solution(self, submission, solver, remover, removed_by_comment):
-        if not self._is_comment_already_saved(removed_by_comment):
-            self._add_comment(removed_by_comment, remover)
-        rowcount = self._soft_remove_solution(submission, solver, removed_by_comment)
-        if rowcount > 0:
-            rowcount = self._update_points(solver, -1)
-        return rowcount
+        """Mark the solution as removed and take the point back, all in a single transaction.
+
+        Return the solver's point total afterwards, or None if there is no (unremoved) solution, in
+        which case nothing is changed.
+        """
+        self._add_comments([(removed_by_comment, remover)])
+        params = {
+            'submission_id': submission.id,
+            'author_id': solver.id,
+            'removed_by_comment_id': removed_by_comment.id,
+        }
+        self.cursor.execute(self.SOFT_REMOVE_SOLUTION_STMT, params)
+        if self.cursor.rowcount == 0:
+            return None
+        self._add_solution_point_event(submission, solver, 'remove', -1, removed_by_comment.id)
+        return self.get_points(solver)
 
     @transaction
     def add_back_point_for_solution(self, submission, solver):
-        self._update_points(solver, 1)
-        submission_rowid = self._get_submission_rowid(submission)
-        author_rowid = self._get_redditor_rowid(solver)
-        params = {'submission_rowid': submission_rowid, 'author_rowid': author_rowid}
+        """Undo `soft_remove_point_for_solution`. Return the solver's point total afterwards. If there is
+        no removed solution, nothing is changed.
+        """
+        params = {'submission_id': submission.id, 'author_id': solver.id}
         update_stmt = '''
             UPDATE solution
             SET removed_by_comment_rowid = NULL
-            WHERE submission_rowid = :submission_rowid
-                AND author_rowid = :author_rowid
+            WHERE submission_rowid = (SELECT rowid FROM submission WHERE id = :submission_id)
+                AND author_rowid = (SELECT rowid FROM redditor WHERE id = :author_id)
+                AND removed_by_comment_rowid IS NOT NULL
         '''
-        return self.cursor.execute(update_stmt, params)
+        self.cursor.execute(update_stmt, params)
+        if self.cursor.rowcount > 0:
+            self._add_solution_point_event(submission, solver, 'restore', 1)
+        return self.get_points(solver)
 
     @transaction
     def remove_point_and_delete_solution(self, submission, solver):
-        params = {
-            'submission_rowid': self._get_submission_rowid(submission),
-            'author_rowid': self._get_redditor_rowid(solver)
-        }
+        """Undo `add_point_for_solution`. Return the solver's point total afterwards."""
+        # The event has to be added while the solution still exists
+        self._add_solution_point_event(submission, solver, 'remove', -1)
+        params = {'submission_id': submission.id, 'author_id': solver.id}
         delete_stmt = '''
             DELETE FROM solution
-            WHERE submission_rowid = :submission_rowid
-                AND author_rowid = :author_rowid
+            WHERE submission_rowid = (SELECT rowid FROM submission WHERE id = :submission_id)
+                AND author_rowid = (SELECT rowid FROM redditor WHERE id = :author_id)
         '''
         self.cursor.execute(delete_stmt, params)
-        return self._update_points(solver, -1)
+        return self.get_points(solver)
+
+    @transaction
+    def adjust_points(self, redditor, points, note=None):
+        """Add (or, if negative, subtract) points that aren't for any solution, e.g. to correct a
+        redditor's total by hand. Return the redditor's point total afterwards.
+        """
+        self.add_redditor(redditor)
+        params = {
+            'id': redditor.id,
+            'points': points,
+            'note': note,
+            'now': datetime.datetime.utcnow().isoformat(),
+        }
+        insert_stmt = '''
+            INSERT INTO point_event (redditor_rowid, kind, points, note, created_at_datetime)
+            SELECT rowid, 'adjust', :points, :note, :now
+            FROM redditor
+            WHERE id = :id
+        '''
+        self.cursor.execute(insert_stmt, params)
+        return self.get_points(redditor)
+
+    @transaction
+    def recompute_points(self):
+        """Recompute every redditor's point total from the ledger, in case the totals have somehow
+        drifted from it. Return the number of totals that were corrected.
+        """
+        # Each sum only reads the redditor's own events, via point_event_redditor_idx
+        update_stmt = '''
+            UPDATE redditor
+            SET points = (SELECT coalesce(sum(points), 0) FROM point_event WHERE redditor_rowid = redditor.rowid)
+            WHERE points != (SELECT coalesce(sum(points), 0) FROM point_event WHERE redditor_rowid = redditor.rowid)
+        '''
+        self.cursor.execute(update_stmt)
+        return self.cursor.rowcount
+
+    @transaction
+    def get_point_events(self, redditor):
+        """Return every change to the redditor's points, oldest first."""
+        select_stmt = '''
+            SELECT point_event.kind, point_event.points, point_event.note,
+                point_event.created_at_datetime, comment.id AS comment_id
+            FROM point_event
+                JOIN redditor ON (point_event.redditor_rowid = redditor.rowid)
+                LEFT JOIN comment ON (point_event.comment_rowid = comment.rowid)
+            WHERE redditor.id = :id
+            ORDER BY point_event.created_at_datetime, point_event.rowid
+        '''
+        self.cursor.execute(select_stmt, {'id': redditor.id})
+        return self.cursor.fetchall()
 
     @transaction
-    def get_points(self, redditor, add_if_none=False):
+    def get_points(self, redditor, add_if_none=False, as_of=None):
+        """Return the redditor's point total, or their total as of the given (Unix) time if any."""
+        if as_of is not None:
+            return self._get_points_as_of(redditor, as_of)
+
         params = {'id': redditor.id, 'name': redditor.name}
         select_stmt = '''
             SELECT points
@@ -369,117 +830,602 @@ class Database:
 
         return points
 
-    ### Internal Methods ###
+    @transaction
+    def get_all_points(self):
+        """Return a (name, points) row for every redditor."""
+        self.cursor.execute('SELECT name, points FROM redditor')
+        return self.cursor.fetchall()
 
-    def _get_submission_rowid(self, submission):
-        return self._get_rowid_from_reddit_id('SELECT rowid FROM submission WHERE id = :reddit_id', {'reddit_id': submission.id})
+    @transaction
+    def get_latest_comment_timestamp(self):
+        """Return the (Unix) creation time of the newest saved comment, or None if there are none."""
+        self.cursor.execute('SELECT max(created_at_datetime) AS latest FROM comment')
+        row = self.cursor.fetchone()
+        return iso_to_reddit_datetime(row['latest']) if row['latest'] else None
 
-    def _get_comment_rowid(self, comment):
-        return self._get_rowid_from_reddit_id('SELECT rowid FROM comment WHERE id = :reddit_id', {'reddit_id': comment.id})
+    @transaction
+    def get_saved_comment_ids(self, comment_ids):
+        """Return the subset of the given comment ids that have already been saved."""
+        comment_ids = list(comment_ids)
+        saved_ids = set()
+        # Stay well under SQLite's limit on the number of parameters per statement
+        for start in range(0, len(comment_ids), 500):
+            batch = comment_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            self.cursor.execute(f'SELECT id FROM comment WHERE id IN ({placeholders})', batch)
+            saved_ids.update(row['id'] for row in self.cursor.fetchall())
+        return saved_ids
 
-    def _get_redditor_rowid(self, redditor):
-        return self._get_rowid_from_reddit_id('SELECT rowid FROM redditor WHERE id = :reddit_id', {'reddit_id': redditor.id})
+    @transaction
+    def explain_query_plans(self):
+        """Return the `EXPLAIN QUERY PLAN` output for each of the `HOT_STATEMENTS`, as a dict mapping
+        each statement name to a list of plan lines.
+        """
+        plans = {}
+        for name, stmt in self.HOT_STATEMENTS.items():
+            # Every named parameter needs a value, but the values themselves don't matter
+            params = {param: '' for param in re.findall(r':(\w+)', stmt)}
+            self.cursor.execute(f'EXPLAIN QUERY PLAN {stmt}', params)
+            plans[name] = [row['detail'] for row in self.cursor.fetchall()]
+        return plans
+
+    ### Leaderboard Methods ###
+
+    # Only redditors with points are ranked. Redditors with the same points share a rank, and the
+    # next rank skips past them (e.g. 1, 2, 2, 4).
 
     @transaction
-    def _get_rowid_from_reddit_id(self, stmt, params):
-        self.cursor.execute(stmt, params)
-        row = self.cursor.fetchone()
-        return row['rowid'] if row else None
+    def get_leaderboard(self, limit=10, offset=0):
+        """Return a page of the leaderboard, as a list of LeaderboardEntry tuples."""
+        params = {'limit': limit, 'offset': offset}
+        select_stmt = '''
+            SELECT name, points
+            FROM redditor
+            WHERE points > 0
+            ORDER BY points DESC, name
+            LIMIT :limit OFFSET :offset
+        '''
+        self.cursor.execute(select_stmt, params)
+        rows = self.cursor.fetchall()
+        if not rows:
+            return []
+
+        # Only the first rank needs to be counted; the rest follow from the points
+        entries = []
+        rank = self._count_ahead_of(rows[0]['points']) + 1
+        for position, row in enumerate(rows):
+            if position > 0 and row['points'] < rows[position - 1]['points']:
+                rank = offset + position + 1
+            entries.append(LeaderboardEntry(rank, row['name'], row['points']))
+        return entries
+
+    @transaction
+    def get_rank(self, redditor):
+        """Return the redditor's LeaderboardEntry, or None if they don't have any points."""
+        points = self.get_points(redditor)
+        if points <= 0:
+            return None
+        return LeaderboardEntry(self._count_ahead_of(points) + 1, redditor.name, points)
+
+    @transaction
+    def get_leaderboard_around(self, redditor, radius=2):
+        """Return the part of the leaderboard with up to `radius` entries on either side of the
+        redditor's, or an empty list if they don't have any points.
+        """
+        points = self.get_points(redditor)
+        if points <= 0:
+            return []
+        params = {'points': points, 'name': redditor.name}
+        count_stmt = '''
+            SELECT count(*) AS position
+            FROM redditor
+            WHERE points > :points
+                OR (points = :points AND name < :name)
+        '''
+        self.cursor.execute(count_stmt, params)
+        position = self.cursor.fetchone()['position']
+        offset = max(position - radius, 0)
+        return self.get_leaderboard(limit=position - offset + radius + 1, offset=offset)
+
+    @transaction
+    def get_leaderboard_as_of(self, timestamp, limit=10):
+        """Return the top of the leaderboard as of the given (Unix) time, from the points ledger."""
+        params = {'as_of': reddit_datetime_to_iso(timestamp), 'limit': limit}
+        select_stmt = '''
+            SELECT redditor.name, sum(point_event.points) AS points
+            FROM point_event
+                JOIN redditor ON (point_event.redditor_rowid = redditor.rowid)
+            WHERE point_event.created_at_datetime <= :as_of
+            GROUP BY point_event.redditor_rowid
+            HAVING sum(point_event.points) > 0
+            ORDER BY points DESC, redditor.name
+            LIMIT :limit
+        '''
+        self.cursor.execute(select_stmt, params)
+        entries = []
+        for position, row in enumerate(self.cursor.fetchall()):
+            if not entries or row['points'] < entries[-1].points:
+                rank = position + 1
+            entries.append(LeaderboardEntry(rank, row['name'], row['points']))
+        return entries
 
     @transaction
-    def _add_comment(self, comment, author):
+    def get_leaderboard_generation(self):
+        """Return a number that changes whenever any redditor's points change."""
+        self.cursor.execute('SELECT generation FROM leaderboard_generation')
+        return self.cursor.fetchone()['generation']
+
+    @transaction
+    def get_leaderboard_snapshot(self, size=LEADERBOARD_SNAPSHOT_SIZE):
+        """Return a LeaderboardSnapshot of the top `size` entries, which is cached until the points
+        change.
+        """
+        generation = self.get_leaderboard_generation()
+        snapshot = self._leaderboard_snapshot
+        if snapshot is None or snapshot.generation != generation or snapshot.size < size:
+            snapshot = LeaderboardSnapshot(generation, size, tuple(self.get_leaderboard(limit=size)))
+            self._leaderboard_snapshot = snapshot
+        if snapshot.size > size:
+            return snapshot._replace(size=size, entries=snapshot.entries[:size])
+        return snapshot
+
+    ### Outbox Methods ###
+
+    @transaction
+    def add_outbox_reply(self, subreddit_name, comment_id, body):
+        return self._add_outbox_item({
+            'kind': 'reply',
+            'subreddit': subreddit_name,
+            'target': comment_id,
+            'body': body,
+            'flair_text': None,
+            'flair_template_id': None,
+        })
+
+    @transaction
+    def add_outbox_flair(self, subreddit_name, redditor_name, flair_text, flair_template_id):
+        return self._add_outbox_item({
+            'kind': 'flair',
+            'subreddit': subreddit_name,
+            'target': redditor_name,
+            'body': None,
+            'flair_text': flair_text,
+            'flair_template_id': flair_template_id,
+        })
+
+    @transaction
+    def get_due_outbox_items(self, limit, now=None):
+        """Return up to `limit` pending outbox items that are due to be sent, oldest first."""
+        params = {'now': time.time() if now is None else now, 'limit': limit}
+        select_stmt = '''
+            SELECT rowid, *
+            FROM outbox
+            WHERE status = 'pending'
+                AND next_attempt_at <= :now
+            ORDER BY rowid
+            LIMIT :limit
+        '''
+        self.cursor.execute(select_stmt, params)
+        return self.cursor.fetchall()
+
+    @transaction
+    def count_pending_outbox_items(self):
+        """Return the number of outbox items waiting to be sent, whether or not they are due yet."""
+        select_stmt = '''
+            SELECT count(*)
+            FROM outbox
+            WHERE status = 'pending'
+        '''
+        self.cursor.execute(select_stmt)
+        return self.cursor.fetchone()[0]
+
+    @transaction
+    def update_outbox_item(self, rowid, status, attempts, next_attempt_at=None, last_error=None):
         params = {
-            'id': comment.id,
-            'author_id': author.id,
-            'created_at_datetime': reddit_datetime_to_iso(comment.created_utc)
+            'rowid': rowid,
+            'status': status,
+            'attempts': attempts,
+            'next_attempt_at': next_attempt_at,
+            'last_error': last_error,
         }
-        insert_stmt = '''
-            INSERT INTO comment (id, author_id, created_at_datetime)
-            VALUES (:id, :author_id, :created_at_datetime)
+        update_stmt = '''
+            UPDATE outbox
+            SET status = :status,
+                attempts = :attempts,
+                next_attempt_at = coalesce(:next_attempt_at, next_attempt_at),
+                last_error = :last_error
+            WHERE rowid = :rowid
         '''
-        self.cursor.execute(insert_stmt, params)
+        self.cursor.execute(update_stmt, params)
         return self.cursor.rowcount
 
     @transaction
-    def _is_comment_already_saved(self, comment):
-        select_stmt = 'SELECT COUNT(*) AS comment_count FROM comment WHERE id = :id'
-        self.cursor.execute(select_stmt, {'id': comment.id})
-        row = self.cursor.fetchone()
-        return row['comment_count'] == 1
+    def delete_sent_outbox_items(self, before):
+        """Delete the items that were sent (or skipped) and added before the given Unix timestamp. Return
+        the number deleted. Failed items are kept, so that they can be looked into.
+        """
+        params = {'before': datetime.datetime.utcfromtimestamp(before).isoformat()}
+        delete_stmt = '''
+            DELETE FROM outbox
+            WHERE status IN ('sent', 'skipped')
+                AND created_at_datetime < :before
+        '''
+        self.cursor.execute(delete_stmt, params)
+        return self.cursor.rowcount
+
+    ### Journal Methods ###
+
+    @transaction
+    def add_processed_comment(self, comment_id, outcome, created_utc):
+        insert_stmt = '''
+            INSERT OR REPLACE INTO processed_comment (id, outcome, created_utc)
+            VALUES (:id, :outcome, :created_utc)
+        '''
+        self.cursor.execute(insert_stmt, {'id': comment_id, 'outcome': outcome, 'created_utc': created_utc})
+
+    @transaction
+    def get_processed_comments(self, comment_ids):
+        """Return the outcome of each of the given comments that is in the journal, keyed by id."""
+        comment_ids = list(comment_ids)
+        outcomes = {}
+        # Stay well under SQLite's limit on the number of parameters per statement
+        for start in range(0, len(comment_ids), 500):
+            batch = comment_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            self.cursor.execute(f'SELECT id, outcome FROM processed_comment WHERE id IN ({placeholders})', batch)
+            outcomes.update((row['id'], row['outcome']) for row in self.cursor.fetchall())
+        return outcomes
+
+    @transaction
+    def get_latest_processed_comment_timestamp(self):
+        """Return the (Unix) creation time of the newest comment in the journal, or None if it's empty."""
+        self.cursor.execute('SELECT max(created_utc) FROM processed_comment')
+        return self.cursor.fetchone()[0]
+
+    @transaction
+    def delete_processed_comments(self, before):
+        """Delete the journal entries of comments created before the given Unix timestamp. Return the
+        number deleted.
+        """
+        self.cursor.execute('DELETE FROM processed_comment WHERE created_utc < :before', {'before': before})
+        return self.cursor.rowcount
+
+    ### Work Queue Methods ###
+
+    # The work queue is only used when comments are handled by separate worker processes (see
+    # `workqueue`); the lease of each submission's items is checked by the transaction that finishes
+    # each item, so that an item is only ever finished once
 
     @transaction
-    def _add_submission(self, submission):
-        # A "deleted" submission does not have an author, so we need to check whether it exists
-        if submission.author:
-            insert_stmt = '''
-                INSERT OR IGNORE INTO submission (id, author_id)
-                VALUES (:id, :author_id)
+    def add_work_items(self, comments, now=None):
+        """Add the comments to the work queue, skipping any that were already added. Return the number
+        that were added.
+        """
+        now = time.time() if now is None else now
+        params = [
+            {
+                'comment_id': comment.id,
+                'submission_id': comment.link_id.partition('_')[2],
+                'created_utc': comment.created_utc,
+                'enqueued_at': now,
+            }
+            for comment in comments
+        ]
+        insert_stmt = '''
+            INSERT OR IGNORE INTO work_item (comment_id, submission_id, created_utc, enqueued_at)
+            VALUES (:comment_id, :submission_id, :created_utc, :enqueued_at)
+        '''
+        before = self.conn.total_changes
+        self.cursor.executemany(insert_stmt, params)
+        return self.conn.total_changes - before
+
+    def claim_work_items(self, worker, limit, lease_duration, now=None):
+        """Lease the submissions with the oldest pending items that no other worker holds a (live)
+        lease on, and return up to `limit` of their pending items, oldest first.
+        """
+        now = time.time() if now is None else now
+        params = {'worker': worker, 'limit': limit, 'now': now, 'expires_at': now + lease_duration}
+        # The submissions are chosen and leased in one transaction, so two workers can't both lease one
+        with self.atomic(immediate=True):
+            select_stmt = '''
+                SELECT work_item.submission_id
+                FROM work_item
+                    LEFT JOIN work_lease ON (work_lease.submission_id = work_item.submission_id)
+                WHERE work_item.status = 'pending'
+                    AND (work_lease.worker IS NULL
+                         OR work_lease.worker = :worker
+                         OR work_lease.expires_at < :now)
+                GROUP BY work_item.submission_id
+                ORDER BY min(work_item.rowid)
+                LIMIT :limit
             '''
-            self.cursor.execute(insert_stmt, {'id': submission.id, 'author_id': submission.author.id})
-        else:
-            insert_stmt = '''
-                INSERT OR IGNORE INTO submission (id)
-                VALUES (:id)
+            self.cursor.execute(select_stmt, params)
+            submission_ids = [row['submission_id'] for row in self.cursor.fetchall()]
+            if not submission_ids:
+                return []
+
+            lease_stmt = '''
+                INSERT OR REPLACE INTO work_lease (submission_id, worker, expires_at)
+                VALUES (:submission_id, :worker, :expires_at)
             '''
-            self.cursor.execute(insert_stmt, {'id': submission.id})
+            self.cursor.executemany(lease_stmt, [dict(params, submission_id=submission_id)
+                                                 for submission_id in submission_ids])
+
+            placeholders = ', '.join('?' * len(submission_ids))
+            items_stmt = f'''
+                SELECT rowid, *
+                FROM work_item
+                WHERE status = 'pending'
+                    AND submission_id IN ({placeholders})
+                ORDER BY rowid
+                LIMIT ?
+            '''
+            self.cursor.execute(items_stmt, [*submission_ids, limit])
+            return self.cursor.fetchall()
+
+    @transaction
+    def renew_work_lease(self, submission_id, worker, lease_duration, now=None):
+        """Extend the worker's lease on the submission's items. Return False if it no longer holds it."""
+        now = time.time() if now is None else now
+        update_stmt = '''
+            UPDATE work_lease
+            SET expires_at = :expires_at
+            WHERE submission_id = :submission_id
+                AND worker = :worker
+                AND expires_at >= :now
+        '''
+        self.cursor.execute(update_stmt, {'submission_id': submission_id, 'worker': worker, 'now': now,
+                                          'expires_at': now + lease_duration})
+        return self.cursor.rowcount > 0
+
+    @transaction
+    def renew_work_leases(self, worker, lease_duration, now=None):
+        """Extend every lease that the worker still holds. Return the number of leases extended."""
+        now = time.time() if now is None else now
+        update_stmt = '''
+            UPDATE work_lease
+            SET expires_at = :expires_at
+            WHERE worker = :worker
+                AND expires_at >= :now
+        '''
+        self.cursor.execute(update_stmt, {'worker': worker, 'now': now, 'expires_at': now + lease_duration})
         return self.cursor.rowcount
 
     @transaction
-    def _add_solution(self, submission, solver, comment, chosen_by_comment):
-        submission_rowid = self._get_submission_rowid(submission)
-        author_rowid = self._get_redditor_rowid(solver)
-        comment_rowid = self._get_comment_rowid(comment)
-        chosen_by_comment_rowid = self._get_comment_rowid(chosen_by_comment)
+    def release_work_leases(self, worker):
+        self.cursor.execute('DELETE FROM work_lease WHERE worker = :worker', {'worker': worker})
+        return self.cursor.rowcount
+
+    @transaction
+    def finish_work_item(self, comment_id, status, attempts=None, last_error=None, now=None):
+        """Mark the item as 'done' or 'failed', or (with status 'pending') leave it to be retried."""
         params = {
-            'submission_rowid': submission_rowid,
-            'author_rowid': author_rowid,
-            'comment_rowid': comment_rowid,
-            'chosen_by_comment_rowid': chosen_by_comment_rowid
+            'comment_id': comment_id,
+            'status': status,
+            'attempts': attempts,
+            'last_error': last_error,
+            'finished_at': None if status == 'pending' else (time.time() if now is None else now),
         }
+        update_stmt = '''
+            UPDATE work_item
+            SET status = :status,
+                attempts = coalesce(:attempts, attempts + 1),
+                last_error = :last_error,
+                finished_at = :finished_at
+            WHERE comment_id = :comment_id
+        '''
+        self.cursor.execute(update_stmt, params)
+        return self.cursor.rowcount
+
+    @transaction
+    def count_pending_work_items(self):
+        self.cursor.execute("SELECT count(*) FROM work_item WHERE status = 'pending'")
+        return self.cursor.fetchone()[0]
+
+    @transaction
+    def get_latest_work_item_timestamp(self):
+        """Return the created_utc of the newest comment ever added to the work queue, or None."""
+        self.cursor.execute('SELECT max(created_utc) FROM work_item')
+        return self.cursor.fetchone()[0]
+
+    @transaction
+    def delete_finished_work_items(self, before):
+        """Delete the items that were finished before the given Unix timestamp. Return the number
+        deleted.
+        """
+        delete_stmt = '''
+            DELETE FROM work_item
+            WHERE status != 'pending'
+                AND finished_at < :before
+        '''
+        self.cursor.execute(delete_stmt, {'before': before})
+        return self.cursor.rowcount
+
+    ### Rebuild Methods ###
+
+    # Rebuilding the database from the subreddit's history (see `rebuild`) happens in a separate,
+    # fresh database, which tracks the submissions that have already been rebuilt so that an
+    # interrupted rebuild can be resumed
+
+    @transaction
+    def start_rebuild(self):
+        create_stmt = '''
+            CREATE TABLE IF NOT EXISTS rebuilt_submission (
+                id TEXT PRIMARY KEY
+            )
+        '''
+        self.cursor.execute(create_stmt)
+
+    @transaction
+    def get_rebuilt_submission_ids(self):
+        self.cursor.execute('SELECT id FROM rebuilt_submission')
+        return {row['id'] for row in self.cursor.fetchall()}
+
+    @transaction
+    def add_rebuilt_solutions(self, submission_ids, solutions):
+        """Save the solutions found in the given submissions, and mark the submissions as rebuilt, all
+        in a single transaction.
+
+        Each solution has the same fields as `rebuild.RebuiltSolution`. Its point (and the point's
+        removal, if any) is added to the ledger, dated by the comment that chose (or removed) it.
+        """
+        comments_and_authors = []
+        for solution in solutions:
+            comments_and_authors.append((solution.solution_comment, solution.solver))
+            comments_and_authors.append((solution.chosen_by_comment, solution.chooser))
+            if solution.removed_by_comment:
+                comments_and_authors.append((solution.removed_by_comment, solution.remover))
+        self._add_submissions({solution.submission for solution in solutions})
+        self._add_comments(comments_and_authors)
+        self._add_redditors({solution.solver for solution in solutions})
+
+        params = [
+            {
+                'submission_id': solution.submission.id,
+                'author_id': solution.solver.id,
+                'comment_id': solution.solution_comment.id,
+                'chosen_by_comment_id': solution.chosen_by_comment.id,
+                'removed_by_comment_id': (solution.removed_by_comment.id
+                                          if solution.removed_by_comment else None),
+            }
+            for solution in solutions
+        ]
+        insert_stmt = '''
+            INSERT OR IGNORE INTO solution (submission_rowid, author_rowid, comment_rowid,
+                                            chosen_by_comment_rowid, removed_by_comment_rowid)
+            SELECT submission.rowid, redditor.rowid, comment.rowid, chosen_by_comment.rowid,
+                (SELECT rowid FROM comment WHERE id = :removed_by_comment_id)
+            FROM submission, redditor, comment, comment AS chosen_by_comment
+            WHERE submission.id = :submission_id
+                AND redditor.id = :author_id
+                AND comment.id = :comment_id
+                AND chosen_by_comment.id = :chosen_by_comment_id
+        '''
+        self.cursor.executemany(insert_stmt, params)
+
+        now = datetime.datetime.utcnow().isoformat()
+        event_params = []
+        for solution in solutions:
+            event = {'submission_id': solution.submission.id, 'author_id': solution.solver.id, 'now': now}
+            event_params.append(dict(event, kind='award', points=1, comment_id=solution.chosen_by_comment.id))
+            if solution.removed_by_comment:
+                event_params.append(dict(event, kind='remove', points=-1,
+                                         comment_id=solution.removed_by_comment.id))
+        self.cursor.executemany(self.ADD_SOLUTION_POINT_EVENT_STMT, event_params)
+
+        self.cursor.executemany('INSERT OR IGNORE INTO rebuilt_submission (id) VALUES (?)',
+                                [(submission_id,) for submission_id in submission_ids])
+
+    @transaction
+    def finish_rebuild(self):
+        """Check every redditor's points against the ledger, and drop the rebuild's bookkeeping."""
+        self.recompute_points()
+        self.cursor.execute('DROP TABLE IF EXISTS rebuilt_submission')
+        self.cursor.execute('ANALYZE')
+
+    def backup(self, path):
+        """Copy the whole database to the given path."""
+        if not self.conn:
+            self._connect()
+        dest = sqlite.connect(path)
+        try:
+            self.conn.backup(dest)
+        finally:
+            dest.close()
+
+    ### Internal Methods ###
+
+    @transaction
+    def _add_outbox_item(self, params):
+        params = dict(params, next_attempt_at=time.time(),
+                      created_at_datetime=datetime.datetime.utcnow().isoformat())
         insert_stmt = '''
-            INSERT INTO solution (submission_rowid, author_rowid, comment_rowid, chosen_by_comment_rowid)
-            VALUES (:submission_rowid, :author_rowid, :comment_rowid, :chosen_by_comment_rowid)
+            INSERT INTO outbox (kind, subreddit, target, body, flair_text, flair_template_id,
+                                next_attempt_at, created_at_datetime)
+            VALUES (:kind, :subreddit, :target, :body, :flair_text, :flair_template_id,
+                    :next_attempt_at, :created_at_datetime)
         '''
         self.cursor.execute(insert_stmt, params)
+        return self.cursor.lastrowid
+
+    @transaction
+    def _add_comments(self, comments_and_authors):
+        params = [
+            {
+                'id': comment.id,
+                'author_id': author.id,
+                'created_at_datetime': reddit_datetime_to_iso(comment.created_utc)
+            }
+            for comment, author in comments_and_authors
+        ]
+        insert_stmt = '''
+            INSERT INTO comment (id, author_id, created_at_datetime)
+            VALUES (:id, :author_id, :created_at_datetime)
+            ON CONFLICT (id) DO NOTHING
+        '''
+        self.cursor.executemany(insert_stmt, params)
+        return self.cursor.rowcount
+
+    @transaction
+    def _add_submissions(self, submissions):
+        # A "deleted" submission does not have an author
+        params = [
+            {
+                'id': submission.id,
+                'author_id': submission.author.id if submission.author else None,
+            }
+            for submission in submissions
+        ]
+        insert_stmt = '''
+            INSERT INTO submission (id, author_id)
+            VALUES (:id, :author_id)
+            ON CONFLICT (id) DO NOTHING
+        '''
+        self.cursor.executemany(insert_stmt, params)
+        return self.cursor.rowcount
+
+    @transaction
+    def _add_redditors(self, redditors):
+        params = [{'id': redditor.id, 'name': redditor.name} for redditor in redditors]
+        insert_stmt = '''
+            INSERT OR IGNORE INTO redditor (id, name)
+            VALUES (:id, :name)
+        '''
+        self.cursor.executemany(insert_stmt, params)
         return self.cursor.rowcount
 
     @transaction
-    def _soft_remove_solution(self, submission, solver, removed_by_comment):
-        submission_rowid = self._get_submission_rowid(submission)
-        author_rowid = self._get_redditor_rowid(solver)
-        removed_by_comment_rowid = self._get_comment_rowid(removed_by_comment)
+    def _add_solution_point_event(self, submission, solver, kind, points, comment_id=None):
         params = {
-            'submission_rowid': submission_rowid,
-            'author_rowid': author_rowid,
-            'removed_by_comment_rowid': removed_by_comment_rowid,
+            'submission_id': submission.id,
+            'author_id': solver.id,
+            'kind': kind,
+            'points': points,
+            'comment_id': comment_id,
+            'now': datetime.datetime.utcnow().isoformat(),
         }
-        update_stmt = '''
-            UPDATE solution
-            SET removed_by_comment_rowid = :removed_by_comment_rowid
-            WHERE submission_rowid = :submission_rowid AND author_rowid = :author_rowid
-        '''
-        self.cursor.execute(update_stmt, params)
+        self.cursor.execute(self.ADD_SOLUTION_POINT_EVENT_STMT, params)
         return self.cursor.rowcount
 
     @transaction
-    def _update_points(self, redditor, points_modifier):
-        """points_modifier is positive to add points, negative to subtract."""
-        points = self.get_points(redditor, add_if_none=True)
-        if points + points_modifier <= 0:
-            return self.remove_redditor(redditor)
-        else:
-            params = {
-                'id': redditor.id,
-                'name': redditor.name,
-                'points': points + points_modifier,
-            }
-            update_stmt = '''
-                UPDATE redditor
-                SET points = :points
-                WHERE id = :id AND name = :name
-            '''
-            self.cursor.execute(update_stmt, params)
-            return self.cursor.rowcount
+    def _count_ahead_of(self, points):
+        """Return the number of redditors with more than the given points."""
+        self.cursor.execute('SELECT count(*) AS num_ahead FROM redditor WHERE points > :points',
+                            {'points': points})
+        return self.cursor.fetchone()['num_ahead']
+
+    @transaction
+    def _get_points_as_of(self, redditor, timestamp):
+        params = {'id': redditor.id, 'as_of': reddit_datetime_to_iso(timestamp)}
+        select_stmt = '''
+            SELECT coalesce(sum(point_event.points), 0) AS points
+            FROM point_event
+                JOIN redditor ON (point_event.redditor_rowid = redditor.rowid)
+            WHERE redditor.id = :id
+                AND point_event.created_at_datetime <= :as_of
+        '''
+        self.cursor.execute(select_stmt, params)
+        return self.cursor.fetchone()['points']
 
 
 ### Utility ###
@@ -488,3 +1434,7 @@ class Database:
 def reddit_datetime_to_iso(timestamp):
     return datetime.datetime.utcfromtimestamp(timestamp).isoformat()
 
+
+def iso_to_reddit_datetime(iso_string):
+    dt = datetime.datetime.fromisoformat(iso_string)
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
@@ -0,0 +1,135 @@
+"""A journal of the comments with commands that the bot has handled, and what happened to each one.
+
+The comment stream is read from the newest comments that Reddit lists each time the bot connects, so
+the comments read before and after reconnecting overlap, and none posted in between are missed. The
+journal lets the bot skip the ones it has already handled. Each entry is just a comment's id, outcome
+and creation time, saved in the database in the same transaction as any point change for the comment.
+
+Checking the journal is cheap. Recent entries are also kept in a bounded in-memory map, and a comment
+created after the newest entry can't be in the journal, so the database is only read for comments
+from around the time the bot reconnected. Entries for comments older than the retention period are
+deleted as the bot runs, since the stream never goes back that far.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+### Globals ###
+
+# Default number of entries to keep in memory, least recently used first out
+DEFAULT_MAX_ENTRIES = 10000
+
+# Default seconds to keep entries for, by the comment's creation time
+DEFAULT_RETENTION = 3 * 24 * 60 * 60
+
+# Seconds between deletions of old entries from each database
+PRUNE_INTERVAL = 60 * 60
+
+_max_entries = DEFAULT_MAX_ENTRIES
+_retention = DEFAULT_RETENTION
+
+# Recent entries' outcomes, keyed by database path and comment id
+_entries = OrderedDict()
+
+# The creation time of the newest comment in each database's journal (None if it's empty), and when
+# each database's old entries should next be deleted, keyed by database path
+_newest = {}
+_next_prune = {}
+
+# The journal may be used by each subreddit's database thread in the async engine
+_lock = threading.Lock()
+
+### Functions ###
+
+
+def configure(max_entries=DEFAULT_MAX_ENTRIES, retention=DEFAULT_RETENTION):
+    global _max_entries, _retention
+    with _lock:
+        _max_entries = max_entries
+        _retention = retention
+        _evict()
+
+
+def record(db, comment, outcome):
+    """Add the comment's outcome to the journal. Call this in the same transaction as any point
+    change for the comment.
+    """
+    db.add_processed_comment(comment.id, outcome, comment.created_utc)
+    # Only remembered once saved, so that a comment is never skipped if the transaction is rolled back
+    db.on_commit(functools.partial(_remember, db, comment.id, outcome, comment.created_utc))
+
+
+def handled_ids(db, comments):
+    """Return the ids of the comments that are in the journal."""
+    with _lock:
+        newest = _get_newest(db)
+        handled = set()
+        unknown = []
+        for comment in comments:
+            key = (db.path, comment.id)
+            if key in _entries:
+                _entries.move_to_end(key)
+                handled.add(comment.id)
+            elif newest is not None and comment.created_utc <= newest:
+                unknown.append(comment.id)
+
+    if unknown:
+        outcomes = db.get_processed_comments(unknown)
+        with _lock:
+            for comment_id, outcome in outcomes.items():
+                _store((db.path, comment_id), outcome)
+        handled.update(outcomes)
+    return handled
+
+
+def newest(db):
+    """Return the creation time of the newest comment in the database's journal, or None if it's empty."""
+    with _lock:
+        return _get_newest(db)
+
+
+def prune(db, now=None):
+    """Delete the database's old entries, if it is time to. Return the number deleted."""
+    now = time.time() if now is None else now
+    with _lock:
+        if now < _next_prune.get(db.path, 0):
+            return 0
+        _next_prune[db.path] = now + PRUNE_INTERVAL
+    num_deleted = db.delete_processed_comments(now - _retention)
+    if num_deleted:
+        logging.debug('Deleted %d old entries from the journal', num_deleted)
+    return num_deleted
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _newest.clear()
+        _next_prune.clear()
+
+
+def _remember(db, comment_id, outcome, created_utc):
+    with _lock:
+        _store((db.path, comment_id), outcome)
+        newest = _get_newest(db)
+        if newest is None or created_utc > newest:
+            _newest[db.path] = created_utc
+
+
+def _get_newest(db):
+    if db.path not in _newest:
+        _newest[db.path] = db.get_latest_processed_comment_timestamp()
+    return _newest[db.path]
+
+
+def _store(key, outcome):
+    _entries[key] = outcome
+    _entries.move_to_end(key)
+    _evict()
+
+
+def _evict():
+    while len(_entries) > _max_entries:
+        _entries.popitem(last=False)
@@ -1,42 +1,120 @@
+import bisect
+import functools
 from collections import namedtuple
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ### Data Structures ###
 
 # A (string, int) tuple
 Level = namedtuple('Level', 'name points flair_template_id')
 
-# A ([Level], Level, Level) tuple
+# A ((Level, ...), Level, Level) tuple
 # previous can be empty, and exactly one of current and next can be None
 LevelInfo = namedtuple('LevelInfo', 'previous current next')
 
+### Classes ###
+
+
+class LevelTable:
+    """The levels, in ascending order by points, along with everything that can be worked out from
+    them ahead of time.
+
+    Looking up a level is a binary search over the levels' points, and every LevelInfo is made once,
+    up front, so nothing is built for each lookup. The table can be used anywhere that the list of
+    levels can.
+    """
+
+    def __init__(self, levels):
+        self.levels = tuple(sorted(levels, key=lambda lvl: lvl.points))
+        # The points needed to reach each level
+        self.thresholds = tuple(lvl.points for lvl in self.levels)
+        # The points needed to reach each level from the previous one (or from zero, for the first)
+        self.diffs = tuple(b - a for a, b in zip((0, *self.thresholds), self.thresholds))
+
+        # The LevelInfo for each number of levels reached, from none to all of them
+        self._infos = tuple(
+            LevelInfo(self.levels[:max(num_reached - 1, 0)],
+                      self.levels[num_reached - 1] if num_reached > 0 else None,
+                      self.levels[num_reached] if num_reached < len(self.levels) else None)
+            for num_reached in range(len(self.levels) + 1)
+        )
+
+    def __iter__(self):
+        return iter(self.levels)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, index):
+        return self.levels[index]
+
+    def __eq__(self, other):
+        return isinstance(other, LevelTable) and self.levels == other.levels
+
+    def __hash__(self):
+        return hash(self.levels)
+
+    def __repr__(self):
+        return f'LevelTable({list(self.levels)!r})'
+
+    def num_reached(self, points):
+        """Return the number of levels that have been reached with the given points."""
+        return bisect.bisect_right(self.thresholds, points)
+
+    def info(self, points):
+        return self._infos[self.num_reached(points)]
+
+    def current(self, points):
+        return self.info(points).current
+
+    def next(self, points):
+        return self.info(points).next
+
+    def num_reached_batch(self, all_points):
+        """Return the number of levels reached for each of the point totals, in a single vectorized
+        pass if NumPy is installed (as a NumPy array), or one at a time otherwise (as a list).
+        """
+        if numpy is not None:
+            return numpy.searchsorted(self.thresholds, numpy.asarray(all_points), side='right')
+        return [self.num_reached(points) for points in all_points]
+
+    def current_batch(self, all_points):
+        """Return the current level (or None) for each of the point totals."""
+        currents = [info.current for info in self._infos]
+        return [currents[num_reached] for num_reached in self.num_reached_batch(all_points)]
+
+
 ### Functions ###
 
 
 def user_level_info(points, levels):
     '''Return a tuple the user's previous (plural), current, and next levels.
 
-    If the user has yet to reach the first level, return ([], None, <first
+    If the user has yet to reach the first level, return ((), None, <first
     level>).
-    If the user has reached the max level, return ([previous], <max level>,
+    If the user has reached the max level, return ((previous), <max level>,
     None).
 
-    Assume levels is sorted in ascending order by points.
+    levels can be a LevelTable or a list of levels.
     '''
-    past_levels, cur_level, next_level = [], None, None
+    return as_table(levels).info(points)
+
 
-    for level in levels:
-        if points < level.points:
-            next_level = level
-            break
-        if cur_level:
-            past_levels.append(cur_level)
-        cur_level = level
-    else:
-        next_level = None
+def as_table(levels):
+    """Return the levels as a LevelTable."""
+    if isinstance(levels, LevelTable):
+        return levels
+    return _make_table(tuple(levels))
 
-    return LevelInfo(past_levels, cur_level, next_level)
+
+@functools.lru_cache(maxsize=8)
+def _make_table(levels):
+    return LevelTable(levels)
 
 
 def is_max_level(level_info):
     return not level_info.next
-
@@ -0,0 +1,170 @@
+"""Setting up the bot's logging, so that logging never holds up the bot.
+
+Every record is put on a queue by the logger that made it, and written to the log file and console
+by a background thread, so the bot never waits for a write. The log file can be plain text (as it
+always was) or one JSON object per line, which is easier to search and to feed to other tools. For
+each comment with a command (or, at DEBUG, every comment the bot reads), one record summarizes what
+happened to it, including how long each stage took; in JSON, those details are separate fields.
+
+The noisiest messages are logged by their own category's logger (e.g. `pointsbot.comments` for what
+happens to each comment, and `pointsbot.rules` for the result of each rule), each of which can have
+its own level, and can be sampled so that only a fraction of its (below WARNING) records are kept.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+### Globals ###
+
+FORMATS = ('text', 'json')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s:%(module)s: %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DEFAULT_LEVEL = 'DEBUG'
+
+# The loggers of the categories of messages that can be configured separately
+CATEGORIES = {
+    'comments': 'pointsbot.comments',
+    'rules': 'pointsbot.rules',
+}
+
+# Every comment is logged at DEBUG, which would be most of the log file, so they are left out unless
+# asked for
+DEFAULT_CATEGORY_LEVELS = {
+    'comments': 'INFO',
+}
+
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+
+# The listener writing the queued records, if logging has been set up
+_listener = None
+
+### Classes ###
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON, including the fields of its `event` (if any)."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            entry.update(event)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue with their exception's traceback (if any) as text, separate from the
+    message, so that the JSON format can write it as its own field.
+
+    The standard handler formats the traceback into the message, and drops the exception.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            # The traceback holds on to every frame's variables
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of each category's records below WARNING."""
+
+    def __init__(self, rates):
+        """`rates` maps each category to the fraction of its records to keep."""
+        super().__init__()
+        self.rates = {CATEGORIES[category]: rate for category, rate in rates.items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.name)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+### Functions ###
+
+
+def setup(cfg):
+    """Log to the log file and console, through a queue and a background thread, as configured.
+
+    Any previous setup is replaced. Return the `QueueListener` that writes the records.
+    """
+    global _listener
+    stop()
+
+    file_handler = logging.handlers.RotatingFileHandler(cfg.log_path, maxBytes=LOG_FILE_MAX_BYTES,
+                                                        backupCount=LOG_FILE_BACKUP_COUNT, encoding='utf-8')
+    if cfg.log_format == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    if cfg.log_sampling:
+        queue_handler.addFilter(SamplingFilter(cfg.log_sampling))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(cfg.log_level.upper())
+
+    for category, logger_name in CATEGORIES.items():
+        category_level = cfg.log_category_levels.get(category, DEFAULT_CATEGORY_LEVELS.get(category))
+        logging.getLogger(logger_name).setLevel(category_level.upper() if category_level else logging.NOTSET)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, console_handler,
+                                               respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def stop():
+    """Write any records still in the queue, and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def log_event(logger, level, event, msg, *args):
+    """Log a message along with the fields of an event, which the JSON format writes separately."""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={'event': event})
+
+
+def elapsed_ms(start, end=None):
+    """Return the milliseconds between `time.perf_counter()` readings, rounded for logging."""
+    return round(((time.perf_counter() if end is None else end) - start) * 1000, 3)
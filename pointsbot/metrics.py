@@ -0,0 +1,295 @@
+"""Counters, gauges and latency histograms for the bot, optionally served in Prometheus' text format.
+
+Every metric is defined here, at module level, so that any module can update them without anything
+being passed around. Updating a metric only takes a lock and an addition, whether or not the metrics
+are served. To serve them, enable the `[metrics]` config section, and point Prometheus (or anything
+else that reads its text format) at `http://<host>:<port>/metrics`.
+"""
+import bisect
+import contextlib
+import http.server
+import logging
+import math
+import threading
+import time
+
+### Globals ###
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9180
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the histogram buckets, for timing code and requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Upper bounds (in seconds) of the histogram buckets for how far behind the stream is
+LAG_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Every metric, in the order they are served
+_metrics = []
+
+### Classes ###
+
+
+class Metric:
+    """A metric, with a separate value for each combination of its labels' values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        if not labels and not self.labelnames:
+            return ()
+        if len(labels) != len(self.labelnames) or not all(name in labels for name in self.labelnames):
+            raise ValueError(f'{self.name} takes the labels {self.labelnames}, not {tuple(labels)}')
+        return tuple([str(labels[name]) for name in self.labelnames])
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Return a (name suffix, label pairs, value) tuple for each of the metric's current values."""
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            values[()] = self._initial_value()
+        return [
+            (suffix, tuple(zip(self.labelnames, key)) + extra_labels, value)
+            for key, value in values.items()
+            for suffix, extra_labels, value in self._expand(value)
+        ]
+
+    def _initial_value(self):
+        return 0
+
+    def _expand(self, value):
+        return [('', (), value)]
+
+
+class Counter(Metric):
+    """A total that only ever goes up, e.g. the number of comments seen."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. the number of items in a queue.
+
+    A gauge can be given a function instead, which is called for its value whenever it is read.
+    """
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func, **labels):
+        self.set(func, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            value = self._values.get(self._key(labels), 0)
+        return value() if callable(value) else value
+
+    def _expand(self, value):
+        return [('', (), value() if callable(value) else value)]
+
+
+class Histogram(Metric):
+    """Counts of observed values (usually durations, in seconds) in cumulative buckets, along with
+    their count and sum.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        self._observe(self._key(labels), (value,))
+
+    def observe_many(self, values, **labels):
+        self._observe(self._key(labels), values)
+
+    def time(self, **labels):
+        """Return a context manager that observes how long its block takes, in seconds."""
+        return Timer(self, self._key(labels))
+
+    def count(self, **labels):
+        with self._lock:
+            value = self._values.get(self._key(labels))
+            return value[1] if value else 0
+
+    def _observe(self, key, values):
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial_value()
+            bucket_counts = state[0]
+            for value in values:
+                bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+                state[1] += 1
+                state[2] += value
+
+    def _initial_value(self):
+        # The count in each bucket (not yet cumulative), the count, and the sum
+        return [[0] * len(self.buckets), 0, 0.0]
+
+    def _expand(self, value):
+        bucket_counts, count, total = value
+        samples = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            samples.append(('_bucket', (('le', format_value(upper_bound)),), cumulative))
+        samples.append(('_count', (), count))
+        samples.append(('_sum', (), total))
+        return samples
+
+
+class Timer:
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram._observe(self.key, (time.perf_counter() - self.start,))
+
+
+class Server(threading.Thread):
+    """Serves the metrics in a background thread."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__(name='metrics', daemon=True)
+        # Bind now, so that e.g. a port that is already in use is reported right away
+        self.httpd = http.server.HTTPServer((host, port), RequestHandler)
+
+    def __enter__(self):
+        self.start()
+        host, port = self.httpd.server_address[:2]
+        logging.info('Serving metrics at http://%s:%d/metrics', host, port)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.join()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def run(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.partition('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('Metrics: %s - %s', self.address_string(), format % args)
+
+
+### Metrics ###
+
+COMMENTS_SEEN = Counter('pointsbot_comments_seen_total', 'Comments read from the subreddit')
+COMMANDS_MATCHED = Counter('pointsbot_commands_matched_total', 'Comments containing each command', ['command'])
+POINTS_CHANGED = Counter('pointsbot_points_changed_total', 'Points awarded or removed', ['action'])
+OUTBOX_FAILURES = Counter('pointsbot_outbox_failures_total',
+                          'Failed attempts to send a reply or flair update', ['kind'])
+RECONNECTS = Counter('pointsbot_reconnects_total', 'Times the connection to Reddit was lost or refused',
+                     ['reason'])
+
+STREAM_LAG = Histogram('pointsbot_stream_lag_seconds', 'Time from a comment being posted to the bot reading it',
+                       buckets=LAG_BUCKETS)
+RULE_EVALUATION = Histogram('pointsbot_rule_evaluation_seconds',
+                            'Time to check the rules for a comment with a command')
+DB_TRANSACTION = Histogram('pointsbot_db_transaction_seconds',
+                           'Time to save a point change and its replies to the database')
+REDDIT_REQUEST = Histogram('pointsbot_reddit_request_seconds', 'Time to send a reply or flair update to Reddit',
+                           ['kind'])
+
+LATEST_STREAM_LAG = Gauge('pointsbot_stream_lag_latest_seconds',
+                          'Time from the newest comment read being posted to the bot reading it')
+QUEUE_DEPTH = Gauge('pointsbot_queue_depth', 'Items waiting in each queue', ['queue'])
+
+### Functions ###
+
+
+def serve(cfg):
+    """Return a context manager that serves the metrics while in use, if it is enabled in the config."""
+    if not cfg.serve_metrics:
+        return contextlib.nullcontext()
+    return Server(cfg.metrics_host, cfg.metrics_port)
+
+
+def observe_comments(comments, now=None):
+    """Count the comments as seen, and observe how long after being posted they were read."""
+    if not comments:
+        return
+    now = time.time() if now is None else now
+    lags = [max(now - comm.created_utc, 0) for comm in comments]
+    COMMENTS_SEEN.inc(len(comments))
+    STREAM_LAG.observe_many(lags)
+    LATEST_STREAM_LAG.set(min(lags))
+
+
+def render():
+    """Return every metric, in Prometheus' text format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {escape(metric.documentation)}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for suffix, labels, value in metric.samples():
+            if labels:
+                label_string = ','.join(f'{name}="{escape(value, quotes=True)}"' for name, value in labels)
+                lines.append(f'{metric.name}{suffix}{{{label_string}}} {format_value(value)}')
+            else:
+                lines.append(f'{metric.name}{suffix} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def escape(text, quotes=False):
+    text = text.replace('\\', r'\\').replace('\n', r'\n')
+    return text.replace('"', r'\"') if quotes else text
+
+
+def format_value(value):
+    return '+Inf' if value == math.inf else str(value)
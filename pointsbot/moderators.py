@@ -0,0 +1,100 @@
+"""Cached lists of each subreddit's moderators.
+
+Checking whether a redditor is a moderator used to take a request to Reddit every time; instead, the
+full list of moderators is fetched once and then refreshed whenever it is older than the TTL.
+
+The async engine can't fetch the lists while checking them, so it refreshes them itself beforehand,
+and turns off refreshing on each check with `configure`.
+"""
+import logging
+import time
+
+### Globals ###
+
+# Default number of seconds before a moderator list is fetched again
+DEFAULT_TTL = 10 * 60
+
+_ttl = DEFAULT_TTL
+_refresh_on_check = True
+
+# Moderator caches, keyed by lowercase subreddit name
+_caches = {}
+
+### Classes ###
+
+
+class ModeratorCache:
+
+    def __init__(self, subreddit, ttl=DEFAULT_TTL, refresh_on_check=True):
+        self.subreddit = subreddit
+        self.ttl = ttl
+        self.refresh_on_check = refresh_on_check
+        self._names = frozenset()
+        self._fetched_at = None
+
+    def __contains__(self, redditor):
+        """Return True if the redditor (or redditor name) is a moderator of the subreddit."""
+        if redditor is None:
+            # The author of a deleted comment or submission
+            return False
+        if self.refresh_on_check and self.is_stale():
+            self.refresh()
+        name = redditor if isinstance(redditor, str) else redditor.name
+        return name.lower() in self._names
+
+    def is_stale(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl
+
+    def refresh(self):
+        """Fetch the full list of moderators from Reddit."""
+        self.update(moderator.name for moderator in self.subreddit.moderator())
+        logging.debug('Fetched %d moderators for subreddit %s', len(self._names), self.subreddit.display_name)
+
+    def update(self, names):
+        """Replace the cached moderators with the given names."""
+        self._names = frozenset(name.lower() for name in names)
+        self._fetched_at = time.monotonic()
+
+    def invalidate(self):
+        """Force the list of moderators to be fetched again on the next check."""
+        self._fetched_at = None
+
+
+### Functions ###
+
+
+def configure(ttl=DEFAULT_TTL, refresh_on_check=True):
+    """If refresh_on_check is False, stale lists are used until they are refreshed some other way."""
+    global _ttl, _refresh_on_check
+    _ttl = ttl
+    _refresh_on_check = refresh_on_check
+    for cache in _caches.values():
+        cache.ttl = ttl
+        cache.refresh_on_check = refresh_on_check
+
+
+def for_subreddit(subreddit):
+    """Return the moderator cache for the subreddit, creating it if necessary."""
+    key = subreddit.display_name.lower()
+    if key not in _caches:
+        _caches[key] = new_cache(subreddit)
+    return _caches[key]
+
+
+def new_cache(subreddit):
+    """Return a new moderator cache that isn't shared, e.g. for use with another thread's Reddit session."""
+    return ModeratorCache(subreddit, ttl=_ttl, refresh_on_check=_refresh_on_check)
+
+
+def is_moderator(subreddit, redditor):
+    return redditor in for_subreddit(subreddit)
+
+
+def invalidate(subreddit=None):
+    """Force moderators to be fetched again for the subreddit, or for every subreddit if None."""
+    if subreddit is None:
+        caches = list(_caches.values())
+    else:
+        caches = [for_subreddit(subreddit)]
+    for cache in caches:
+        cache.invalidate()
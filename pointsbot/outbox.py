@@ -0,0 +1,209 @@
+"""Sending the bot's replies and flair updates to Reddit.
+
+Instead of replying and setting flair directly, the bot adds them to the `outbox` table in the same
+transaction as the point change they're for, so neither can be lost if the bot crashes in between. A
+background `Sender` then sends them, retrying with exponential backoff when Reddit has a transient
+problem, and slowing down when the bot is close to its rate limit. A point change is never undone just
+because the reply couldn't be sent.
+"""
+import contextlib
+import logging
+import threading
+import time
+
+import praw
+import prawcore
+
+from . import database, metrics, moderators
+
+### Globals ###
+
+# Number of times to try sending an item before giving up on it
+MAX_ATTEMPTS = 8
+
+# Seconds to wait before the first retry, doubled after each attempt, up to the max
+BASE_RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+
+# Seconds to wait between checks for new items, if the sender isn't notified of them first
+POLL_INTERVAL = 5
+
+# Number of items to load from the database at a time
+BATCH_SIZE = 20
+
+# Number of requests to leave unused in each rate limit period
+RATE_LIMIT_RESERVE = 5
+
+# Seconds to keep items after they are sent, and between deletions of older ones
+SENT_ITEM_RETENTION = 24 * 60 * 60
+PRUNE_INTERVAL = 60 * 60
+
+# Reddit API errors that are worth retrying; any others mean the item can never be sent (e.g. because
+# the comment was deleted or the thread was locked)
+TRANSIENT_API_ERRORS = {'RATELIMIT'}
+
+### Functions ###
+
+
+def add(db, subreddit_name, command, reply_body, lvl):
+    """Add the reply to the command comment, and the solver's new flair level (if any), to the outbox.
+
+    This should be called in the same transaction as the point change.
+    """
+    db.add_outbox_reply(subreddit_name, command.comment.id, reply_body)
+    if lvl:
+        db.add_outbox_flair(subreddit_name, command.solver.name, lvl.name, lvl.flair_template_id)
+
+
+def retry_delay(attempts):
+    return min(BASE_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def is_permanent_error(error):
+    """Return True if the error means the item can never be sent."""
+    # Only Reddit API errors (as opposed to e.g. network errors) have items
+    items = getattr(error, 'items', None)
+    if items is None:
+        return False
+    return not any(item.error_type in TRANSIENT_API_ERRORS for item in items)
+
+
+def record_sent(db, item, status='sent'):
+    db.update_outbox_item(item['rowid'], status, item['attempts'] + 1)
+
+
+def record_failure(db, item, error):
+    """Schedule the item to be retried, or give up on it if it can't (or shouldn't) be retried."""
+    metrics.OUTBOX_FAILURES.inc(kind=item['kind'])
+    attempts = item['attempts'] + 1
+    if is_permanent_error(error) or attempts >= MAX_ATTEMPTS:
+        logging.error('Giving up on sending %s for %s: %s', item['kind'], item['target'], error)
+        db.update_outbox_item(item['rowid'], 'failed', attempts, last_error=str(error))
+    else:
+        delay = retry_delay(attempts)
+        logging.warning('Unable to send %s for %s (retrying in %ds): %s', item['kind'], item['target'],
+                        delay, error)
+        db.update_outbox_item(item['rowid'], 'pending', attempts, next_attempt_at=time.time() + delay,
+                              last_error=str(error))
+
+
+def seconds_until_rate_limit_reset(limits):
+    """Return how long to wait before sending, given PRAW's `reddit.auth.limits`."""
+    remaining, reset_timestamp = limits.get('remaining'), limits.get('reset_timestamp')
+    if remaining is None or reset_timestamp is None or remaining > RATE_LIMIT_RESERVE:
+        return 0
+    return max(reset_timestamp - time.time(), 0)
+
+
+### Classes ###
+
+
+class Sender(threading.Thread):
+    """Sends outbox items in a background thread, with its own database connections and Reddit session."""
+
+    def __init__(self, dbpaths, connect):
+        """`dbpaths` are the databases whose outboxes to send (one for each subreddit), and `connect` is a
+        function that returns a new `praw.Reddit` instance.
+        """
+        super().__init__(name='outbox', daemon=True)
+        self.dbpaths = [dbpaths] if isinstance(dbpaths, str) else list(dbpaths)
+        self.connect = connect
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.join()
+
+    def notify(self):
+        """Let the sender know that there are new items, so it doesn't wait for the next poll."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        reddit = None
+        # Each thread needs its own Reddit session, so it also needs its own moderator caches
+        moderator_caches = {}
+        next_prune = 0
+        with contextlib.ExitStack() as stack:
+            dbs = [stack.enter_context(database.Database(dbpath)) for dbpath in self.dbpaths]
+            while not self._stopping.is_set():
+                # Keep running after any error (e.g. while another process holds a database's lock), since
+                # nothing else would send the items
+                try:
+                    if reddit is None:
+                        reddit = self.connect()
+                    if time.monotonic() >= next_prune:
+                        for db in dbs:
+                            db.delete_sent_outbox_items(time.time() - SENT_ITEM_RETENTION)
+                        next_prune = time.monotonic() + PRUNE_INTERVAL
+                    if not self._send_due(reddit, moderator_caches, dbs):
+                        self._wake.wait(POLL_INTERVAL)
+                        self._wake.clear()
+                except Exception:
+                    logging.exception('Unexpected error in the outbox sender; trying again in %ds', POLL_INTERVAL)
+                    self._stopping.wait(POLL_INTERVAL)
+
+    def _send_due(self, reddit, moderator_caches, dbs):
+        """Send the items that are due from each database. Return False if there were none."""
+        metrics.QUEUE_DEPTH.set(sum(db.count_pending_outbox_items() for db in dbs), queue='outbox')
+        batches = [(db, db.get_due_outbox_items(BATCH_SIZE)) for db in dbs]
+        if not any(items for _, items in batches):
+            return False
+        for db, items in batches:
+            self._send_batch(reddit, moderator_caches, db, items)
+        return True
+
+    def _send_batch(self, reddit, moderator_caches, db, items):
+        for item in items:
+            if self._stopping.is_set():
+                break
+            self._wait_for_rate_limit(reddit)
+            try:
+                sent = self._send(reddit, moderator_caches, item)
+            except (praw.exceptions.RedditAPIException, prawcore.exceptions.PrawcoreException) as e:
+                record_failure(db, item, e)
+            except Exception as e:
+                # Retried like any other transient error, until it has failed too many times
+                logging.exception('Unexpected error sending outbox item %s', item['rowid'])
+                record_failure(db, item, e)
+            else:
+                record_sent(db, item, 'sent' if sent else 'skipped')
+
+    def _send(self, reddit, moderator_caches, item):
+        """Send the item. Return False if it was skipped."""
+        subreddit = reddit.subreddit(item['subreddit'])
+        if item['kind'] == 'reply':
+            with metrics.REDDIT_REQUEST.time(kind='reply'):
+                reddit.comment(item['target']).reply(item['body'])
+            logging.info('Replied to comment %s', item['target'])
+            logging.debug('Reply body: %s', item['body'])
+            return True
+
+        if item['subreddit'] not in moderator_caches:
+            moderator_caches[item['subreddit']] = moderators.new_cache(subreddit)
+        if item['target'] in moderator_caches[item['subreddit']]:
+            logging.info('Solver is mod; don\'t alter flair')
+            return False
+
+        logging.info('Setting flair for user "%s"', item['target'])
+        logging.info('Flair text: %s', item['flair_text'])
+        logging.info('Flair template ID: %s', item['flair_template_id'])
+        with metrics.REDDIT_REQUEST.time(kind='flair'):
+            subreddit.flair.set(item['target'],
+                                text=item['flair_text'],
+                                flair_template_id=item['flair_template_id'])
+        return True
+
+    def _wait_for_rate_limit(self, reddit):
+        delay = seconds_until_rate_limit_reset(reddit.auth.limits)
+        if delay > 0:
+            logging.info('Close to the rate limit; waiting %ds before sending', delay)
+            self._stopping.wait(delay)
@@ -0,0 +1,85 @@
+"""Batched fetching of the parent comments and submissions of streamed comments.
+
+Looking up a comment's parent or submission through PRAW lazily fetches each object with its own
+request. Instead, the parents and submissions of a whole window of comments are fetched up front with
+`reddit.info`, which accepts up to 100 fullnames per request, and kept in a bounded in-memory map.
+"""
+import logging
+from collections import OrderedDict
+
+### Globals ###
+
+# Maximum number of fullnames that Reddit accepts per `info` request
+BATCH_SIZE = 100
+
+# Default number of fetched objects to keep, least recently used first out
+DEFAULT_MAX_OBJECTS = 1000
+
+_max_objects = DEFAULT_MAX_OBJECTS
+
+# Fetched comments and submissions, keyed by fullname (e.g. "t1_abc123")
+_objects = OrderedDict()
+
+### Functions ###
+
+
+def configure(max_objects=DEFAULT_MAX_OBJECTS):
+    global _max_objects
+    _max_objects = max_objects
+    _evict()
+
+
+def prefetch(reddit, comments):
+    """Fetch the parents and submissions of the comments that aren't already in the map."""
+    fullnames = missing(comments)
+    for start in range(0, len(fullnames), BATCH_SIZE):
+        store(reddit.info(fullnames=fullnames[start:start + BATCH_SIZE]))
+    if fullnames:
+        logging.debug('Prefetched %d objects for %d comments', len(fullnames), len(comments))
+
+
+def missing(comments):
+    """Return the fullnames of the comments' parents and submissions that aren't in the map."""
+    fullnames = []
+    for comment in comments:
+        for fullname in (comment.parent_id, comment.link_id):
+            if fullname not in _objects and fullname not in fullnames:
+                fullnames.append(fullname)
+    return fullnames
+
+
+def store(things):
+    """Add the fetched comments and/or submissions to the map."""
+    for thing in things:
+        _objects[thing.fullname] = thing
+        _objects.move_to_end(thing.fullname)
+    _evict()
+
+
+def get(fullname):
+    """Return the fetched object with the given fullname, or None if it hasn't been fetched."""
+    thing = _objects.get(fullname)
+    if thing is not None:
+        _objects.move_to_end(fullname)
+    return thing
+
+
+def parent(comment):
+    """Return the comment's parent comment or submission, fetching it only if it wasn't prefetched."""
+    thing = get(comment.parent_id)
+    return thing if thing is not None else comment.parent()
+
+
+def submission(comment):
+    """Return the comment's submission, fetching it only if it wasn't prefetched."""
+    thing = get(comment.link_id)
+    return thing if thing is not None else comment.submission
+
+
+def clear():
+    _objects.clear()
+
+
+def _evict():
+    while len(_objects) > _max_objects:
+        _objects.popitem(last=False)
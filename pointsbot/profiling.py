@@ -0,0 +1,233 @@
+"""Profiling the bot while it runs, without restarting it under a profiler.
+
+While profiling is on:
+
+* Every Nth comment is profiled with `cProfile`, along with the rest of the window of comments that it
+  arrived in (since their parents and submissions are fetched together). The samples are collected into
+  `.pstats` files in the log file's directory, each covering the samples since the previous file; load
+  them with `pstats` (or e.g. snakeviz), alone or combined.
+* If a memory snapshot interval is set, `tracemalloc` takes a snapshot of the bot's memory on that
+  timer, and writes the lines whose allocations grew the most since the previous snapshot to a text
+  file beside the profiles.
+
+Profiling can be turned on in the config (the `[profiling]` section), or toggled in the running bot by
+sending it SIGUSR1 (on platforms that have it), e.g. `kill -USR1 <pid>`.
+"""
+import contextlib
+import cProfile
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+
+### Globals ###
+
+# Profile every Nth comment
+DEFAULT_SAMPLE_EVERY = 100
+
+# Number of samples in each .pstats file
+DEFAULT_DUMP_EVERY = 10
+
+# Seconds between memory snapshots; 0 to not take any
+DEFAULT_MEMORY_INTERVAL = 0
+
+# Number of stack frames kept for each allocation, and of lines written for each memory snapshot diff
+MEMORY_TRACE_FRAMES = 10
+MEMORY_DIFF_LINES = 25
+
+# Used instead of a profile, when a window isn't sampled
+_NOT_SAMPLED = contextlib.nullcontext()
+
+# The profiler installed for the bot, if any
+_profiler = None
+
+### Classes ###
+
+
+class Profiler:
+    """Samples comments with cProfile, and diffs memory snapshots on a timer, while enabled."""
+
+    def __init__(self, output_dir, sample_every=DEFAULT_SAMPLE_EVERY, dump_every=DEFAULT_DUMP_EVERY,
+                 memory_interval=DEFAULT_MEMORY_INTERVAL, enabled=False, use_signal=True):
+        self.output_dir = output_dir
+        self.sample_every = sample_every
+        self.dump_every = dump_every
+        self.memory_interval = memory_interval
+        self.enabled = False
+        self._enable_on_enter = enabled
+        self._use_signal = use_signal
+        self._previous_handler = None
+
+        self._lock = threading.RLock()
+        self._num_comments = 0
+        self._profile = None
+        self._num_samples = 0
+        self._memory_watcher = None
+
+    def __enter__(self):
+        if self._use_signal and hasattr(signal, 'SIGUSR1') \
+                and threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(signal.SIGUSR1, self._handle_signal)
+        if self._enable_on_enter:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGUSR1, self._previous_handler)
+            self._previous_handler = None
+
+    def start(self):
+        with self._lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self._num_comments = 0
+            self._profile = cProfile.Profile()
+            self._num_samples = 0
+            if self.memory_interval > 0:
+                self._memory_watcher = MemoryWatcher(self.output_dir, self.memory_interval)
+                self._memory_watcher.start()
+        logging.info('Started profiling; profiles will be saved to %s', self.output_dir)
+
+    def stop(self):
+        with self._lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            self.dump()
+            self._profile = None
+            if self._memory_watcher:
+                self._memory_watcher.stop()
+                self._memory_watcher = None
+        logging.info('Stopped profiling')
+
+    def toggle(self):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+
+    def sample(self, num_comments):
+        """Return a context manager that profiles its block, if the block handles an Nth comment."""
+        if not self.enabled:
+            return _NOT_SAMPLED
+        before = self._num_comments
+        self._num_comments += num_comments
+        if before // self.sample_every == self._num_comments // self.sample_every:
+            return _NOT_SAMPLED
+        return self._profiled()
+
+    @contextlib.contextmanager
+    def _profiled(self):
+        profile = self._profile
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                # Profiling may have been stopped (and the samples saved) in the meantime
+                if profile is self._profile:
+                    self._num_samples += 1
+                    if self._num_samples >= self.dump_every:
+                        self.dump()
+
+    def dump(self):
+        """Save the samples taken since the last dump, if any. Return the path they were saved to."""
+        with self._lock:
+            if not self._num_samples:
+                return None
+            path = output_path(self.output_dir, 'profile', 'pstats')
+            self._profile.dump_stats(path)
+            logging.info('Saved %d profiled samples to %s', self._num_samples, path)
+            self._profile = cProfile.Profile()
+            self._num_samples = 0
+            return path
+
+    def _handle_signal(self, signum, frame):
+        self.toggle()
+
+
+class MemoryWatcher(threading.Thread):
+    """Takes a tracemalloc snapshot on a timer, and saves how it differs from the previous one."""
+
+    def __init__(self, output_dir, interval):
+        super().__init__(name='memory-watcher', daemon=True)
+        self.output_dir = output_dir
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._started_tracing = False
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+            self._started_tracing = True
+        try:
+            previous = take_snapshot()
+            while not self._stopping.wait(self.interval):
+                snapshot = take_snapshot()
+                save_snapshot_diff(snapshot, previous, self.output_dir)
+                previous = snapshot
+        finally:
+            if self._started_tracing:
+                tracemalloc.stop()
+
+
+### Functions ###
+
+
+def install(cfg):
+    """Return a context manager that installs a profiler for the bot while in use, as configured."""
+    global _profiler
+    output_dir = os.path.dirname(os.path.abspath(cfg.log_path))
+    _profiler = Profiler(output_dir, sample_every=cfg.profile_sample_every, dump_every=cfg.profile_dump_every,
+                         memory_interval=cfg.memory_snapshot_interval, enabled=cfg.profiling_enabled,
+                         use_signal=cfg.profiling_signal)
+    return _profiler
+
+
+def sample(num_comments):
+    """Return a context manager that profiles its block, if it handles a comment that is sampled."""
+    if _profiler is None:
+        return _NOT_SAMPLED
+    return _profiler.sample(num_comments)
+
+
+def take_snapshot():
+    # The profiler's and tracemalloc's own allocations aren't interesting
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def save_snapshot_diff(snapshot, previous, output_dir):
+    """Save the lines whose allocations grew the most between the snapshots. Return the file's path."""
+    stats = snapshot.compare_to(previous, 'lineno')
+    total = sum(stat.size for stat in snapshot.statistics('filename'))
+    path = output_path(output_dir, 'memory', 'txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'Traced memory: {total / 1024:.1f} KiB\n\n')
+        for stat in stats[:MEMORY_DIFF_LINES]:
+            f.write(f'{stat}\n')
+    logging.info('Saved memory snapshot diff to %s (traced memory: %.1f KiB)', path, total / 1024)
+    return path
+
+
+def output_path(output_dir, kind, extension):
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(output_dir, f'pointsbot-{kind}-{timestamp}.{extension}')
+    # Several files of the same kind may be saved in the same second
+    num = 1
+    while os.path.exists(path):
+        num += 1
+        path = os.path.join(output_dir, f'pointsbot-{kind}-{timestamp}-{num}.{extension}')
+    return path
@@ -0,0 +1,190 @@
+"""Rebuilding the database from the subreddit's history ("recovery mode").
+
+Submissions are walked and their full comment forests fetched concurrently by a bounded pool of
+threads, each with its own Reddit session. The comments are then classified offline, with the same
+rules that the bot uses for new comments, and each submission's commands are replayed in the order
+they were posted. The resulting solutions are saved in bulk to a fresh database beside the real one,
+which records the submissions already rebuilt, so an interrupted rebuild picks up where it left off.
+Once every submission is done, the fresh database replaces the real one in a single atomic rename,
+after the real one is backed up.
+
+The bot should not be running during a rebuild, since the database it is using will be replaced.
+"""
+import itertools
+import logging
+import os
+import os.path
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import prawcore
+
+from . import bot, database, moderators, prefetch
+
+### Globals ###
+
+# Default number of submissions to fetch at the same time
+DEFAULT_WORKERS = 8
+
+# Number of submissions whose solutions are saved together, in one transaction
+CHECKPOINT_INTERVAL = 50
+
+# Appended to the database path for the database being rebuilt, and for the backup of the old one
+REBUILD_SUFFIX = '.rebuild'
+BACKUP_SUFFIX = '.bak'
+
+# A solution found by replaying a submission's commands; remover and removed_by_comment are None
+# unless the point was later removed
+RebuiltSolution = namedtuple('RebuiltSolution',
+                             'submission solver solution_comment chooser chosen_by_comment '
+                             'remover removed_by_comment')
+
+### Main Function ###
+
+
+def rebuild(cfg, workers=DEFAULT_WORKERS, submission_ids=None):
+    """Rebuild the database from the submissions with the given ids, or from the subreddit's
+    listings if None, then replace the existing database with the result.
+    """
+    reddit = bot.connect(cfg)
+    me = bot.identify(reddit)
+    subreddit = reddit.subreddit(cfg.subreddit)
+    # Moderators can't be checked as of when each comment was posted, so the current moderators are
+    # used for the whole rebuild, without refreshing them from the worker threads' sessions
+    moderators.configure(ttl=float('inf'))
+    moderators.for_subreddit(subreddit).refresh()
+
+    if submission_ids is None:
+        submission_ids = list_submission_ids(subreddit)
+
+    rebuild_path = cfg.database_path + REBUILD_SUFFIX
+    with database.Database(rebuild_path) as db:
+        db.start_rebuild()
+        rebuilt_ids = db.get_rebuilt_submission_ids()
+        remaining_ids = [submission_id for submission_id in submission_ids if submission_id not in rebuilt_ids]
+        logging.info('Rebuilding %d submissions (%d already done)', len(remaining_ids),
+                     len(submission_ids) - len(remaining_ids))
+
+        done_ids, solutions = [], []
+        for submission, comments in fetch_comment_forests(cfg, remaining_ids, workers):
+            done_ids.append(submission.id)
+            solutions.extend(find_solutions(submission, comments, cfg, me))
+            if len(done_ids) >= CHECKPOINT_INTERVAL:
+                db.add_rebuilt_solutions(done_ids, solutions)
+                logging.info('Saved %d solutions from %d submissions', len(solutions), len(done_ids))
+                done_ids, solutions = [], []
+        db.add_rebuilt_solutions(done_ids, solutions)
+
+        num_failed = len(remaining_ids) - len(db.get_rebuilt_submission_ids() - rebuilt_ids)
+        if num_failed:
+            logging.error('Unable to rebuild %d submissions; run the rebuild again to retry them', num_failed)
+            return False
+        db.finish_rebuild()
+
+    swap_in(rebuild_path, cfg.database_path)
+    logging.info('Replaced database %s with the rebuilt one', cfg.database_path)
+    return True
+
+
+### Functions ###
+
+
+def list_submission_ids(subreddit):
+    """Return the ids of every submission that the subreddit's listings include.
+
+    Reddit stops each listing at roughly 1000 submissions, so for older submissions, the ids have to
+    be found elsewhere (e.g. an archive of the subreddit) and passed to `rebuild` instead.
+    """
+    submission_ids = {}
+    listings = [subreddit.new(limit=None), subreddit.top(time_filter='all', limit=None)]
+    for submission in itertools.chain(*listings):
+        submission_ids.setdefault(submission.id, submission.created_utc)
+    # Oldest first, so that a resumed rebuild has already done the submissions least likely to change
+    return sorted(submission_ids, key=submission_ids.get)
+
+
+def fetch_comment_forests(cfg, submission_ids, workers):
+    """Yield a (submission, list of all its comments) tuple for each submission id, in the order they
+    are fetched.
+
+    Submissions are fetched by `workers` threads, each with its own Reddit session, with at most
+    twice that many submissions in flight at a time. A submission that can't be fetched is logged
+    and skipped.
+    """
+    thread_data = threading.local()
+
+    def fetch(submission_id):
+        if not hasattr(thread_data, 'reddit'):
+            thread_data.reddit = bot.connect(cfg)
+        submission = thread_data.reddit.submission(submission_id)
+        submission.comments.replace_more(limit=None)
+        return submission, submission.comments.list()
+
+    remaining_ids = iter(submission_ids)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rebuild') as executor:
+        in_flight = {executor.submit(fetch, submission_id): submission_id
+                     for submission_id in itertools.islice(remaining_ids, workers * 2)}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                submission_id = in_flight.pop(future)
+                next_id = next(remaining_ids, None)
+                if next_id is not None:
+                    in_flight[executor.submit(fetch, next_id)] = next_id
+
+                try:
+                    yield future.result()
+                except prawcore.exceptions.PrawcoreException as e:
+                    logging.error('Unable to fetch submission %s: %s', submission_id, e)
+
+
+def find_solutions(submission, comments, cfg, me):
+    """Return the solutions that the submission's comments result in, without any requests to Reddit
+    (other than for comments whose parents are missing from the forest).
+    """
+    command_comments = [comm for comm in comments if bot.find_commands(comm)]
+    if not command_comments:
+        return []
+
+    # Make the parents and submission available to the rules, the same as when streaming
+    by_fullname = {comm.fullname: comm for comm in comments}
+    prefetch.store([submission] + [by_fullname[comm.parent_id] for comm in command_comments
+                                   if comm.parent_id in by_fullname])
+
+    commands = (bot.classify(comm, cfg, me) for comm in command_comments)
+    return replay([command for command in commands if command])
+
+
+def replay(commands):
+    """Return the solutions that result from handling a submission's commands in the order they were
+    posted, the same way that `bot.persist` would have.
+    """
+    solutions = {}
+    for command in sorted(commands, key=lambda command: command.comment.created_utc):
+        solution = solutions.get(command.solver.id)
+        if command.remove_point:
+            if solution and not solution.removed_by_comment:
+                solutions[command.solver.id] = solution._replace(remover=command.chooser,
+                                                                 removed_by_comment=command.comment)
+        elif not solution:
+            # Like `has_already_solved_once`, a removed solution still counts
+            solutions[command.solver.id] = RebuiltSolution(command.submission,
+                                                           command.solver,
+                                                           command.solution_comment,
+                                                           command.chooser,
+                                                           command.comment,
+                                                           None,
+                                                           None)
+    return list(solutions.values())
+
+
+def swap_in(rebuild_path, dbpath):
+    """Back up the database at dbpath (if any), then atomically replace it with the rebuilt one."""
+    if os.path.exists(dbpath):
+        # Opening and closing the database also checkpoints its write-ahead log, so that no leftover
+        # log is applied to the rebuilt database after the swap
+        with database.Database(dbpath) as old_db:
+            old_db.backup(dbpath + BACKUP_SUFFIX)
+        logging.info('Backed up the old database to %s', dbpath + BACKUP_SUFFIX)
+    os.replace(rebuild_path, dbpath)
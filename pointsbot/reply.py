@@ -1,3 +1,5 @@
+import functools
+
 from . import level
 
 ### Globals ###
@@ -12,11 +14,8 @@ EXCESS_POINTS = 100              # TODO move this to level and/or config?
 EXCESS_SYMBOL = '\u2605'         # A star character
 EXCESS_SYMBOL_TITLE = 'a star'   # Used in comment body
 
-###
-# TODO make this a ReplyFactory? pass in feedback & scoreboard URLs to the
-# ReplyFactory constructor, then pass in redditor, points, level_info each time
-# making a comment, ie probably make `make` or `build` a method of the factory
-###
+# Number of points values whose fragments each ReplyFactory keeps
+FRAGMENT_CACHE_SIZE = 1024
 
 ### Main Functions ###
 
@@ -30,40 +29,105 @@ def make(redditor, points, level_info, feedback_url=None, scoreboard_url=None, i
     if level_info is None:
         paras.append(no_points(redditor))
     else:
-        if points <= 1:
-            paras.append(first_greeting(redditor))
-            if level_info.current and points == level_info.current.points:
-                paras.append(level_up(redditor,
-                                      level_info.current.name,
-                                      tag_user=False))
-        elif points > 1:
-            user_already_tagged = False
-
-            if level_info.current and points == level_info.current.points:
-                paras.append(level_up(redditor,
-                                      level_info.current.name,
-                                      tag_user=(not user_already_tagged)))
-                user_already_tagged = True
-
-            if points % EXCESS_POINTS == 0:
-                first_excess = (points == EXCESS_POINTS)
-                paras.append(new_excess_symbol(redditor,
-                                               first_excess=first_excess,
-                                               tag_user=(not user_already_tagged)))
-                user_already_tagged = True
-
-            if not user_already_tagged:
-                paras.append(normal_greeting(redditor))
-
+        paras.extend(greetings(redditor, points, level_info))
         paras.append(points_status(redditor, points, level_info))
     paras.append(divider())
     paras.append(footer(feedback_url=feedback_url, scoreboard_url=scoreboard_url))
     return '\n\n'.join(paras)
 
 
+def factory_for(levels, feedback_url=None, scoreboard_url=None):
+    """Return the (shared) ReplyFactory for the levels and URLs."""
+    return _make_factory(level.as_table(levels), feedback_url, scoreboard_url)
+
+
+# Not bounded, since there is only one factory for each configured subreddit's levels and links, and a
+# bounded cache would keep rebuilding them when there are more subreddits than it holds
+@functools.lru_cache(maxsize=None)
+def _make_factory(levels, feedback_url, scoreboard_url):
+    return ReplyFactory(levels, feedback_url=feedback_url, scoreboard_url=scoreboard_url)
+
+
+### Classes ###
+
+
+class ReplyFactory:
+    """Makes the same replies as `make`, for a fixed set of levels and URLs.
+
+    Everything that doesn't depend on the redditor or their points (the footer, and the progress bar
+    segments for each level) is rendered once, up front, and everything that only depends on the
+    points is kept for the most recently used points values.
+    """
+
+    def __init__(self, levels, feedback_url=None, scoreboard_url=None):
+        self.levels = level.as_table(levels)
+        self._footer = '\n\n'.join([divider(), footer(feedback_url=feedback_url, scoreboard_url=scoreboard_url)])
+        # The progress bar segments for the levels already reached, for each number of levels reached
+        self._reached_bars = [DIV_SYMBOL.join(FILLED_SYMBOL * diff for diff in self.levels.diffs[:num_reached])
+                              for num_reached in range(len(self.levels) + 1)]
+        # Cached separately for each factory, since they depend on its levels
+        self.points_status = functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)(self._points_status)
+
+    def make(self, redditor, points, is_add=True):
+        paras = [solved_header() if is_add else remove_header()]
+        if points <= 0:
+            paras.append(no_points(redditor))
+        else:
+            paras.extend(greetings(redditor, points, self.levels.info(points)))
+            paras.append(self.points_status(points))
+        paras.append(self._footer)
+        return '\n\n'.join(paras)
+
+    def progress_bar(self, points):
+        if points >= EXCESS_POINTS:
+            return progress_bar(points, None)
+
+        num_reached = self.levels.num_reached(points)
+        bar = self._reached_bars[num_reached]
+        level_info = self.levels.info(points)
+        if level_info.next:
+            have = points if not level_info.current else points - level_info.current.points
+            need = level_info.next.points - points
+            bar = (bar + DIV_SYMBOL if bar else '') + (FILLED_SYMBOL * have) + (EMPTY_SYMBOL * need)
+        return f'[{bar}]'
+
+    def _points_status(self, points):
+        return points_status_lines(points, self.levels.info(points), self.progress_bar(points))
+
+
 ### Comment Section Functions ###
 
 
+def greetings(redditor, points, level_info):
+    """Return the paragraphs that congratulate (or otherwise greet) the redditor."""
+    paras = []
+    if points <= 1:
+        paras.append(first_greeting(redditor))
+        if level_info.current and points == level_info.current.points:
+            paras.append(level_up(redditor,
+                                  level_info.current.name,
+                                  tag_user=False))
+    elif points > 1:
+        user_already_tagged = False
+
+        if level_info.current and points == level_info.current.points:
+            paras.append(level_up(redditor,
+                                  level_info.current.name,
+                                  tag_user=(not user_already_tagged)))
+            user_already_tagged = True
+
+        if points % EXCESS_POINTS == 0:
+            first_excess = (points == EXCESS_POINTS)
+            paras.append(new_excess_symbol(redditor,
+                                           first_excess=first_excess,
+                                           tag_user=(not user_already_tagged)))
+            user_already_tagged = True
+
+        if not user_already_tagged:
+            paras.append(normal_greeting(redditor))
+    return paras
+
+
 def solved_header():
     return 'Thanks! Post marked as Solved!'
 
@@ -100,6 +164,10 @@ def new_excess_symbol(redditor, first_excess=True, tag_user=True):
 
 
 def points_status(redditor, points, level_info):
+    return points_status_lines(points, level_info, progress_bar(points, level_info))
+
+
+def points_status_lines(points, level_info, bar):
     pointstext = 'points' if points > 1 else 'point'
 
     if level_info.next:
@@ -116,7 +184,7 @@ def points_status(redditor, points, level_info):
 
     # 2 spaces are appended to each line to force a Markdown line break
     lines = [line + '  ' for line in lines]
-    lines.append(progress_bar(points, level_info))
+    lines.append(bar)
 
     return '\n'.join(lines)
 
@@ -124,7 +192,8 @@ def points_status(redditor, points, level_info):
 def progress_bar(points, level_info):
     if points < EXCESS_POINTS:
         past, cur, nxt = level_info
-        allpoints = [lvl.points for lvl in [*past, cur]]
+        # There is no current level until the first level is reached
+        allpoints = [lvl.points for lvl in [*past, cur] if lvl]
         diffs = [a - b for a, b in zip(allpoints, [0] + allpoints)]
         bar = [FILLED_SYMBOL * diff for diff in diffs]
 
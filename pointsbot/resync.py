@@ -0,0 +1,117 @@
+"""Bringing every redditor's flair up to date with their level, e.g. after the levels are changed.
+
+The bot only sets a redditor's flair when they reach a new level, so changing the levels in the
+config leaves existing flair out of date. Instead of setting each redditor's flair with its own
+request, every redditor's level is worked out from the database in one pass, compared with the
+subreddit's current flair (fetched in pages of 1000), and only the flair that differs is updated,
+100 redditors per request.
+
+Reddit's bulk flair API only sets flair text and CSS classes, not flair templates, so a level's flair
+template is applied as that template's text and CSS class. Reddit's flair list doesn't include each
+redditor's template either, so changing a level's template to one with the same (or no) CSS class
+can't be detected. With `templates`, each redditor at a level with a template has it set again with its
+own request instead, whether or not their flair looks out of date.
+"""
+import logging
+from collections import namedtuple
+
+import praw
+import prawcore
+
+from . import bot, database, moderators
+
+### Globals ###
+
+# A redditor's flair, as (text, CSS class); a redditor without flair has ('', '')
+Flair = namedtuple('Flair', 'text css_class')
+
+NO_FLAIR = Flair('', '')
+
+### Main Function ###
+
+
+def resync(cfg, dry_run=False, templates=False):
+    """Update the flair of every redditor whose flair doesn't match their level (and, if templates is
+    True, of every redditor at a level with a flair template). Return the list of (name, old Flair,
+    new Flair) changes.
+    """
+    reddit = bot.connect(cfg)
+    subreddit = reddit.subreddit(cfg.subreddit)
+    with database.Database(cfg.database_path) as db:
+        all_points = [(row['name'], row['points']) for row in db.get_all_points()]
+
+    current_flair = fetch_current_flair(subreddit)
+    template_css_classes = {template['id']: template['css_class'] for template in subreddit.flair.templates}
+    mods = moderators.for_subreddit(subreddit)
+
+    changes = find_changes(all_points, cfg.levels, current_flair, template_css_classes,
+                           is_moderator=lambda name: name in mods, templates=templates)
+    logging.info('%d of %d redditors have out-of-date flair', len(changes), len(all_points))
+    if changes and not dry_run:
+        push_changes(subreddit, changes, cfg.levels, templates=templates)
+    return changes
+
+
+### Functions ###
+
+
+def fetch_current_flair(subreddit):
+    """Return a dict mapping each (lowercase) redditor name to their Flair in the subreddit."""
+    return {
+        str(item['user']).lower(): Flair(item['flair_text'] or '', item['flair_css_class'] or '')
+        for item in subreddit.flair(limit=None)
+    }
+
+
+def find_changes(all_points, levels, current_flair, template_css_classes, is_moderator, templates=False):
+    """Return a (name, old Flair, new Flair) tuple for every redditor whose flair doesn't match their
+    level, given their (name, points) tuples. If templates is True, every redditor at a level with a
+    flair template is included, since their current template is unknown.
+
+    Only flair that the bot manages is changed: a redditor below the first level only has their flair
+    cleared if it is a level's, and moderators are skipped, the same as when the bot levels them up.
+    """
+    level_names = {lvl.name for lvl in levels}
+    names = [name for name, _ in all_points]
+    currents = levels.current_batch([points for _, points in all_points])
+
+    changes = []
+    for name, lvl in zip(names, currents):
+        old_flair = current_flair.get(name.lower(), NO_FLAIR)
+        if lvl:
+            new_flair = Flair(lvl.name, template_css_classes.get(lvl.flair_template_id) or '')
+        elif old_flair.text in level_names:
+            new_flair = NO_FLAIR
+        else:
+            continue
+
+        outdated = new_flair != old_flair or (templates and lvl and lvl.flair_template_id)
+        if outdated and not is_moderator(name):
+            changes.append((name, old_flair, new_flair))
+    return changes
+
+
+def push_changes(subreddit, changes, levels, templates=False):
+    """Update the flair in batches, logging any that Reddit rejects. If templates is True, flair for
+    levels with a flair template is set one redditor at a time, with the template.
+    """
+    templated_levels = {lvl.name: lvl for lvl in levels if lvl.flair_template_id} if templates else {}
+    flair_list = []
+    for name, _, new_flair in changes:
+        lvl = templated_levels.get(new_flair.text)
+        if lvl:
+            set_template(subreddit, name, lvl)
+        else:
+            flair_list.append({'user': name, 'flair_text': new_flair.text, 'flair_css_class': new_flair.css_class})
+
+    if flair_list:
+        for result in subreddit.flair.update(flair_list):
+            if not result.get('ok'):
+                logging.error('Unable to update flair: %s', result.get('errors') or result.get('warnings'))
+
+
+def set_template(subreddit, name, lvl):
+    try:
+        subreddit.flair.set(name, text=lvl.name, flair_template_id=lvl.flair_template_id)
+    except (praw.exceptions.RedditAPIException, prawcore.exceptions.PrawcoreException) as e:
+        logging.error('Unable to set flair for %s: %s', name, e)
@@ -0,0 +1,214 @@
+"""An optional scoreboard, served over HTTP by the bot itself.
+
+The scoreboard runs in its own thread, with its own read-only connection to the database, so it never
+holds up the bot, and (thanks to WAL journaling) never blocks the bot's writes. Responses are cached,
+and tagged with the database's leaderboard generation, which changes whenever any redditor's points
+do; until then, the cached responses are reused, and clients that send the tag back with
+`If-None-Match` get an empty "304 Not Modified" response instead.
+
+Pages:
+
+    /                   The leaderboard, as HTML
+    /leaderboard.json   The leaderboard, as JSON; takes optional `page` and `per_page` parameters
+    /users/<name>.json  A redditor's points, rank, level, and the redditors around them, as JSON
+"""
+import contextlib
+import html
+import http.server
+import json
+import logging
+import threading
+import urllib.parse
+from collections import namedtuple
+
+from . import database, level
+
+### Globals ###
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# Maximum number of entries per page of the JSON leaderboard
+MAX_PER_PAGE = 100
+
+# Maximum number of responses to cache for each leaderboard generation
+MAX_CACHED_RESPONSES = 1000
+
+# A response body, and its ETag, which is the leaderboard generation it was made from
+Response = namedtuple('Response', 'etag content_type body')
+
+### Functions ###
+
+
+def serve(cfg):
+    """Return a context manager that serves the scoreboard while in use, if it is enabled in the
+    config.
+    """
+    if not cfg.serve_scoreboard:
+        return contextlib.nullcontext()
+    # The database has to exist (and be up to date) before it can be opened read-only
+    database.Database(cfg.database_path).close()
+    return Server(cfg.database_path, cfg.levels, cfg.subreddit, host=cfg.scoreboard_host,
+                  port=cfg.scoreboard_port, size=cfg.scoreboard_size)
+
+
+### Classes ###
+
+
+class Server(threading.Thread):
+    """Serves the scoreboard in a background thread, with its own read-only database connection."""
+
+    def __init__(self, dbpath, levels, subreddit_name, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 size=database.LEADERBOARD_SNAPSHOT_SIZE):
+        super().__init__(name='scoreboard', daemon=True)
+        self.dbpath = dbpath
+        self.levels = levels
+        self.subreddit_name = subreddit_name
+        self.size = size
+        self.db = None
+        self._responses = {}
+        self._generation = None
+        self._ready = threading.Event()
+
+        # Bind now, so that e.g. a port that is already in use is reported right away
+        self.httpd = http.server.HTTPServer((host, port), RequestHandler)
+        self.httpd.scoreboard = self
+
+    def __enter__(self):
+        self.start()
+        self._ready.wait()
+        if self.db is None:
+            self.httpd.server_close()
+            raise RuntimeError(f'Unable to open the database for the scoreboard: {self.dbpath}')
+        host, port = self.httpd.server_address[:2]
+        logging.info('Serving the scoreboard at http://%s:%d/', host, port)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.join()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def run(self):
+        try:
+            # The connection has to be created in the thread that will use it
+            self.db = database.Database(self.dbpath, read_only=True)
+        finally:
+            self._ready.set()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.db.close()
+
+    def respond(self, path, query):
+        """Return the Response for the path and query string, or None if there is no such page."""
+        generation = self.db.get_leaderboard_generation()
+        if generation != self._generation:
+            # Everything cached is out of date
+            self._responses.clear()
+            self._generation = generation
+
+        key = (path, query)
+        if key in self._responses:
+            return self._responses[key]
+
+        page = self.render(path, urllib.parse.parse_qs(query))
+        if page is None:
+            return None
+        content_type, body = page
+        response = Response(f'"{generation}"', content_type, body)
+        if len(self._responses) < MAX_CACHED_RESPONSES:
+            self._responses[key] = response
+        return response
+
+    def render(self, path, params):
+        """Return a (content type, body) tuple for the page, or None if there is no such page."""
+        if path in ('/', '/index.html'):
+            return 'text/html; charset=utf-8', self.render_html().encode('utf-8')
+        if path == '/leaderboard.json':
+            page = int(params.get('page', ['1'])[0])
+            per_page = int(params.get('per_page', [str(MAX_PER_PAGE)])[0])
+            if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+                raise ValueError(f'page must be at least 1, and per_page from 1 to {MAX_PER_PAGE}')
+            return 'application/json', json.dumps(self.leaderboard(page, per_page)).encode('utf-8')
+        if path.startswith('/users/') and path.endswith('.json'):
+            name = urllib.parse.unquote(path[len('/users/'):-len('.json')])
+            stats = self.user_stats(name)
+            if stats is None:
+                return None
+            return 'application/json', json.dumps(stats).encode('utf-8')
+        return None
+
+    def leaderboard(self, page, per_page):
+        offset = (page - 1) * per_page
+        if offset + per_page <= self.size:
+            entries = self.db.get_leaderboard_snapshot(self.size).entries[offset:offset + per_page]
+        else:
+            entries = self.db.get_leaderboard(limit=per_page, offset=offset)
+        return {
+            'page': page,
+            'per_page': per_page,
+            'entries': [entry._asdict() for entry in entries],
+        }
+
+    def user_stats(self, name):
+        redditor = self.db.find_redditor(name)
+        if redditor is None:
+            return None
+        points = self.db.get_points(redditor)
+        level_info = level.user_level_info(points, self.levels)
+        entry = self.db.get_rank(redditor)
+        return {
+            'name': redditor.name,
+            'points': points,
+            'rank': entry.rank if entry else None,
+            'level': level_info.current.name if level_info.current else None,
+            'next_level': level_info.next.name if level_info.next else None,
+            'points_to_next_level': level_info.next.points - points if level_info.next else None,
+            'around': [entry._asdict() for entry in self.db.get_leaderboard_around(redditor)],
+        }
+
+    def render_html(self):
+        title = html.escape(f'r/{self.subreddit_name} Scoreboard')
+        rows = '\n'.join(
+            f'<tr><td>{entry.rank}</td><td>{html.escape(entry.name)}</td><td>{entry.points}</td></tr>'
+            for entry in self.db.get_leaderboard_snapshot(self.size).entries
+        )
+        return (f'<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>{title}</title></head>\n'
+                f'<body>\n<h1>{title}</h1>\n<table>\n<tr><th>Rank</th><th>User</th><th>Points</th></tr>\n'
+                f'{rows}\n</table>\n</body>\n</html>\n')
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        try:
+            response = self.server.scoreboard.respond(path, query)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        if response is None:
+            self.send_error(404)
+            return
+
+        if self.headers.get('If-None-Match') == response.etag:
+            self.send_response(304)
+            self.send_header('ETag', response.etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.body)))
+        self.send_header('ETag', response.etag)
+        # Clients may keep responses, but should check that they're still current before using them
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        logging.debug('Scoreboard: %s - %s', self.address_string(), format % args)
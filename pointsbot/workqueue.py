@@ -0,0 +1,371 @@
+"""Handling comments in several worker processes, which share the database through a work queue.
+
+In this mode, a single ingest process streams the subreddit's comments, and adds each one with a command
+to the `work_item` table of the subreddit's database (ordinary comments would be ignored anyway, so they
+aren't queued). Any number of worker processes (e.g. one per core) then claim the items and handle them,
+the same way the bot does in a single process:
+
+* A worker claims items by leasing their submissions. Only the worker holding a submission's lease
+  handles its items, oldest first, so that e.g. a point is never removed before it was awarded.
+* While a worker is running, a background thread renews its leases (its heartbeat). If a worker dies,
+  its leases expire, and the submissions' remaining items are claimed by another worker.
+* Each point change is saved in the same transaction that checks the worker's lease and marks the item
+  as done, so an item is never saved by a worker that has lost its lease to another. Along with
+  `has_already_solved_once`, this means each command is acted on exactly once.
+
+Replies and flair updates are added to the outbox as usual, and only the ingest process sends them.
+"""
+import contextlib
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import praw
+import prawcore
+
+from . import bot, database, journal, logs, metrics, moderators, outbox, prefetch
+
+### Globals ###
+
+# Seconds that a worker's lease on a submission lasts, unless it is renewed
+LEASE_DURATION = 60
+
+# Seconds between renewals of a worker's leases
+HEARTBEAT_INTERVAL = LEASE_DURATION / 4
+
+# Seconds for a worker to wait before checking for new items, when there were none
+POLL_INTERVAL = 1
+
+# Maximum number of items (and submissions) claimed at a time, which are fetched together
+CLAIM_SIZE = prefetch.BATCH_SIZE
+
+# Number of times to try handling an item before giving up on it
+MAX_ATTEMPTS = 5
+
+# Seconds to keep items after they are finished (or the journal's retention, if longer), and between
+# deletions of older ones
+FINISHED_ITEM_RETENTION = 24 * 60 * 60
+PRUNE_INTERVAL = 60 * 60
+
+### Exceptions ###
+
+
+class LeaseLost(Exception):
+    """The worker's lease on a submission expired, and may have been claimed by another worker."""
+
+
+class RetryLater(Exception):
+    """An item couldn't be handled yet, and will be retried; its submission's later items have to wait."""
+
+
+### Main Functions ###
+
+
+def run_ingest(cfg):
+    """Stream every subreddit's comments into its work queue, and send the replies and flair updates
+    that the workers add to the outbox.
+    """
+    with contextlib.ExitStack() as stack:
+        dbs = [stack.enter_context(database.Database(profile.database_path)) for profile in cfg.profiles]
+        stack.enter_context(outbox.Sender([profile.database_path for profile in cfg.profiles],
+                                          lambda: bot.connect(cfg)))
+        # Run indefinitely, reconnecting any time a connection is lost
+        while True:
+            try:
+                reddit = bot.connect(cfg)
+                communities = []
+                for profile, db in zip(cfg.profiles, dbs):
+                    subreddit = reddit.subreddit(profile.subreddit)
+                    logging.info('Queueing comments from subreddit %s', subreddit.display_name)
+                    communities.append(bot.Community(subreddit, db, profile.levels, profile))
+
+                if cfg.catch_up:
+                    for community in communities:
+                        catch_up(community)
+                subreddit = reddit.subreddit('+'.join(profile.subreddit for profile in cfg.profiles))
+                ingest(subreddit, communities)
+
+            # Ignoring other potential exceptions for now, since we may not be able
+            # to recover from them as well as from these ones
+            except prawcore.exceptions.RequestException as e:
+                metrics.RECONNECTS.inc(reason='request')
+                logging.error('Unable to connect to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Trying again')
+            except prawcore.exceptions.ServerError as e:
+                metrics.RECONNECTS.inc(reason='server')
+                logging.error('Lost connection to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Attempting to reconnect')
+
+
+def run_workers(cfg, num_processes=1):
+    """Run the given number of worker processes, until they all exit."""
+    if num_processes <= 1:
+        run_worker(cfg)
+        return
+
+    processes = [multiprocessing.Process(target=worker_process, args=(cfg,), name=f'worker-{num}')
+                 for num in range(num_processes)]
+    for process in processes:
+        process.start()
+    logging.info('Started %d worker processes', num_processes)
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+
+def worker_process(cfg):
+    # Each process writes its own records to the log, since the background logging thread isn't copied
+    bot.setup_logging(cfg)
+    try:
+        run_worker(cfg)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_worker(cfg, worker=None):
+    """Claim and handle items from every subreddit's work queue, indefinitely."""
+    worker = worker or default_worker_name()
+    moderators.configure(ttl=cfg.moderator_cache_ttl)
+    dbpaths = [profile.database_path for profile in cfg.profiles]
+    with contextlib.ExitStack() as stack:
+        dbs = [stack.enter_context(database.Database(dbpath)) for dbpath in dbpaths]
+        stack.enter_context(Heartbeat(dbpaths, worker))
+        logging.info('Started worker %s', worker)
+        # Run indefinitely, reconnecting any time a connection is lost
+        while True:
+            try:
+                reddit = bot.connect(cfg)
+                me = bot.identify(reddit)
+                # Moderators may have changed while disconnected
+                moderators.invalidate()
+                communities = [bot.Community(reddit.subreddit(profile.subreddit), db, profile.levels, profile)
+                               for profile, db in zip(cfg.profiles, dbs)]
+                work(reddit, communities, me, worker)
+
+            except prawcore.exceptions.RequestException as e:
+                metrics.RECONNECTS.inc(reason='request')
+                logging.error('Unable to connect to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Trying again')
+            except prawcore.exceptions.ServerError as e:
+                metrics.RECONNECTS.inc(reason='server')
+                logging.error('Lost connection to Reddit')
+                logging.error('Error message: %s', e)
+                logging.error('Attempting to reconnect')
+
+
+### Ingest Functions ###
+
+
+def ingest(subreddit, communities):
+    """Add each new comment with a command to its community's work queue."""
+    by_name = {community.cfg.subreddit.lower(): community for community in communities}
+    # Comments read again after reconnecting are already in the queue (or were handled), so they are
+    # skipped when added
+    skip_existing = not any(community.db.get_latest_work_item_timestamp()
+                            or community.db.get_latest_comment_timestamp() for community in communities)
+    next_prune = 0
+    for window in bot.stream_windows(subreddit, bot.PREFETCH_WINDOW_SIZE, skip_existing=skip_existing):
+        metrics.observe_comments(window)
+        enqueue(by_name, window)
+        metrics.QUEUE_DEPTH.set(sum(community.db.count_pending_work_items() for community in communities),
+                                queue='work')
+
+        if time.monotonic() >= next_prune:
+            for community in communities:
+                # Kept at least as long as the journal, which is also how long the stream might go back
+                retention = max(FINISHED_ITEM_RETENTION, community.cfg.journal_retention)
+                community.db.delete_finished_work_items(time.time() - retention)
+                journal.prune(community.db)
+            next_prune = time.monotonic() + PRUNE_INTERVAL
+
+
+def enqueue(by_name, comments):
+    """Add the comments with commands to the work queues of the communities (keyed by lowercase
+    subreddit name) that they were posted in, unless they were already handled. Return the number added.
+    """
+    grouped = {}
+    for comm in comments:
+        if bot.find_commands(comm):
+            grouped.setdefault(comm.subreddit.display_name.lower(), []).append(comm)
+    num_added = 0
+    for name, comms in grouped.items():
+        db = by_name[name].db
+        handled_ids = find_handled_ids(db, comms)
+        num_added += db.add_work_items(comm for comm in comms if comm.id not in handled_ids)
+    if num_added:
+        logging.debug('Queued %d comments', num_added)
+    return num_added
+
+
+def find_handled_ids(db, comments):
+    """Return the ids of the comments that are in the journal, or that awarded or removed a point.
+
+    The workers add the journal's entries, so the database is read directly, rather than through this
+    process's (out of date) copy of the journal.
+    """
+    comment_ids = [comm.id for comm in comments]
+    return set(db.get_processed_comments(comment_ids)) | db.get_saved_comment_ids(comment_ids)
+
+
+def catch_up(community):
+    """Queue any comments with commands that were posted since the newest comment in the work queue
+    (or the database), e.g. while the ingest process wasn't running. Return the number queued.
+    """
+    db = community.db
+    timestamps = [ts for ts in (db.get_latest_work_item_timestamp(), db.get_latest_comment_timestamp())
+                  if ts is not None]
+    if not timestamps:
+        # Nothing has ever been handled, so there is nothing to catch up to
+        return 0
+
+    since = max(timestamps)
+    missed = []
+    for comm in community.subreddit.comments(limit=None):
+        if comm.created_utc < since:
+            break
+        if bot.find_commands(comm):
+            missed.append(comm)
+    # Comments that were already queued (or saved) are skipped
+    saved_ids = db.get_saved_comment_ids(comm.id for comm in missed)
+    num_added = db.add_work_items(comm for comm in reversed(missed) if comm.id not in saved_ids)
+    if num_added:
+        logging.info('Queued %d comments posted in %s while disconnected', num_added,
+                     community.subreddit.display_name)
+    return num_added
+
+
+### Worker Functions ###
+
+
+def work(reddit, communities, me, worker):
+    """Claim and handle items until an exception is raised."""
+    while True:
+        num_handled = sum(handle_claim(reddit, community, me, worker) for community in communities)
+        if not num_handled:
+            time.sleep(POLL_INTERVAL)
+
+
+def handle_claim(reddit, community, me, worker):
+    """Claim a batch of the community's items, and handle them. Return the number of items claimed."""
+    db = community.db
+    items = db.claim_work_items(worker, CLAIM_SIZE, LEASE_DURATION)
+    if not items:
+        return 0
+
+    # Submissions with an item to be retried, whose later items are left until then, so that they are
+    # still handled in order
+    retrying = set()
+    try:
+        comments = fetch_comments(reddit, [item['comment_id'] for item in items])
+        prefetch.prefetch(reddit, list(comments.values()))
+        for item in items:
+            if item['submission_id'] in retrying:
+                continue
+            try:
+                handle_item(community, me, worker, item, comments.get(item['comment_id']))
+            except RetryLater as e:
+                logging.warning('%s; leaving the rest of the comments on submission %s until then', e,
+                                item['submission_id'])
+                retrying.add(item['submission_id'])
+    except LeaseLost as e:
+        # The rest of the submission's items (and maybe others) now belong to another worker
+        logging.warning('%s; leaving the rest of the claimed comments', e)
+    finally:
+        db.release_work_leases(worker)
+    return len(items)
+
+
+def handle_item(community, me, worker, item, comm):
+    """Handle the item's comment, and mark it as done in the same transaction as any point change.
+    Return True if a point was awarded or removed, or raise RetryLater if it should be tried again.
+    """
+    db = community.db
+    if comm is None:
+        db.finish_work_item(item['comment_id'], 'failed', last_error='Comment not found')
+        return False
+
+    start = time.perf_counter()
+    try:
+        command = bot.classify(comm, community.cfg, me)
+    except praw.exceptions.RedditAPIException as e:
+        attempts = item['attempts'] + 1
+        if attempts >= MAX_ATTEMPTS:
+            logging.error('Giving up on comment %s after %d attempts: %s', comm.id, attempts, e)
+            db.finish_work_item(item['comment_id'], 'failed', attempts, last_error=str(e))
+            return False
+        db.finish_work_item(item['comment_id'], 'pending', attempts, last_error=str(e))
+        raise RetryLater(f'Unable to handle comment {comm.id} (attempt {attempts}): {e}')
+    classified = time.perf_counter()
+
+    with db.atomic(immediate=True):
+        if not db.renew_work_lease(item['submission_id'], worker, LEASE_DURATION):
+            raise LeaseLost(f'Lost the lease on submission {item["submission_id"]}')
+        if command:
+            processed = bot.persist_and_queue_replies(db, community.subreddit.display_name, community.levels,
+                                                      community.cfg, command)
+        else:
+            processed = False
+            journal.record(db, comm, 'rejected')
+        db.finish_work_item(item['comment_id'], 'done')
+    bot.log_comment(comm, command, processed, classify_ms=logs.elapsed_ms(start, classified),
+                    persist_ms=logs.elapsed_ms(classified))
+    return processed
+
+
+def fetch_comments(reddit, comment_ids):
+    """Fetch the comments, in batches. Return them keyed by id; deleted comments may be missing."""
+    fullnames = [f't1_{comment_id}' for comment_id in comment_ids]
+    comments = {}
+    for start in range(0, len(fullnames), prefetch.BATCH_SIZE):
+        for comm in reddit.info(fullnames=fullnames[start:start + prefetch.BATCH_SIZE]):
+            comments[comm.id] = comm
+    return comments
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+### Classes ###
+
+
+class Heartbeat(threading.Thread):
+    """Renews a worker's leases in a background thread, with its own database connections, so that
+    they don't expire while the worker is busy (e.g. waiting for Reddit).
+    """
+
+    def __init__(self, dbpaths, worker, interval=HEARTBEAT_INTERVAL, lease_duration=LEASE_DURATION):
+        super().__init__(name='heartbeat', daemon=True)
+        self.dbpaths = dbpaths
+        self.worker = worker
+        self.interval = interval
+        self.lease_duration = lease_duration
+        self._stopping = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.join()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        with contextlib.ExitStack() as stack:
+            dbs = [stack.enter_context(database.Database(dbpath)) for dbpath in self.dbpaths]
+            while not self._stopping.wait(self.interval):
+                for db in dbs:
+                    db.renew_work_leases(self.worker, self.lease_duration)
@@ -0,0 +1,234 @@
+import asyncio
+import tempfile
+
+from context import pointsbot
+from pointsbot import asyncbot
+
+from benchmarks import fakes, pipeline
+
+# asyncpraw may not be installed, so these stand in for its objects, wrapping the benchmark's fakes
+
+### Classes ###
+
+
+class FakeAuth:
+
+    limits = {}
+
+
+class AsyncStream:
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def comments(self, skip_existing=False):
+        for comm in self._stream.comments():
+            yield comm
+
+
+class AsyncFlair:
+
+    def __init__(self, reddit):
+        self._reddit = reddit
+
+    async def set(self, redditor, text=None, flair_template_id=None):
+        self._reddit.flair.append((redditor, text))
+
+
+class AsyncSubreddit:
+
+    def __init__(self, subreddit, reddit):
+        self._subreddit = subreddit
+        self.display_name = subreddit.display_name
+        self.stream = AsyncStream(subreddit.stream)
+        self.flair = AsyncFlair(reddit)
+
+    async def moderator(self):
+        return self._subreddit.moderator()
+
+
+class AsyncComment:
+
+    def __init__(self, reddit, id):
+        self._reddit = reddit
+        self.id = id
+
+    async def reply(self, body):
+        if self.id in self._reddit.errors:
+            raise self._reddit.errors.pop(self.id)
+        self._reddit.replies.append(self.id)
+
+
+class AsyncReddit:
+    """Serves the fake Reddit's objects, and records the replies and flair that are sent."""
+
+    auth = FakeAuth()
+
+    def __init__(self, reddit, subreddit, errors=None):
+        self._reddit = reddit
+        # There is only the one subreddit
+        self._subreddit = AsyncSubreddit(subreddit, self)
+        self.errors = errors or {}
+        self.replies = []
+        self.flair = []
+
+    async def info(self, fullnames):
+        for thing in self._reddit.info(fullnames):
+            yield thing
+
+    async def comment(self, id, fetch=True):
+        if fetch:
+            raise AssertionError('The comment should not be fetched')
+        return AsyncComment(self, id)
+
+    async def subreddit(self, name):
+        return self._subreddit
+
+
+### Functions ###
+
+
+def run_pipeline(reddit, cfg, me, stages):
+    """Open the database and run the coroutine returned by stages(pipeline). Return the database's
+    points and outbox statuses afterwards.
+    """
+    async def run():
+        db = asyncbot.AsyncDatabase(cfg.database_path)
+        await db.open()
+        try:
+            subreddit = await reddit.subreddit(cfg.subreddit)
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            await stages(asyncbot.Pipeline(reddit, subreddit, [community], cfg, me))
+            return await db.run(lambda db: (sorted(map(tuple, db.get_all_points())), get_statuses(db)))
+        finally:
+            await db.close()
+
+    return asyncio.run(run())
+
+
+async def handle_stream(pipeline):
+    """Run the ingest, classify and persist stages, until every comment in the stream is persisted."""
+    tasks = [asyncio.create_task(pipeline.classify(queue)) for queue in pipeline.classify_queues]
+    tasks.append(asyncio.create_task(pipeline.persist()))
+    try:
+        # If a stage fails, the queues stop emptying, so the time limits make sure its error is raised
+        await asyncio.wait_for(pipeline.ingest(), 10)
+        for queue in [*pipeline.classify_queues, pipeline.persist_queue]:
+            await asyncio.wait_for(queue.join(), 10)
+    finally:
+        await stop(tasks)
+
+
+async def send_outbox(pipeline, is_done):
+    """Run the dispatch and send stages, until is_done(statuses) returns True."""
+    tasks = [asyncio.create_task(pipeline.send(queue)) for queue in pipeline.send_queues]
+    tasks.append(asyncio.create_task(pipeline.dispatch()))
+    db = next(iter(pipeline.communities.values())).db
+    try:
+        for _ in range(1000):
+            if is_done(await db.run(get_statuses)):
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('Timed out')
+    finally:
+        await stop(tasks)
+
+
+async def stop(tasks):
+    """Cancel the tasks, and raise the first exception that any of them raised."""
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if not isinstance(result, asyncio.CancelledError):
+            raise result
+
+
+def get_statuses(db):
+    rows = db.conn.execute('SELECT kind, target, status, attempts FROM outbox ORDER BY rowid')
+    return [tuple(row) for row in rows]
+
+
+### Tests ###
+
+
+def test_pipeline_awards_the_same_points_as_the_sync_bot():
+    command_mix = fakes.CommandMix(0.2, 0.05, 0.05)
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+
+    pipeline.clear_caches()
+    reddit, subreddit, _ = fakes.generate(500, command_mix)
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            pointsbot.bot.monitor_comments(reddit, subreddit, [community], me, pipeline.NullSender())
+            expected_points = sorted(map(tuple, db.get_all_points()))
+            expected_replies = len([item for item in db.get_due_outbox_items(1000, now=float('inf'))
+                                    if item['kind'] == 'reply'])
+            assert expected_points
+
+    pipeline.clear_caches()
+    reddit, subreddit, _ = fakes.generate(500, command_mix)
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        points, statuses = run_pipeline(AsyncReddit(reddit, subreddit), cfg, me, handle_stream)
+        assert points == expected_points
+        assert len([status for status in statuses if status[0] == 'reply']) == expected_replies
+
+
+def test_comment_whose_parent_is_missing_is_skipped():
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(300, fakes.CommandMix(1.0, 0, 0))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    command_comment = next(comm for comm in comments if pointsbot.bot.find_commands(comm))
+    # e.g. the parent was deleted, and Reddit no longer lists it
+    del reddit._objects[command_comment.parent_id]
+
+    def fetch_parent():
+        raise AssertionError('The parent was fetched synchronously')
+
+    command_comment.parent = fetch_parent
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        points, statuses = run_pipeline(AsyncReddit(reddit, subreddit), cfg, me, handle_stream)
+        assert points
+        assert command_comment.id not in {status[1] for status in statuses}
+        with pointsbot.database.Database(cfg.database_path) as db:
+            assert db.get_processed_comments([command_comment.id]) == {command_comment.id: 'rejected'}
+
+
+def test_send_stage_retries_items_that_fail():
+    pipeline.clear_caches()
+    reddit, subreddit, _ = fakes.generate(0)
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    async_reddit = AsyncReddit(reddit, subreddit, errors={'c1': RuntimeError('Connection reset')})
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            for comment_id in ('c1', 'c2'):
+                db.add_outbox_reply('benchmark', comment_id, 'Thanks!')
+            db.add_outbox_flair('benchmark', 'user100', 'Novice', None)
+
+        def is_done(statuses):
+            return all(status[2:] != ('pending', 0) for status in statuses)
+
+        _, statuses = run_pipeline(async_reddit, cfg, me, lambda pipeline: send_outbox(pipeline, is_done))
+        assert statuses == [('reply', 'c1', 'pending', 1), ('reply', 'c2', 'sent', 1),
+                            ('flair', 'user100', 'sent', 1)]
+        assert async_reddit.replies == ['c2']
+        assert async_reddit.flair == [('user100', 'Novice')]
+
+
+def test_moderators_are_not_fetched_while_checking():
+    pipeline.clear_caches()
+    reddit, subreddit, _ = fakes.generate(500, fakes.CommandMix(0.05, 0.2, 0.05))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    # Every list is stale as soon as it is fetched, but fetching it is a coroutine
+    pointsbot.moderators.configure(ttl=0, refresh_on_check=False)
+    try:
+        with tempfile.TemporaryDirectory() as dirname:
+            cfg = pipeline.make_config(dirname)
+            points, _ = run_pipeline(AsyncReddit(reddit, subreddit), cfg, me, handle_stream)
+            assert points
+    finally:
+        pointsbot.moderators.configure()
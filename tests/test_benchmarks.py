@@ -0,0 +1,78 @@
+import json
+import os.path
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from context import pointsbot
+
+from benchmarks import fake_reddit, fakes, pipeline
+
+### Functions ###
+
+
+def get(server, path):
+    try:
+        with urllib.request.urlopen(server.url + path) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, None
+
+
+### Tests ###
+
+
+def test_pipeline_benchmark_runs_every_stage():
+    results = pipeline.run(500, fakes.CommandMix(0.2, 0.05, 0.05))
+    assert results['comments'] == 500
+    assert results['outbox_items'] > 0
+    assert results['statements_per_comment'] > 0
+    assert set(results['stages']) == {name for name, _, _ in pipeline.STAGES}
+    # The stages are restored afterwards
+    assert pointsbot.bot.classify.__module__ == 'pointsbot.bot'
+    assert not hasattr(pointsbot.bot.classify, '__wrapped__')
+
+
+def test_fake_reddit_serves_praw():
+    world = fake_reddit.World(comment_rate=1000)
+    # A generous rate limit, so that PRAW doesn't space out the requests
+    faults = fake_reddit.Faults(rate_limit=100000)
+    with fake_reddit.Server(world, faults, port=0) as server, tempfile.TemporaryDirectory() as dirname:
+        cfg = pointsbot.config.Config(os.path.join(dirname, 'pointsbot.toml'), 'benchmark', 'id', 'secret',
+                                      'PointsBot', 'password', [], reddit_oauth_url=server.url,
+                                      reddit_url=server.url)
+        reddit = pointsbot.bot.connect(cfg)
+        assert pointsbot.bot.identify(reddit).name == 'PointsBot'
+
+        subreddit = reddit.subreddit('benchmark')
+        assert subreddit.title == 'r/benchmark'
+        assert [mod.name for mod in subreddit.moderator()] == [mod.name for mod in world.generator.moderators]
+
+        time.sleep(0.1)
+        comments = list(subreddit.comments(limit=10))
+        assert len(comments) == 10
+        assert comments[0].created_utc >= comments[-1].created_utc
+        assert [comm.id for comm in reddit.info(fullnames=[comments[0].fullname])] == [comments[0].id]
+
+        reply = comments[0].reply('Thanks!')
+        assert reply.author.name == 'PointsBot'
+        assert reply.parent_id == comments[0].fullname
+
+        subreddit.flair.set('user7', text='Novice', flair_template_id='template')
+        assert [(str(item['user']), item['flair_text']) for item in subreddit.flair(limit=None)] == \
+            [('user7', 'Novice')]
+        assert reddit.auth.limits['remaining'] is not None
+
+
+def test_fake_reddit_injects_errors_and_rate_limits():
+    with fake_reddit.Server(fake_reddit.World(), fake_reddit.Faults(error_rate=1.0), port=0) as server:
+        status, _, _ = get(server, '/r/benchmark/about')
+        assert status in fake_reddit.ERROR_STATUSES
+
+    with fake_reddit.Server(fake_reddit.World(), fake_reddit.Faults(rate_limit=2), port=0) as server:
+        statuses = [get(server, '/r/benchmark/about')[0] for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        _, headers, _ = get(server, '/r/benchmark/about')
+        assert headers['x-ratelimit-remaining'] == '0'
+        assert get(server, '/_fake/stats')[2]['counts']['rate_limited'] == 2
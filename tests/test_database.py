@@ -0,0 +1,232 @@
+import os.path
+import tempfile
+from collections import namedtuple
+
+from context import pointsbot
+
+### Data Structures ###
+
+MockRedditor = namedtuple('MockRedditor', 'id name')
+MockSubmission = namedtuple('MockSubmission', 'id author')
+MockComment = namedtuple('MockComment', 'id created_utc')
+
+### Functions ###
+
+
+def make_database(dirname):
+    return pointsbot.database.Database(os.path.join(dirname, 'pointsbot.db'))
+
+
+### Tests ###
+
+
+def test_connection_is_long_lived_and_uses_wal():
+    with tempfile.TemporaryDirectory() as dirname:
+        db = make_database(dirname)
+        conn = db.conn
+        db.add_redditor(MockRedditor('1', 'Tim_the_Sorcerer'))
+        db.get_points(MockRedditor('1', 'Tim_the_Sorcerer'))
+        assert db.conn is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        db.close()
+        assert db.conn is None
+
+
+def test_nested_calls_commit_once():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            redditor = MockRedditor('1', 'Tim_the_Sorcerer')
+            db.adjust_points(redditor, 3)
+            assert not db.conn.in_transaction
+            assert db.get_points(redditor) == 3
+
+
+def test_failed_call_rolls_back():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            redditor = MockRedditor('1', 'Tim_the_Sorcerer')
+
+            @pointsbot.database.transaction
+            def add_then_fail(self):
+                self.add_redditor(redditor)
+                raise RuntimeError
+
+            try:
+                add_then_fail(db)
+            except RuntimeError:
+                pass
+            assert db._transaction_depth == 0
+            assert db.add_redditor(redditor) == 1
+
+
+def test_award_and_remove_point():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            op = MockRedditor('1', 'Tim_the_Sorcerer')
+            solver = MockRedditor('2', 'Arthur')
+            mod = MockRedditor('3', 'Bedevere')
+            submission = MockSubmission('s1', op)
+            solution = MockComment('c1', 0)
+            helped = MockComment('c2', 10)
+
+            assert db.add_point_for_solution(submission, solver, solution, op, helped) == 1
+            assert db.has_already_solved_once(submission, solver)
+            # Already solved, so no extra point is awarded
+            assert db.add_point_for_solution(submission, solver, solution, op, helped) == 1
+
+            removed = MockComment('c3', 20)
+            assert db.soft_remove_point_for_solution(submission, solver, mod, removed) == 0
+            # Already removed, so no point is taken twice
+            assert db.soft_remove_point_for_solution(submission, solver, mod, removed) is None
+            assert db.get_points(solver) == 0
+
+            deleted_submission = MockSubmission('s2', None)
+            assert db.add_point_for_solution(deleted_submission, solver, MockComment('c4', 30), mod,
+                                             MockComment('c5', 40)) == 1
+
+
+def test_hot_statements_use_indexes():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            for name, plan in db.explain_query_plans().items():
+                assert not any(line.startswith('SCAN') for line in plan), (name, plan)
+
+
+def test_outbox_items_are_due_in_order():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            db.add_outbox_reply('test', 'c1', 'Thanks!')
+            db.add_outbox_flair('test', 'Arthur', 'Level One', None)
+            items = db.get_due_outbox_items(10)
+            assert [item['kind'] for item in items] == ['reply', 'flair']
+
+            db.update_outbox_item(items[0]['rowid'], 'sent', 1)
+            db.update_outbox_item(items[1]['rowid'], 'pending', 1, next_attempt_at=items[1]['next_attempt_at'] + 60)
+            assert db.get_due_outbox_items(10) == []
+
+
+def test_latest_comment_timestamp_and_saved_ids():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            assert db.get_latest_comment_timestamp() is None
+
+            op = MockRedditor('1', 'Tim_the_Sorcerer')
+            solver = MockRedditor('2', 'Arthur')
+            submission = MockSubmission('s1', op)
+            db.add_point_for_solution(submission, solver, MockComment('c1', 1000),
+                                      op, MockComment('c2', 1600000000))
+
+            assert db.get_latest_comment_timestamp() == 1600000000
+            assert db.get_saved_comment_ids(['c1', 'c2', 'c3']) == {'c1', 'c2'}
+
+
+def test_point_changes_are_kept_in_ledger():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            op = MockRedditor('1', 'Tim_the_Sorcerer')
+            solver = MockRedditor('2', 'Arthur')
+            mod = MockRedditor('3', 'Bedevere')
+            submission = MockSubmission('s1', op)
+
+            db.add_point_for_solution(submission, solver, MockComment('c1', 100), op, MockComment('c2', 200))
+            assert db.soft_remove_point_for_solution(submission, solver, mod, MockComment('c3', 300)) == 0
+            # No longer deleted when their points reach zero
+            assert db.add_redditor(solver) == 0
+            assert db.adjust_points(solver, 5, note='Moved from old subreddit') == 5
+
+            events = db.get_point_events(solver)
+            assert [(event['kind'], event['points']) for event in events] == [('award', 1), ('remove', -1),
+                                                                              ('adjust', 5)]
+            assert [event['comment_id'] for event in events[:2]] == ['c2', 'c3']
+            assert db.get_points(solver, as_of=250) == 1
+            assert db.get_points(solver, as_of=300) == 0
+
+            # The ledger can't be changed, only added to
+            try:
+                db.conn.execute('DELETE FROM point_event')
+            except pointsbot.database.sqlite.IntegrityError:
+                pass
+            else:
+                assert False, 'point_event rows should not be deletable'
+
+            db.conn.execute('UPDATE redditor SET points = 42')
+            assert db.recompute_points() == 1
+            assert db.get_points(solver) == 5
+
+
+def test_point_is_restored_only_once():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            op = MockRedditor('1', 'Tim_the_Sorcerer')
+            solver = MockRedditor('2', 'Arthur')
+            mod = MockRedditor('3', 'Bedevere')
+            submission = MockSubmission('s1', op)
+
+            db.add_point_for_solution(submission, solver, MockComment('c1', 100), op, MockComment('c2', 200))
+            # Not removed yet, so there is nothing to restore
+            assert db.add_back_point_for_solution(submission, solver) == 1
+            db.soft_remove_point_for_solution(submission, solver, mod, MockComment('c3', 300))
+            assert db.add_back_point_for_solution(submission, solver) == 1
+            assert db.add_back_point_for_solution(submission, solver) == 1
+
+            events = db.get_point_events(solver)
+            assert [event['kind'] for event in events] == ['award', 'remove', 'restore']
+
+
+def test_migration_fills_ledger_from_existing_points():
+    with tempfile.TemporaryDirectory() as dirname:
+        dbpath = os.path.join(dirname, 'pointsbot.db')
+        # Create a version 0.3.1 database, where an old point predates the solution table
+        conn = pointsbot.database.sqlite.connect(dbpath)
+        versions = pointsbot.database.Database.SCHEMA_VERSION_STATEMENTS
+        for version in sorted(versions):
+            if version < pointsbot.database.DatabaseVersion(0, 4, 0):
+                for stmt in versions[version]:
+                    conn.execute(stmt)
+        conn.executescript('''
+            INSERT INTO bot_version (major, minor, patch) VALUES (0, 3, 1);
+            INSERT INTO redditor (id, name, points) VALUES ('2', 'Arthur', 2);
+            INSERT INTO submission (id, author_id) VALUES ('s1', '1');
+            INSERT INTO comment (id, author_id, created_at_datetime) VALUES ('c1', '2', '2021-01-01T00:00:00');
+            INSERT INTO comment (id, author_id, created_at_datetime) VALUES ('c2', '1', '2021-01-02T00:00:00');
+            INSERT INTO solution (submission_rowid, author_rowid, comment_rowid, chosen_by_comment_rowid)
+            VALUES (1, 1, 1, 2);
+        ''')
+        conn.commit()
+        conn.close()
+
+        with pointsbot.database.Database(dbpath) as db:
+            solver = MockRedditor('2', 'Arthur')
+            assert db.get_points(solver) == 2
+            events = db.get_point_events(solver)
+            assert [(event['kind'], event['points']) for event in events] == [('award', 1), ('adjust', 1)]
+            assert db.recompute_points() == 0
+
+
+def test_leaderboard_ranks_and_snapshot():
+    with tempfile.TemporaryDirectory() as dirname:
+        with make_database(dirname) as db:
+            names_and_points = [('Arthur', 5), ('Bedevere', 3), ('Galahad', 3), ('Lancelot', 1), ('Robin', 0)]
+            redditors = [MockRedditor(str(i), name) for i, (name, _) in enumerate(names_and_points)]
+            for redditor, (_, points) in zip(redditors, names_and_points):
+                db.adjust_points(redditor, points)
+
+            assert [tuple(entry) for entry in db.get_leaderboard(limit=10)] == [
+                (1, 'Arthur', 5), (2, 'Bedevere', 3), (2, 'Galahad', 3), (4, 'Lancelot', 1)]
+            assert [tuple(entry) for entry in db.get_leaderboard(limit=2, offset=2)] == [
+                (2, 'Galahad', 3), (4, 'Lancelot', 1)]
+            assert db.get_rank(redditors[2]) == (2, 'Galahad', 3)
+            assert db.get_rank(redditors[4]) is None
+            assert [entry.name for entry in db.get_leaderboard_around(redditors[3], radius=1)] == [
+                'Galahad', 'Lancelot']
+
+            snapshot = db.get_leaderboard_snapshot()
+            assert db.get_leaderboard_snapshot() is snapshot
+            db.adjust_points(redditors[4], 10)
+            new_snapshot = db.get_leaderboard_snapshot()
+            assert new_snapshot.generation != snapshot.generation
+            assert new_snapshot.entries[0] == (1, 'Robin', 10)
+
+            plan = db.conn.execute('EXPLAIN QUERY PLAN SELECT name FROM redditor WHERE points > 0 '
+                                   'ORDER BY points DESC, name LIMIT 10').fetchall()
+            assert all('redditor_points_idx' in row['detail'] for row in plan)
@@ -0,0 +1,136 @@
+import os.path
+import tempfile
+from collections import namedtuple
+
+from context import pointsbot
+
+from benchmarks import fakes, pipeline
+
+### Data Structures ###
+
+MockComment = namedtuple('MockComment', 'id created_utc')
+
+### Classes ###
+
+
+class RecordingStream(fakes.FakeStream):
+    """Records whether the comments already listed were skipped."""
+
+    def __init__(self, comments):
+        super().__init__(comments)
+        self.skipped_existing = None
+
+    def comments(self, skip_existing=False, pause_after=None):
+        self.skipped_existing = skip_existing
+        return super().comments(skip_existing=skip_existing, pause_after=pause_after)
+
+
+### Functions ###
+
+
+def count_outbox_items(db):
+    return len(db.get_due_outbox_items(10000, now=float('inf')))
+
+
+### Tests ###
+
+
+def test_comments_read_again_are_skipped():
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(1000, fakes.CommandMix(0.2, 0.05, 0.05))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            communities = [pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)]
+            subreddit.stream = fakes.FakeStream(comments[:600])
+            pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+            points = db.get_all_points()
+            num_items = count_outbox_items(db)
+            assert num_items
+
+            # After reconnecting, the stream starts with comments that were already read; the first
+            # time from the in-memory journal, and the second from the database
+            for clear in (False, True):
+                if clear:
+                    pointsbot.journal.clear()
+                subreddit.stream = fakes.FakeStream(comments[500:600])
+                pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+                assert db.get_all_points() == points
+                assert count_outbox_items(db) == num_items
+
+            # Comments that weren't read yet are still handled
+            subreddit.stream = fakes.FakeStream(comments[500:])
+            pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+            assert count_outbox_items(db) > num_items
+
+
+def test_comments_already_listed_are_skipped_while_journal_is_empty():
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(300, fakes.CommandMix(0.2, 0.05, 0.05))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            communities = [pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)]
+            subreddit.stream = RecordingStream(comments[:200])
+            pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+            assert subreddit.stream.skipped_existing
+
+            subreddit.stream = RecordingStream(comments[100:])
+            pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+            assert not subreddit.stream.skipped_existing
+
+            # e.g. just after upgrading, or once every entry has aged out, the points are still saved but
+            # the journal can't tell which comments were handled
+            db.conn.execute('DELETE FROM processed_comment')
+            db.conn.commit()
+            pointsbot.journal.clear()
+            subreddit.stream = RecordingStream([])
+            pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+            assert subreddit.stream.skipped_existing
+
+
+def test_old_entries_age_out():
+    pointsbot.journal.clear()
+    with tempfile.TemporaryDirectory() as dirname:
+        with pointsbot.database.Database(os.path.join(dirname, 'pointsbot.db')) as db:
+            assert pointsbot.journal.newest(db) is None
+            for comment_id, created_utc in [('old', 100), ('new', 1000)]:
+                pointsbot.journal.record(db, MockComment(comment_id, created_utc), 'rejected')
+            assert pointsbot.journal.newest(db) == 1000
+            assert db.get_processed_comments(['old', 'new', 'other']) == {'old': 'rejected', 'new': 'rejected'}
+
+            pointsbot.journal.configure(retention=500)
+            try:
+                assert pointsbot.journal.prune(db, now=1200) == 1
+                # Not again until the prune interval has passed
+                assert pointsbot.journal.prune(db, now=1300) == 0
+            finally:
+                pointsbot.journal.configure()
+
+            pointsbot.journal.clear()
+            comments = [MockComment('old', 100), MockComment('new', 1000), MockComment('newer', 2000)]
+            assert pointsbot.journal.handled_ids(db, comments) == {'new'}
+
+
+def test_entries_rolled_back_are_forgotten():
+    pipeline.clear_caches()
+    with tempfile.TemporaryDirectory() as dirname:
+        with pointsbot.database.Database(os.path.join(dirname, 'pointsbot.db')) as db:
+            comment = MockComment('c1', 100)
+            try:
+                with db.atomic():
+                    pointsbot.journal.record(db, comment, 'awarded')
+                    raise RuntimeError('Unable to save the point')
+            except RuntimeError:
+                pass
+            assert db.get_processed_comments(['c1']) == {}
+            assert pointsbot.journal.handled_ids(db, [comment]) == set()
+            assert pointsbot.journal.newest(db) is None
+
+            with db.atomic():
+                pointsbot.journal.record(db, comment, 'awarded')
+                # Not until the transaction commits
+                assert pointsbot.journal.handled_ids(db, [comment]) == set()
+            assert pointsbot.journal.handled_ids(db, [comment]) == {'c1'}
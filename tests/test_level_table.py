@@ -0,0 +1,51 @@
+import pytest
+
+from context import pointsbot
+
+### Data Structures ###
+
+Level = pointsbot.level.Level
+
+LEVELS = [
+    Level('Helper', 5, None),
+    Level('Trusted Helper', 15, None),
+    Level('Super Helper', 45, None),
+]
+
+### Functions ###
+
+
+def check_batch_lookup(table):
+    assert list(table.num_reached_batch([0, 5, 14, 15, 100])) == [0, 1, 1, 2, 3]
+    all_points = list(range(-1, 60))
+    assert list(table.num_reached_batch(all_points)) == [table.num_reached(points) for points in all_points]
+    assert table.current_batch([4, 45]) == [None, LEVELS[2]]
+
+
+### Tests ###
+
+
+def test_level_table_matches_linear_scan():
+
+    def scan(points):
+        reached = [lvl for lvl in LEVELS if lvl.points <= points]
+        later = [lvl for lvl in LEVELS if lvl.points > points]
+        return tuple(reached[:-1]), reached[-1] if reached else None, later[0] if later else None
+
+    table = pointsbot.level.LevelTable(reversed(LEVELS))
+    assert list(table) == LEVELS
+    assert table.diffs == (5, 10, 30)
+    for points in range(-1, 60):
+        assert tuple(table.info(points)) == scan(points)
+        assert pointsbot.level.user_level_info(points, LEVELS) == table.info(points)
+
+
+def test_batch_lookup(monkeypatch):
+    monkeypatch.setattr(pointsbot.level, 'numpy', None)
+    check_batch_lookup(pointsbot.level.LevelTable(LEVELS))
+
+
+def test_batch_lookup_with_numpy(monkeypatch):
+    # NumPy is optional, but installed with the development packages
+    monkeypatch.setattr(pointsbot.level, 'numpy', pytest.importorskip('numpy'))
+    check_batch_lookup(pointsbot.level.LevelTable(LEVELS))
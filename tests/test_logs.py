@@ -0,0 +1,97 @@
+import json
+import logging
+import os.path
+import tempfile
+from collections import namedtuple
+
+from context import pointsbot
+
+from benchmarks import fakes, pipeline
+
+logs = pointsbot.logs
+
+### Data Structures ###
+
+MockRedditor = namedtuple('MockRedditor', 'name')
+MockComment = namedtuple('MockComment', 'id link_id author body')
+
+### Tests ###
+
+
+def test_json_log_records_comment_events():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pointsbot.config.Config(os.path.join(dirname, 'pointsbot.toml'), 'test', '', '', '', '', [],
+                                      log_format='json', log_category_levels={'rules': 'WARNING'})
+        try:
+            logs.setup(cfg)
+            comment = MockComment('c1', 't3_s1', MockRedditor('Arthur'), 'Nothing to see here')
+            # Comments without commands are only logged at DEBUG, which is left out by default
+            pointsbot.bot.log_comment(comment, None, False, classify_ms=0.5)
+            comment = comment._replace(id='c2', body='Thanks! !helped')
+            pointsbot.bot.log_comment(comment, None, False, classify_ms=0.25)
+            pointsbot.bot.rule_log.info('Left out, below the rules level')
+            logging.info('Plain message')
+            try:
+                raise ValueError('Bad row')
+            except ValueError:
+                logging.exception('Unable to send %s', 'reply')
+        finally:
+            logs.stop()
+            root.handlers[:] = handlers
+            root.setLevel(level)
+
+        with open(cfg.log_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+
+    assert [record['message'] for record in records] == ['Comment c2: rejected', 'Plain message',
+                                                         'Unable to send reply']
+    event = records[0]
+    assert event['logger'] == 'pointsbot.comments'
+    assert event['commands'] == ['op_solved']
+    assert event['author'] == 'Arthur'
+    assert event['timings_ms'] == {'classify_ms': 0.25}
+    assert records[1]['level'] == 'INFO'
+    assert 'exception' not in records[1]
+    assert records[2]['exception'].startswith('Traceback')
+    assert records[2]['exception'].endswith('ValueError: Bad row')
+
+
+def test_each_command_comment_is_logged_once():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(200, fakes.CommandMix(0.2, 0.05, 0.05))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        cfg.log_format = 'json'
+        try:
+            logs.setup(cfg)
+            with pointsbot.database.Database(cfg.database_path) as db:
+                communities = [pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)]
+                pointsbot.bot.monitor_comments(reddit, subreddit, communities, me, pipeline.NullSender())
+        finally:
+            logs.stop()
+            root.handlers[:] = handlers
+            root.setLevel(level)
+
+        with open(cfg.log_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+
+    comment_records = [record for record in records if record['logger'] == 'pointsbot.comments']
+    assert sorted(record['comment'] for record in comment_records) == \
+        sorted(comm.id for comm in comments if pointsbot.bot.find_commands(comm))
+
+
+def test_sampling_filter_keeps_warnings():
+    sampler = logs.SamplingFilter({'comments': 0.0})
+
+    def record(name, level):
+        return logging.LogRecord(name, level, __file__, 1, 'message', (), None)
+
+    assert not sampler.filter(record('pointsbot.comments', logging.INFO))
+    assert sampler.filter(record('pointsbot.comments', logging.WARNING))
+    assert sampler.filter(record('pointsbot.rules', logging.INFO))
+    assert sampler.filter(record('root', logging.DEBUG))
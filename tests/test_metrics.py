@@ -0,0 +1,58 @@
+import urllib.request
+
+from context import pointsbot
+
+from benchmarks import fakes, pipeline
+
+metrics = pointsbot.metrics
+
+### Tests ###
+
+
+def test_render_counters_and_histograms():
+    before = metrics.COMMANDS_MATCHED.value(command='mod_remove')
+    metrics.COMMANDS_MATCHED.inc(command='mod_remove')
+    assert metrics.COMMANDS_MATCHED.value(command='mod_remove') == before + 1
+
+    metrics.REDDIT_REQUEST.clear()
+    metrics.REDDIT_REQUEST.observe(0.003, kind='reply')
+    metrics.REDDIT_REQUEST.observe(0.3, kind='reply')
+    metrics.REDDIT_REQUEST.observe(100, kind='reply')
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE pointsbot_commands_matched_total counter' in lines
+    assert f'pointsbot_commands_matched_total{{command="mod_remove"}} {before + 1}' in lines
+    assert '# TYPE pointsbot_reddit_request_seconds histogram' in lines
+    assert 'pointsbot_reddit_request_seconds_bucket{kind="reply",le="0.001"} 0' in lines
+    assert 'pointsbot_reddit_request_seconds_bucket{kind="reply",le="0.005"} 1' in lines
+    assert 'pointsbot_reddit_request_seconds_bucket{kind="reply",le="0.5"} 2' in lines
+    assert 'pointsbot_reddit_request_seconds_bucket{kind="reply",le="+Inf"} 3' in lines
+    assert 'pointsbot_reddit_request_seconds_count{kind="reply"} 3' in lines
+    # Metrics without labels are served even before they change
+    assert any(line.startswith('pointsbot_comments_seen_total ') for line in lines)
+
+
+def test_pipeline_updates_metrics():
+    commands = ('op_solved', 'mod_solved', 'mod_remove')
+    seen = metrics.COMMENTS_SEEN.value()
+    matched = sum(metrics.COMMANDS_MATCHED.value(command=command) for command in commands)
+    evaluations = metrics.RULE_EVALUATION.count()
+    awarded = metrics.POINTS_CHANGED.value(action='award')
+
+    results = pipeline.run(300, fakes.CommandMix(0.2, 0.05, 0.05))
+
+    assert metrics.COMMENTS_SEEN.value() == seen + 300
+    # The rules are only checked for comments with commands
+    num_matched = sum(metrics.COMMANDS_MATCHED.value(command=command) for command in commands) - matched
+    assert 0 < num_matched < 300
+    assert metrics.RULE_EVALUATION.count() == evaluations + num_matched
+    assert metrics.POINTS_CHANGED.value(action='award') > awarded
+    assert metrics.DB_TRANSACTION.count() >= results['stages']['persist']['calls']
+
+
+def test_server_serves_metrics():
+    with metrics.Server(port=0) as server:
+        host, port = server.httpd.server_address[:2]
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert b'# TYPE pointsbot_queue_depth gauge' in response.read()
@@ -0,0 +1,39 @@
+from collections import namedtuple
+
+from context import pointsbot
+
+### Data Structures ###
+
+MockRedditor = namedtuple('MockRedditor', 'id name')
+
+
+class MockSubreddit:
+
+    display_name = 'test'
+
+    def __init__(self, moderator_names):
+        self.moderator_names = moderator_names
+        self.num_requests = 0
+
+    def moderator(self):
+        self.num_requests += 1
+        return [MockRedditor(str(i), name) for i, name in enumerate(self.moderator_names)]
+
+
+### Tests ###
+
+
+def test_moderators_are_fetched_once_per_ttl():
+    subreddit = MockSubreddit(['GlipGlorp7'])
+    cache = pointsbot.moderators.ModeratorCache(subreddit, ttl=60)
+
+    assert MockRedditor('1', 'glipglorp7') in cache
+    assert 'GlipGlorp7' in cache
+    assert MockRedditor('2', 'Tim_the_Sorcerer') not in cache
+    assert None not in cache
+    assert subreddit.num_requests == 1
+
+    subreddit.moderator_names.append('Tim_the_Sorcerer')
+    cache.invalidate()
+    assert MockRedditor('2', 'Tim_the_Sorcerer') in cache
+    assert subreddit.num_requests == 2
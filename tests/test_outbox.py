@@ -0,0 +1,140 @@
+import os.path
+import sqlite3
+import tempfile
+import time
+
+import praw
+
+from context import pointsbot
+
+### Functions ###
+
+
+def make_database(dirname):
+    return pointsbot.database.Database(os.path.join(dirname, 'pointsbot.db'))
+
+
+def get_statuses(db):
+    rows = db.conn.execute('SELECT status, attempts, last_error FROM outbox ORDER BY rowid')
+    return [tuple(row) for row in rows]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out'
+        time.sleep(0.01)
+
+
+def api_error(error_type):
+    return praw.exceptions.RedditAPIException([[error_type, 'message', None]])
+
+
+class FakeComment:
+
+    def __init__(self, reddit, id):
+        self.reddit = reddit
+        self.id = id
+
+    def reply(self, body):
+        if self.id in self.reddit.errors:
+            raise self.reddit.errors.pop(self.id)
+        self.reddit.replies.append((self.id, body))
+
+
+class FakeAuth:
+
+    limits = {}
+
+
+class FakeReddit:
+    """Replies to comments, unless there is an error to raise for the comment."""
+
+    auth = FakeAuth()
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.replies = []
+
+    def subreddit(self, name):
+        return None
+
+    def comment(self, id):
+        return FakeComment(self, id)
+
+
+### Tests ###
+
+
+def test_retries_back_off_exponentially():
+    assert [pointsbot.outbox.retry_delay(attempts) for attempts in (1, 2, 3)] == [30, 60, 120]
+    assert pointsbot.outbox.retry_delay(100) == pointsbot.outbox.MAX_RETRY_DELAY
+
+
+def test_only_some_api_errors_are_worth_retrying():
+    assert not pointsbot.outbox.is_permanent_error(api_error('RATELIMIT'))
+    assert pointsbot.outbox.is_permanent_error(api_error('DELETED_COMMENT'))
+    # Errors without items, e.g. network errors, are retried
+    assert not pointsbot.outbox.is_permanent_error(RuntimeError('Connection reset'))
+
+
+def test_failed_items_are_retried_until_they_give_up():
+    with tempfile.TemporaryDirectory() as dirname, make_database(dirname) as db:
+        db.add_outbox_reply('test', 'c1', 'Thanks!')
+        db.add_outbox_reply('test', 'c2', 'Thanks!')
+        first, second = db.get_due_outbox_items(10)
+
+        before = time.time()
+        pointsbot.outbox.record_failure(db, first, api_error('RATELIMIT'))
+        pointsbot.outbox.record_failure(db, second, api_error('THREAD_LOCKED'))
+        assert [status[:2] for status in get_statuses(db)] == [('pending', 1), ('failed', 1)]
+        assert db.get_due_outbox_items(10) == []
+        retried = db.get_due_outbox_items(10, now=before + pointsbot.outbox.BASE_RETRY_DELAY + 1)
+        assert [item['target'] for item in retried] == ['c1']
+
+        retried = dict(retried[0], attempts=pointsbot.outbox.MAX_ATTEMPTS - 1)
+        pointsbot.outbox.record_failure(db, retried, api_error('RATELIMIT'))
+        assert get_statuses(db)[0][0] == 'failed'
+
+
+def test_sent_items_are_deleted_once_old():
+    with tempfile.TemporaryDirectory() as dirname, make_database(dirname) as db:
+        for comment_id in ('c1', 'c2', 'c3'):
+            db.add_outbox_reply('test', comment_id, 'Thanks!')
+        sent, skipped, failed = db.get_due_outbox_items(10)
+        pointsbot.outbox.record_sent(db, sent)
+        pointsbot.outbox.record_sent(db, skipped, 'skipped')
+        db.update_outbox_item(failed['rowid'], 'failed', 1)
+
+        assert db.delete_sent_outbox_items(before=time.time() - 60) == 0
+        assert db.delete_sent_outbox_items(before=time.time() + 60) == 2
+        assert [status[0] for status in get_statuses(db)] == ['failed']
+
+
+def test_sender_survives_unexpected_errors(monkeypatch):
+    monkeypatch.setattr(pointsbot.outbox, 'POLL_INTERVAL', 0.01)
+    # The database is locked by another process once...
+    count_pending = pointsbot.database.Database.count_pending_outbox_items
+    locked = [True]
+
+    def count_pending_unless_locked(self):
+        if locked and locked.pop():
+            raise sqlite3.OperationalError('database is locked')
+        return count_pending(self)
+
+    monkeypatch.setattr(pointsbot.database.Database, 'count_pending_outbox_items', count_pending_unless_locked)
+
+    # ...and sending one of the replies fails with an unexpected error
+    reddit = FakeReddit({'c2': KeyError('body')})
+    with tempfile.TemporaryDirectory() as dirname, make_database(dirname) as db:
+        for comment_id in ('c1', 'c2', 'c3'):
+            db.add_outbox_reply('test', comment_id, 'Thanks!')
+
+        with pointsbot.outbox.Sender(db.path, lambda: reddit) as sender:
+            sender.notify()
+            wait_until(lambda: len(reddit.replies) == 2)
+            wait_until(lambda: get_statuses(db)[1][0] == 'pending' and get_statuses(db)[1][1] == 1)
+            assert sender.is_alive()
+
+        assert [comment_id for comment_id, _ in reddit.replies] == ['c1', 'c3']
+        assert get_statuses(db) == [('sent', 1, None), ('pending', 1, "'body'"), ('sent', 1, None)]
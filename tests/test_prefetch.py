@@ -0,0 +1,39 @@
+from collections import namedtuple
+
+from context import pointsbot
+
+### Data Structures ###
+
+MockThing = namedtuple('MockThing', 'fullname')
+MockComment = namedtuple('MockComment', 'fullname parent_id link_id')
+
+
+class MockReddit:
+
+    def __init__(self):
+        self.requests = []
+
+    def info(self, fullnames):
+        self.requests.append(fullnames)
+        return [MockThing(fullname) for fullname in fullnames]
+
+
+### Tests ###
+
+
+def test_parents_and_submissions_are_fetched_in_batches():
+    prefetch = pointsbot.prefetch
+    prefetch.clear()
+    reddit = MockReddit()
+    comments = [MockComment(f't1_c{i}', f't1_p{i}', 't3_s1') for i in range(150)]
+
+    prefetch.prefetch(reddit, comments)
+    # 150 parents plus one shared submission, in batches of 100
+    assert [len(fullnames) for fullnames in reddit.requests] == [100, 51]
+    assert prefetch.parent(comments[0]) == MockThing('t1_p0')
+    assert prefetch.submission(comments[-1]) == MockThing('t3_s1')
+
+    # Nothing is fetched twice
+    prefetch.prefetch(reddit, comments)
+    assert len(reddit.requests) == 2
+    prefetch.clear()
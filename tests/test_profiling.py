@@ -0,0 +1,62 @@
+import glob
+import os
+import os.path
+import pstats
+import signal
+import tempfile
+import time
+
+import pytest
+
+from context import pointsbot
+
+profiling = pointsbot.profiling
+
+### Tests ###
+
+
+def test_profiler_samples_every_nth_comment():
+    with tempfile.TemporaryDirectory() as dirname:
+        profiler = profiling.Profiler(dirname, sample_every=10, dump_every=2, use_signal=False)
+        with profiler:
+            # Nothing is sampled until profiling is started
+            assert profiler.sample(100) is profiling._NOT_SAMPLED
+            profiler.start()
+
+            # Windows of 4 comments: only those that reach the 10th, 20th, ... comment are sampled
+            sampled = []
+            for _ in range(5):
+                context = profiler.sample(4)
+                with context:
+                    sum(range(1000))
+                sampled.append(context is not profiling._NOT_SAMPLED)
+            assert sampled == [False, False, True, False, True]
+
+        paths = glob.glob(os.path.join(dirname, 'pointsbot-profile-*.pstats'))
+        assert len(paths) == 1
+        assert pstats.Stats(paths[0]).total_calls > 0
+
+
+def test_profiler_saves_memory_snapshot_diffs():
+    with tempfile.TemporaryDirectory() as dirname:
+        with profiling.Profiler(dirname, memory_interval=0.05, enabled=True, use_signal=False):
+            allocations = [bytearray(1024) for _ in range(1000)]
+            time.sleep(0.3)
+        del allocations
+
+        paths = glob.glob(os.path.join(dirname, 'pointsbot-memory-*.txt'))
+        assert paths
+        with open(sorted(paths)[0], encoding='utf-8') as f:
+            assert f.readline().startswith('Traced memory:')
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='SIGUSR1 is not available on this platform')
+def test_signal_toggles_profiling():
+    with tempfile.TemporaryDirectory() as dirname:
+        with profiling.Profiler(dirname) as profiler:
+            assert not profiler.enabled
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert profiler.enabled
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert not profiler.enabled
+        assert signal.getsignal(signal.SIGUSR1) is signal.SIG_DFL
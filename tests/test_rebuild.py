@@ -0,0 +1,80 @@
+import os.path
+import tempfile
+from collections import namedtuple
+
+from context import pointsbot
+
+### Data Structures ###
+
+MockComment = namedtuple('MockComment', 'id created_utc')
+
+Identity = pointsbot.bot.Identity
+SubmissionInfo = pointsbot.bot.SubmissionInfo
+
+### Functions ###
+
+
+def make_command(comment, submission, solver, chooser, remove_point=False):
+    solution_comment = MockComment(f'{comment.id}_parent', comment.created_utc - 1)
+    return pointsbot.bot.Command(comment, submission, solver, solution_comment, chooser, remove_point,
+                                 remove_point)
+
+
+### Tests ###
+
+
+def test_replay_matches_handling_commands_in_order():
+    op = Identity('1', 'Tim_the_Sorcerer')
+    solver = Identity('2', 'Arthur')
+    mod = Identity('3', 'Bedevere')
+    submission = SubmissionInfo('s1', op)
+
+    commands = [
+        # Listed out of order; the removal comes after both awards
+        make_command(MockComment('c3', 30), submission, solver, mod, remove_point=True),
+        make_command(MockComment('c1', 10), submission, solver, op),
+        make_command(MockComment('c2', 20), submission, solver, mod),
+        make_command(MockComment('c4', 40), submission, solver, mod, remove_point=True),
+    ]
+    solutions = pointsbot.rebuild.replay(commands)
+    assert len(solutions) == 1
+    assert solutions[0].chosen_by_comment.id == 'c1'
+    assert solutions[0].removed_by_comment.id == 'c3'
+
+
+def test_rebuilt_solutions_are_saved_and_swapped_in():
+    op = Identity('1', 'Tim_the_Sorcerer')
+    solver = Identity('2', 'Arthur')
+    mod = Identity('3', 'Bedevere')
+    submissions = [SubmissionInfo('s1', op), SubmissionInfo('s2', op)]
+
+    with tempfile.TemporaryDirectory() as dirname:
+        dbpath = os.path.join(dirname, 'pointsbot.db')
+        with pointsbot.database.Database(dbpath) as db:
+            db.add_redditor(Identity('4', 'Lancelot'))
+
+        rebuild_path = dbpath + pointsbot.rebuild.REBUILD_SUFFIX
+        with pointsbot.database.Database(rebuild_path) as db:
+            db.start_rebuild()
+            # Each submission's commands are replayed separately
+            solutions = [
+                *pointsbot.rebuild.replay([make_command(MockComment('c1', 10), submissions[0], solver, op)]),
+                *pointsbot.rebuild.replay([make_command(MockComment('c2', 20), submissions[1], solver, op)]),
+            ]
+            db.add_rebuilt_solutions(['s1', 's2', 's3'], solutions)
+            removed = pointsbot.rebuild.replay([
+                make_command(MockComment('c3', 30), submissions[1], solver, mod, remove_point=True),
+            ])
+            assert removed == []
+            assert db.get_rebuilt_submission_ids() == {'s1', 's2', 's3'}
+            db.finish_rebuild()
+            assert db.get_points(solver) == 2
+
+        pointsbot.rebuild.swap_in(rebuild_path, dbpath)
+        assert not os.path.exists(rebuild_path)
+        with pointsbot.database.Database(dbpath) as db:
+            assert db.get_points(solver) == 2
+            assert db.get_points(Identity('4', 'Lancelot')) == 0
+            assert [event['kind'] for event in db.get_point_events(solver)] == ['award', 'award']
+        with pointsbot.database.Database(dbpath + pointsbot.rebuild.BACKUP_SUFFIX) as db:
+            assert db.add_redditor(Identity('4', 'Lancelot')) == 0
@@ -61,3 +61,32 @@ for redditor in testredditors:
         print(leftpad(body, num_indents=1))
         print()
 print('*' * 80)
+
+
+def test_factory_makes_same_replies():
+    factory = pointsbot.reply.ReplyFactory(levels, feedback_url='https://example.com/feedback',
+                                           scoreboard_url='https://example.com/scoreboard')
+    redditor = testredditors[0]
+    for points in range(0, 560):
+        level_info = pointsbot.level.user_level_info(points, levels) if points > 0 else None
+        for is_add in (True, False):
+            expected = pointsbot.reply.make(redditor, points, level_info,
+                                            feedback_url='https://example.com/feedback',
+                                            scoreboard_url='https://example.com/scoreboard',
+                                            is_add=is_add)
+            assert factory.make(redditor, points, is_add=is_add) == expected
+    assert pointsbot.reply.factory_for(levels) is pointsbot.reply.factory_for(levels)
+
+    # Below the first level, there is no current level
+    factory = pointsbot.reply.ReplyFactory(levels[1:])
+    for points in range(1, 5):
+        level_info = pointsbot.level.user_level_info(points, levels[1:])
+        assert factory.make(redditor, points) == pointsbot.reply.make(redditor, points, level_info)
+
+
+def test_each_subreddit_keeps_its_factory():
+    # More subreddits, with their own links, than a small cache would hold
+    urls = [f'https://example.com/r/sub{i}/scoreboard' for i in range(10)]
+    factories = [pointsbot.reply.factory_for(levels, scoreboard_url=url) for url in urls]
+    assert all(pointsbot.reply.factory_for(levels, scoreboard_url=url) is factory
+               for url, factory in zip(urls, factories))
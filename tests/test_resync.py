@@ -0,0 +1,66 @@
+from context import pointsbot
+
+### Data Structures ###
+
+Flair = pointsbot.resync.Flair
+
+LEVELS = pointsbot.level.LevelTable([
+    pointsbot.level.Level('Helper', 5, 'template-helper'),
+    pointsbot.level.Level('Expert', 15, None),
+])
+
+### Tests ###
+
+
+def test_only_out_of_date_flair_is_changed():
+    all_points = [
+        ('Arthur', 15),     # Already has the right flair
+        ('Bedevere', 5),    # Has no flair yet
+        ('Galahad', 20),    # Has the old flair for the previous level
+        ('Lancelot', 1),    # Below the first level, but has a level's flair
+        ('Robin', 1),       # Below the first level, with flair that the bot doesn't manage
+        ('Tim', 20),        # A moderator
+    ]
+    current_flair = {
+        'arthur': Flair('Expert', ''),
+        'galahad': Flair('Helper', 'helper'),
+        'lancelot': Flair('Helper', 'helper'),
+        'robin': Flair('Brave', ''),
+    }
+    changes = pointsbot.resync.find_changes(all_points, LEVELS, current_flair, {'template-helper': 'helper'},
+                                            is_moderator=lambda name: name == 'Tim')
+    assert changes == [
+        ('Bedevere', pointsbot.resync.NO_FLAIR, Flair('Helper', 'helper')),
+        ('Galahad', Flair('Helper', 'helper'), Flair('Expert', '')),
+        ('Lancelot', Flair('Helper', 'helper'), pointsbot.resync.NO_FLAIR),
+    ]
+
+
+def test_templates_are_set_again_one_user_at_a_time():
+    class MockFlair:
+        def __init__(self):
+            self.updated = []
+            self.set_templates = []
+
+        def update(self, flair_list):
+            self.updated.extend(item['user'] for item in flair_list)
+            return [{'ok': True} for _ in flair_list]
+
+        def set(self, name, text, flair_template_id):
+            self.set_templates.append((name, text, flair_template_id))
+
+    class MockSubreddit:
+        def __init__(self):
+            self.flair = MockFlair()
+
+    # The flair looks right, but the Helper level's template may have changed
+    all_points = [('Arthur', 15), ('Bedevere', 5), ('Galahad', 20)]
+    current_flair = {'arthur': Flair('Expert', ''), 'bedevere': Flair('Helper', 'helper')}
+    changes = pointsbot.resync.find_changes(all_points, LEVELS, current_flair, {'template-helper': 'helper'},
+                                            is_moderator=lambda name: False, templates=True)
+    assert [name for name, _, _ in changes] == ['Bedevere', 'Galahad']
+
+    subreddit = MockSubreddit()
+    pointsbot.resync.push_changes(subreddit, changes, LEVELS, templates=True)
+    assert subreddit.flair.set_templates == [('Bedevere', 'Helper', 'template-helper')]
+    assert subreddit.flair.updated == ['Galahad']
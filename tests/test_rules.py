@@ -0,0 +1,63 @@
+from context import pointsbot
+
+### Data Structures ###
+
+
+class MockComment:
+    """A comment whose body is known, but which fails the test if anything else is looked up."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def __getattr__(self, name):
+        raise AssertionError(f'Comment attribute "{name}" should not be needed')
+
+
+### Tests ###
+
+
+def test_find_commands():
+    find_commands = pointsbot.bot.find_commands
+    assert find_commands(MockComment('Thanks, that worked!')) == set()
+    assert find_commands(MockComment('!helped')) == {'op_solved'}
+    assert find_commands(MockComment('/Helped /removepoint')) == {'mod_solved', 'mod_remove'}
+
+
+def test_comment_without_command_checks_no_rules():
+    comment = MockComment('Have you tried turning it off and on again?')
+    assert pointsbot.bot.marks_as_solved(comment) == (False, False, False)
+
+
+def test_rules_are_checked_cheapest_first():
+    for rules in pointsbot.bot.COMMAND_RULES.values():
+        costs = [rule.cost for rule in rules]
+        assert costs == sorted(costs)
+
+
+def test_find_missed_comments_stops_at_newest_saved_comment():
+
+    class MockDatabase:
+        path = 'mock.db'
+
+        def get_latest_comment_timestamp(self):
+            return 100
+
+        def get_latest_processed_comment_timestamp(self):
+            return None
+
+        def get_saved_comment_ids(self, comment_ids):
+            return {'c100'} & set(comment_ids)
+
+    class ListedComment:
+        def __init__(self, id, created_utc, body):
+            self.id = id
+            self.created_utc = created_utc
+            self.body = body
+
+    # Newest first, as listed by Reddit
+    comments = [ListedComment('c300', 300, '!helped'),
+                ListedComment('c200', 200, 'Thanks!'),
+                ListedComment('c100', 100, '!helped'),
+                ListedComment('c50', 50, '!helped')]
+    missed = pointsbot.bot.find_missed_comments(comments, MockDatabase())
+    assert [comm.id for comm in missed] == ['c300']
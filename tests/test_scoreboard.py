@@ -0,0 +1,68 @@
+import json
+import os.path
+import tempfile
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+from context import pointsbot
+
+### Data Structures ###
+
+MockRedditor = namedtuple('MockRedditor', 'id name')
+
+LEVELS = [pointsbot.level.Level('Novice', 1, None), pointsbot.level.Level('Expert', 5, None)]
+
+### Functions ###
+
+
+def get(server, path, etag=None):
+    host, port = server.httpd.server_address[:2]
+    request = urllib.request.Request(f'http://{host}:{port}{path}')
+    if etag:
+        request.add_header('If-None-Match', etag)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers.get('ETag'), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('ETag'), b''
+
+
+### Tests ###
+
+
+def test_scoreboard_serves_leaderboard_from_read_only_connection():
+    with tempfile.TemporaryDirectory() as dirname:
+        dbpath = os.path.join(dirname, 'pointsbot.db')
+        with pointsbot.database.Database(dbpath) as db:
+            arthur = MockRedditor('1', 'Arthur')
+            db.adjust_points(arthur, 3)
+            db.adjust_points(MockRedditor('2', 'Bedevere'), 1)
+
+            with pointsbot.scoreboard.Server(dbpath, LEVELS, 'test', port=0) as server:
+                status, etag, body = get(server, '/leaderboard.json')
+                assert status == 200
+                assert [entry['name'] for entry in json.loads(body)['entries']] == ['Arthur', 'Bedevere']
+                assert get(server, '/leaderboard.json', etag)[0] == 304
+
+                status, _, body = get(server, '/users/Arthur.json')
+                stats = json.loads(body)
+                assert (stats['rank'], stats['level'], stats['points_to_next_level']) == (1, 'Novice', 2)
+                assert get(server, '/users/Nobody.json')[0] == 404
+                assert get(server, '/leaderboard.json?page=0')[0] == 400
+
+                # A write by the bot invalidates the cached responses
+                db.adjust_points(arthur, 2)
+                status, new_etag, body = get(server, '/leaderboard.json', etag)
+                assert status == 200 and new_etag != etag
+                assert b'Arthur' in get(server, '/')[2]
+
+        # A read-only connection (like the scoreboard's) can't write
+        with pointsbot.database.Database(dbpath, read_only=True) as db:
+            assert db.get_points(arthur) == 5
+            try:
+                db.adjust_points(arthur, 1)
+            except pointsbot.database.sqlite.OperationalError:
+                pass
+            else:
+                assert False, 'a read-only connection should not be able to write'
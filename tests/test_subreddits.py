@@ -0,0 +1,120 @@
+import os.path
+import tempfile
+
+import pytest
+
+from context import pointsbot
+
+from benchmarks import fakes, pipeline
+
+### Globals ###
+
+CONFIG = '''
+[core]
+subreddit = "Alpha"
+valid_tags = "Java,Bedrock"
+
+[credentials]
+client_id = ""
+client_secret = ""
+username = "PointsBot"
+password = ""
+
+[filepaths]
+database = ""
+log = ""
+
+[links]
+feedback = "https://example.com/feedback"
+scoreboard = ""
+
+[[levels]]
+name = "Helper"
+points = 1
+
+[[subreddits]]
+name = "Beta"
+valid_tags = "Console"
+scoreboard = "https://example.com/beta"
+
+[[subreddits.levels]]
+name = "Beta Helper"
+points = 2
+
+[[subreddits]]
+name = "Gamma"
+'''
+
+### Functions ###
+
+
+def load_config(dirname, text=CONFIG):
+    path = os.path.join(dirname, 'pointsbot.toml')
+    with open(path, 'w') as f:
+        f.write(text)
+    return pointsbot.config.Config.from_toml(path)
+
+
+### Tests ###
+
+
+def test_subreddit_profiles_inherit_missing_settings():
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = load_config(dirname)
+        alpha, beta, gamma = cfg.profiles
+
+        assert alpha is cfg
+        assert beta.subreddit == 'Beta'
+        assert beta.tags == ['console']
+        assert [lvl.name for lvl in beta.levels] == ['Beta Helper']
+        assert beta.feedback_url == 'https://example.com/feedback'
+        assert beta.scoreboard_url == 'https://example.com/beta'
+        assert beta.database_path == os.path.join(dirname, 'pointsbot-beta.db')
+        assert beta.username == 'PointsBot'
+
+        assert gamma.tags == alpha.tags
+        assert gamma.levels is alpha.levels
+        assert len({profile.database_path for profile in cfg.profiles}) == 3
+
+        assert cfg.profile('gamma') is gamma
+        assert gamma.profiles == [gamma]
+        with pytest.raises(ValueError):
+            cfg.profile('Delta')
+
+
+def test_subreddits_can_only_be_configured_once():
+    with tempfile.TemporaryDirectory() as dirname:
+        with pytest.raises(ValueError):
+            load_config(dirname, CONFIG + '\n[[subreddits]]\nname = "alpha"\n')
+
+
+def test_combined_stream_is_handled_per_subreddit():
+    reddit = fakes.FakeReddit(fakes.Latency())
+    command_mix = fakes.CommandMix(0.2, 0.05, 0.05)
+    generators = [fakes.CommentGenerator(command_mix, seed=seed, subreddit_name=name, reddit=reddit)
+                  for seed, name in enumerate(['Alpha', 'Beta'])]
+    comments = [generator.next_comment() for _ in range(300) for generator in generators]
+    combined = fakes.FakeSubreddit('Alpha+Beta', [], reddit.latency)
+    combined.stream = fakes.FakeStream(comments)
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+
+    pipeline.clear_caches()
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = load_config(dirname)
+        with pointsbot.database.Database(cfg.profile('Alpha').database_path) as alpha_db, \
+                pointsbot.database.Database(cfg.profile('Beta').database_path) as beta_db:
+            communities = [
+                pointsbot.bot.Community(generators[0].subreddit, alpha_db, cfg.levels, cfg),
+                pointsbot.bot.Community(generators[1].subreddit, beta_db, cfg.profile('Beta').levels,
+                                        cfg.profile('Beta')),
+            ]
+            pointsbot.bot.monitor_comments(reddit, combined, communities, me, pipeline.NullSender())
+
+            for db, name, levels in [(alpha_db, 'Alpha', {'Helper'}), (beta_db, 'Beta', {'Beta Helper'})]:
+                items = db.get_due_outbox_items(1000, now=float('inf'))
+                assert items
+                assert {item['subreddit'] for item in items} == {name}
+                assert {item['flair_text'] for item in items if item['kind'] == 'flair'} <= levels
+                replied_to = {item['target'] for item in items if item['kind'] == 'reply'}
+                assert all(reddit.info_one(f't1_{target}').subreddit.display_name == name
+                           for target in replied_to)
@@ -0,0 +1,176 @@
+import os.path
+import tempfile
+from collections import namedtuple
+
+import praw
+import pytest
+
+from context import pointsbot
+
+from benchmarks import fakes, pipeline
+
+### Data Structures ###
+
+MockComment = namedtuple('MockComment', 'id link_id created_utc')
+
+### Functions ###
+
+
+def count_replies(db):
+    return len([item for item in db.get_due_outbox_items(1000, now=float('inf')) if item['kind'] == 'reply'])
+
+
+def handle_everything(reddit, communities, me, workers):
+    """Take turns claiming and handling items with each worker, until none are left."""
+    while True:
+        num_claimed = sum(pointsbot.workqueue.handle_claim(reddit, community, me, worker)
+                          for worker in workers for community in communities)
+        if not num_claimed:
+            return
+
+
+### Tests ###
+
+
+def test_submissions_are_leased_to_one_worker_at_a_time():
+    with tempfile.TemporaryDirectory() as dirname:
+        path = os.path.join(dirname, 'pointsbot.db')
+        with pointsbot.database.Database(path) as db_a, pointsbot.database.Database(path) as db_b:
+            comments = [MockComment('c1', 't3_s1', 1), MockComment('c2', 't3_s2', 2),
+                        MockComment('c3', 't3_s1', 3)]
+            assert db_a.add_work_items(comments, now=0) == 3
+            # Comments already in the queue are skipped
+            assert db_a.add_work_items(comments[:1], now=0) == 0
+
+            claimed = db_a.claim_work_items('a', 1, lease_duration=60, now=100)
+            assert [item['comment_id'] for item in claimed] == ['c1']
+            # Only the other submission is left for another worker, until the lease expires
+            claimed = db_b.claim_work_items('b', 10, lease_duration=60, now=100)
+            assert [item['comment_id'] for item in claimed] == ['c2']
+            assert db_b.claim_work_items('c', 10, lease_duration=60, now=110) == []
+
+            # A renewed lease is kept, while an expired one is reclaimed
+            assert db_a.renew_work_lease('s1', 'a', lease_duration=60, now=150)
+            claimed = db_b.claim_work_items('c', 10, lease_duration=60, now=200)
+            assert [item['comment_id'] for item in claimed] == ['c2']
+            claimed = db_b.claim_work_items('c', 10, lease_duration=60, now=300)
+            assert [item['comment_id'] for item in claimed] == ['c1', 'c2', 'c3']
+            assert not db_a.renew_work_lease('s1', 'a', lease_duration=60, now=300)
+
+            assert db_b.finish_work_item('c1', 'done', now=300) == 1
+            assert db_b.count_pending_work_items() == 2
+            assert db_b.delete_finished_work_items(before=400) == 1
+            assert db_b.get_latest_work_item_timestamp() == 3
+
+
+def test_workers_award_each_point_exactly_once(monkeypatch):
+    command_mix = fakes.CommandMix(0.2, 0.05, 0.05)
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+
+    # The same comments, handled in a single process...
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(500, command_mix)
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            pointsbot.bot.monitor_comments(reddit, subreddit, [community], me, pipeline.NullSender())
+            expected_points = sorted(map(tuple, db.get_all_points()))
+            # Flair updates may differ, since commands for different submissions may be handled in a
+            # different order
+            expected_replies = count_replies(db)
+            assert expected_points and expected_replies
+
+    # ...and by two workers sharing a work queue
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(500, command_mix)
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db_a, \
+                pointsbot.database.Database(cfg.database_path) as db_b:
+            by_name = {'benchmark': pointsbot.bot.Community(subreddit, db_a, cfg.levels, cfg)}
+            assert pointsbot.workqueue.enqueue(by_name, comments) > 0
+            monkeypatch.setattr(pointsbot.workqueue, 'CLAIM_SIZE', 7)
+            communities = [pointsbot.bot.Community(subreddit, db, cfg.levels, cfg) for db in (db_a, db_b)]
+            handle_everything(reddit, communities, me, ['a', 'b'])
+
+            assert db_a.count_pending_work_items() == 0
+            assert sorted(map(tuple, db_a.get_all_points())) == expected_points
+            assert count_replies(db_a) == expected_replies
+
+
+def test_comments_already_handled_are_not_queued_again():
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(300, fakes.CommandMix(0.2, 0.05, 0.05))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            assert pointsbot.workqueue.enqueue({'benchmark': community}, comments) > 0
+            handle_everything(reddit, [community], me, ['a'])
+            num_replies = count_replies(db)
+
+            # Once the finished items are deleted, the comments read again after reconnecting are still
+            # known to have been handled
+            db.delete_finished_work_items(before=float('inf'))
+            assert pointsbot.workqueue.enqueue({'benchmark': community}, comments[200:]) == 0
+            assert db.count_pending_work_items() == 0
+            assert count_replies(db) == num_replies
+
+
+def test_worker_that_lost_its_lease_saves_nothing():
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(300, fakes.CommandMix(1.0, 0, 0))
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            pointsbot.workqueue.enqueue({'benchmark': community}, comments)
+            item = db.claim_work_items('a', 1, lease_duration=-1)[0]
+            comm = reddit.info_one(f't1_{item["comment_id"]}')
+
+            with pytest.raises(pointsbot.workqueue.LeaseLost):
+                pointsbot.workqueue.handle_item(community, me, 'a', item, comm)
+            assert db.get_due_outbox_items(10, now=float('inf')) == []
+            assert db.count_pending_work_items() == len([comm for comm in comments
+                                                         if pointsbot.bot.find_commands(comm)])
+
+
+def test_submission_waits_for_an_item_to_be_retried(monkeypatch):
+    pipeline.clear_caches()
+    reddit, subreddit, comments = fakes.generate(100, fakes.CommandMix(1.0, 0, 0), num_submissions=5)
+    me = pointsbot.bot.Identity('0', 'PointsBot')
+    with tempfile.TemporaryDirectory() as dirname:
+        cfg = pipeline.make_config(dirname)
+        with pointsbot.database.Database(cfg.database_path) as db:
+            community = pointsbot.bot.Community(subreddit, db, cfg.levels, cfg)
+            pointsbot.workqueue.enqueue({'benchmark': community}, comments)
+            first = db.conn.execute('SELECT comment_id, submission_id FROM work_item ORDER BY rowid').fetchone()
+
+            # Reddit fails once for the first item
+            classify = pointsbot.bot.classify
+            errors = []
+
+            def classify_unless_failing(comm, cfg, me):
+                if comm.id == first['comment_id'] and not errors:
+                    errors.append(comm.id)
+                    raise praw.exceptions.RedditAPIException([['RATELIMIT', 'Try again later', None]])
+                return classify(comm, cfg, me)
+
+            monkeypatch.setattr(pointsbot.bot, 'classify', classify_unless_failing)
+            pointsbot.workqueue.handle_claim(reddit, community, me, 'a')
+
+            statuses = db.conn.execute('SELECT submission_id, status, attempts FROM work_item ORDER BY rowid')
+            by_submission = {}
+            for submission_id, status, attempts in statuses:
+                by_submission.setdefault(submission_id, []).append((status, attempts))
+            # None of the submission's later items were handled before the failed one
+            failed_submission = by_submission.pop(first['submission_id'])
+            assert failed_submission[0] == ('pending', 1)
+            assert len(failed_submission) > 1 and set(failed_submission[1:]) == {('pending', 0)}
+            assert all(status == 'done' for items in by_submission.values() for status, _ in items)
+
+            handle_everything(reddit, [community], me, ['a'])
+            assert db.count_pending_work_items() == 0